@@ -3,23 +3,27 @@ import sys
 import logging
 from datetime import datetime
 import platform
+import threading
+import traceback
 
-# application specific libraries
-from pylibdmtx.pylibdmtx import decode
-from cv2 import cv2
-import numpy as np
+# OpenCV, numpy and pylibdmtx are imported when the camera is first used, and requests with the Digi-Key API in the
+# background, as they take most of the startup time
 
 # GUI
 import wx
+import wx.grid
 from Inventory_GUI import MainFrame
-from custom_dialogs import ViewResultDialog, CheckoutDialog
+from custom_dialogs import ViewResultDialog, CheckoutDialog, CheckinDialog, BatchIntakeDialog
 
 # database interface
 from dbinterface import ItemRecord
-from dbinterface import DbInterface
+from dbinterface import SearchPage
+from dbinterface import STAGING_PENDING, STAGING_FAILED
+from results_grid import ResultsGridTable
+from app_startup import connect_database, start_backup_service, first_results_page, start_live_search
 
-# Digi-Key API interface
-from dkinterface import DKAPIInterface
+# batch intake of scanned codes
+from batch_intake import BatchIntake, item_from_barcode_response, item_from_dmtx_local
 
 if platform.system() == "Windows":
     import winsound  # Windows only!
@@ -42,41 +46,77 @@ class InventoryFrame(MainFrame):
         self.frame_width = None
         self.frame_bmp = None
         self.camera_timer = None
-        self.Bind(wx.EVT_TIMER, self.process_frame)  # bind the method for processing camera frames
+        self.scan_pipeline = None  # captures and decodes frames on worker threads
+        self.Bind(wx.EVT_TIMER, self.process_frame)  # bind the method for displaying camera frames
 
-        # do a camera scan
+        # do a camera scan, in the background as each camera can take a while to respond
+        self.cameras = []  # CameraInfo of the cameras in the drop-down box
+        self.camera_scan_thread = None
         self.btn_update_cam_list(None)
 
         # object to pass around the raw data matrix bytes without going through the GUI
         self.dmtx_bytes = None
 
         # database objects
-        self.db = DbInterface()
-        self.db.connect()
+        self.db = connect_database()
+        self.backup_service = start_backup_service()  # scheduled snapshots of the database
 
-        # Digi-Key API interface
-        self.dk_api = DKAPIInterface(auth_complete_callback=self.auth_complete)
-        if self.dk_api.auth_valid:
-            self.update_auth_status(auth_valid=True)
+        # Digi-Key API interface, set up in the background as refreshing the tokens may need the network
+        self.dk_api = None
+        self.dk_api_thread = threading.Thread(target=self.init_dk_api, name="dk_api", daemon=True)
+        self.dk_api_thread.start()
 
         # on_close handler
         self.Bind(wx.EVT_CLOSE, self.on_close)
 
+        # back the results grid with a virtual table, so cells are only produced for the rows being shown
+        self.results_table = ResultsGridTable()
+        self.grid_results.SetTable(self.results_table, True, wx.grid.Grid.SelectRows)
+        self.grid_results.EnableEditing(False)
+
         # resize the grid columns to fit text
         self.grid_results.AutoSizeColumns()
         self.grid_results.SetColSize(6, 200)
         self.grid_results.SetColSize(8, 150)
 
-        # object to keep track of the search results
-        self.search_results = None  # should be a list of ItemRecords when populated
-
-        # initialise dialogues
-        self.dialog_view_result = ViewResultDialog(parent=self)
-        self.dialog_checkout = CheckoutDialog(parent=self)
+        # number of matches of the search shown, at the start of the row of buttons under the grid
+        self.label_result_count = wx.StaticText(self.notebook_main_Search, wx.ID_ANY, "")
+        self.label_result_count.SetFont(self.button_view.GetFont())
+        self.button_view.GetContainingSizer().Insert(0, self.label_result_count, 0,
+                                                     wx.ALIGN_CENTER_VERTICAL | wx.ALL, 5)
+
+        # explain the exact and prefix matches of the advanced search
+        for text_ctrl in [self.text_ctrl_adv_search_1, self.text_ctrl_adv_search_2, self.text_ctrl_adv_search_3]:
+            text_ctrl.SetToolTip('"text" matches the whole field, text* matches the start of it, '
+                                 'anything else matches anywhere in it')
+
+        # dialogues, built the first time they're needed by get_dialog()
+        self.dialogs = {}
+
+        # batch intake mode: scans are looked up in the background and reviewed together.
+        # The controls are added next to the camera buttons
+        self.checkbox_batch = wx.CheckBox(self.notebook_main_Scan, wx.ID_ANY, "Batch intake")
+        self.button_batch_review = wx.Button(self.notebook_main_Scan, wx.ID_ANY, "Review Batch...")
+        self.checkbox_batch.SetFont(self.button_camera.GetFont())
+        self.button_batch_review.SetFont(self.button_camera.GetFont())
+        sizer_camera = self.button_camera.GetContainingSizer()
+        sizer_camera.Add(self.checkbox_batch, 0, wx.ALIGN_CENTER | wx.BOTTOM | wx.LEFT | wx.RIGHT, 5)
+        sizer_camera.Add(self.button_batch_review, 1, wx.BOTTOM | wx.EXPAND | wx.LEFT | wx.RIGHT, 5)
+        self.notebook_main_Scan.Layout()
+        self.Bind(wx.EVT_BUTTON, self.btn_batch_review, self.button_batch_review)
+        self.batch_last_code = None  # the code queued last, which is likely still in front of the camera
+        self.batch_intake = BatchIntake(resolve=self.resolve_code,
+                                        on_resolved=lambda dmtx, item, error: wx.CallAfter(self.batch_code_resolved,
+                                                                                           dmtx, item, error))
 
         # fill in the display area with some entries in the DB
-        rows = self.db.get_all()
-        self.populate_results(rows=rows)
+        self.populate_results(page=first_results_page(self.db),
+                              next_page=lambda cursor: self.db.get_all(cursor=cursor, summary=True))
+
+        # search as the user types in the basic search box
+        self.live_search = start_live_search(
+            self.db, on_results=lambda keyword, page: wx.CallAfter(self.live_search_results, keyword, page))
+        self.text_ctrl_basic_search.Bind(wx.EVT_TEXT, self.text_basic_search_changed)
 
     def get_fields(self) -> ItemRecord:
         return ItemRecord(
@@ -113,39 +153,45 @@ class InventoryFrame(MainFrame):
     def btn_update_cam_list(self, event):
         """
         Scans for connected cameras and update the drop-down box in the GUI accordingly.
-        :param event: event object from button clicking
+        The cameras are probed on a background thread, and the drop-down box is filled in when it's done.
+        At startup the cameras found last time are used, unless the devices connected have changed
+        :param event: event object from button clicking, None at startup
         :return: None
         """
-        scan_range = 5
-
-        # iterate through the scan range
-        index = 0
-        devices = [False] * scan_range  # True means a camera is present at the index
-        while True:
-            cap = cv2.VideoCapture(index, cv2.CAP_DSHOW)
-            if not cap.read()[0]:  # try to read one frame, failed to read
-                devices[index] = False
-            else:
-                devices[index] = True
-            cap.release()
-            index += 1
-            if index == scan_range:
-                break
-
-        # update GUI
+        if self.camera_scan_thread is not None and self.camera_scan_thread.is_alive():
+            return  # already scanning
+        self.camera_scan_thread = threading.Thread(target=self.scan_cameras, args=(event is not None,),
+                                                   name="camera_scan", daemon=True)
+        self.camera_scan_thread.start()
+
+    def scan_cameras(self, refresh: bool):
+        """
+        Runs on a background thread
+        :param refresh: True to probe the cameras again, False to use the cached list if it's up to date
+        :return: None
+        """
+        from camera_discovery import discover_cameras
+
+        wx.CallAfter(self.update_cam_list, discover_cameras(refresh=refresh))
+
+    def update_cam_list(self, cameras: list):
+        """
+        :param cameras: CameraInfo of each camera found
+        :return: None
+        """
+        self.cameras = cameras
         self.choice_camera.Clear()
-        if True in devices:  # has at least one camera connected
-            for i in range(scan_range):
-                if devices[i]:
-                    self.choice_camera.Append("{}".format(i))  # add to the combo box
+        if len(cameras) > 0:  # has at least one camera connected
+            for camera in cameras:
+                self.choice_camera.Append(camera.label())  # add to the combo box
             # set the first camera as selected
             self.choice_camera.SetSelection(0)
 
     def btn_enable_camera(self, event):
         if self.camera_on is False:  # camera not on, turn it on
             # get camera number from the combo box
-            cam_num = self.choice_camera.GetStringSelection()
-            if cam_num == "":  # no selection
+            selection = self.choice_camera.GetSelection()
+            if selection == wx.NOT_FOUND:  # no selection
                 if self.choice_camera.IsListEmpty():  # no camera detected or connected
                     self.show_modal_dialog(message="No cameras detected! "
                                                    "If a new camera is connected, are the drivers installed?"
@@ -157,9 +203,14 @@ class InventoryFrame(MainFrame):
                     # when the camera list is updated
                     print("This isn't supposed to happen - no camera selected")
             else:  # a camera number is selected, proceed
-                self.camera_cap = cv2.VideoCapture(int(cam_num), cv2.CAP_DSHOW)
-                # CAP_DSHOW - direct show. Removes this warning:
-                # https://stackoverflow.com/questions/59596748/warn0-global-sourcereadercbsourcereadercb-terminating-async-callback-wa
+                from camera_discovery import open_camera
+                from capture_profile import camera_profile, apply_capture_profile
+                from scan_pipeline import ScanPipeline
+
+                camera = self.cameras[selection]
+                self.camera_cap = open_camera(camera)
+                print("Camera {} set to {}".format(camera.label(),
+                                                   apply_capture_profile(self.camera_cap, camera_profile(camera))))
                 self.button_camera.SetLabel("Disable Camera")
                 self.camera_on = True
 
@@ -171,11 +222,20 @@ class InventoryFrame(MainFrame):
 
                     self.camera_timer = wx.Timer(self)  # used to update the camera view
                     self.camera_timer.Start(1000. / FRAME_RATE)
+
+                    # results come back from the decode thread, pass them onto the GUI thread
+                    self.scan_pipeline = ScanPipeline(camera_cap=self.camera_cap,
+                                                      on_decoded=lambda dmtx: wx.CallAfter(self.process_code, dmtx),
+                                                      frame_budget=1000. / FRAME_RATE)
+                    self.scan_pipeline.start()
                 else:
                     print("Error no camera image")
         else:  # camera is on, turn it off
             self.camera_timer.Stop()
             self.camera_timer = None
+            if self.scan_pipeline is not None:
+                self.scan_pipeline.stop()
+                self.scan_pipeline = None
             self.camera_cap.release()
             self.camera_on = False
             self.button_camera.SetLabel("Enable Camera")
@@ -205,16 +265,10 @@ class InventoryFrame(MainFrame):
             # the item has a data matrix code associated with it
             item.dmtx = self.dmtx_bytes
             item.has_dmtx = True
-
-            # check if it's already in the database
-            test_item = self.db.get_item_by_code(item.dmtx)
-            if test_item is None:  # not in the DB
-                self.db.add_component(item=item)
-            else:
-                self.db.update_component(item=item)
-        else:  # the item doesn't have a data matrix code
+        else:  # the item doesn't have a data matrix code, one is assigned when saving
             item.has_dmtx = False
-            self.db.add_component(item=item)
+        # added if it's not in the database yet, updated otherwise
+        self.db.bulk_upsert(items=[item])
         self.btn_cancel(event=None)
 
     def btn_cancel(self, event):
@@ -222,20 +276,92 @@ class InventoryFrame(MainFrame):
         self.button_delete.Disable()
         if self.camera_timer is not None:
             self.camera_timer.Start(1000. / FRAME_RATE)  # resume camera if it was running
+        if self.scan_pipeline is not None:
+            self.scan_pipeline.resume_decoding()
 
     def btn_auth(self, event):
-        if self.dk_api.auth_valid:  # no need to authorise
+        if self.dk_api_thread.is_alive():  # waiting for it here would freeze the window until the network answers
+            self.show_modal_dialog(message="Still connecting to Digi-Key, try again in a moment.",
+                                   caption="Info",
+                                   style=wx.OK | wx.ICON_INFORMATION)
+            return
+        dk_api = self.dk_api
+        if dk_api is None:
+            self.show_modal_dialog(message="The Digi-Key API is not set up, see the console for the error.",
+                                   caption="Error",
+                                   style=wx.OK | wx.ICON_ERROR)
+            return
+        if dk_api.auth_valid:  # no need to authorise
             self.show_modal_dialog(message="Already authorised.",
                                    caption="Info",
                                    style=wx.OK | wx.ICON_INFORMATION)
             self.update_auth_status(auth_valid=True)
         else:
-            self.dk_api.authorise()
+            dk_api.authorise()
+
+    def init_dk_api(self):
+        """
+        Sets up the Digi-Key API interface and checks the tokens. Runs on a background thread
+        :return: None
+        """
+        try:
+            from dkinterface import DKAPIInterface
+            self.dk_api = DKAPIInterface(auth_complete_callback=lambda: wx.CallAfter(self.auth_complete))
+        except SystemExit:  # no Digi-Key app set up, the user was asked to create one
+            wx.CallAfter(self.Close)
+            return
+        except Exception as e:  # e.g. a broken config file. The rest of the app works without the API
+            print("Failed to set up the Digi-Key API: {}".format(e))
+            traceback.print_exc()
+            wx.CallAfter(self.dk_api_failed, e)
+            return
+        wx.CallAfter(self.update_auth_status, self.dk_api.auth_valid)
+
+    def dk_api_failed(self, error: Exception):
+        self.update_auth_status(auth_valid=False)
+        self.show_modal_dialog(message="Failed to set up the Digi-Key API, codes can only be decoded locally:\n"
+                                       "{}".format(error),
+                               caption="Error",
+                               style=wx.OK | wx.ICON_ERROR)
+
+    def get_dk_api(self):
+        """
+        Waits for the Digi-Key API to be set up if needed, so only call it from a background thread
+        :return: the DKAPIInterface object, None if it failed
+        """
+        self.dk_api_thread.join()
+        return self.dk_api
+
+    def get_dialog(self, dialog_class):
+        """
+        Builds a dialogue the first time it's needed, then reuses it
+        :param dialog_class: one of the dialogue classes in custom_dialogs
+        :return: the dialogue object
+        """
+        if dialog_class not in self.dialogs:
+            self.dialogs[dialog_class] = dialog_class(parent=self)
+        return self.dialogs[dialog_class]
+
+    def batch_dialog_shown(self) -> bool:
+        return BatchIntakeDialog in self.dialogs and self.dialogs[BatchIntakeDialog].IsShown()
 
     def btn_search_basic(self, event):
         keyword = self.text_ctrl_basic_search.GetValue()
-        rows = self.db.basic_search(keyword=keyword)
-        self.populate_results(rows=rows)
+        page = self.db.basic_search(keyword=keyword, summary=True)
+        self.populate_results(page=page,
+                              next_page=lambda cursor: self.db.basic_search(keyword=keyword, cursor=cursor,
+                                                                            summary=True))
+
+    def text_basic_search_changed(self, event):
+        self.live_search.update(keyword=self.text_ctrl_basic_search.GetValue())
+        event.Skip()
+
+    def live_search_results(self, keyword: str, page: SearchPage):
+        if keyword != self.text_ctrl_basic_search.GetValue():  # typed on since
+            return
+        self.populate_results(page=page,
+                              next_page=lambda cursor: self.db.basic_search(keyword=keyword, cursor=cursor,
+                                                                            summary=True))
 
     def btn_search_adv(self, event):
         # collect input field contents
@@ -271,21 +397,61 @@ class InventoryFrame(MainFrame):
                 if i > 0:
                     logics_for_search += [self.choice_logic_1.GetString(logics[i - 1])]
 
-        rows = self.db.advanced_search(cols=cols_for_search, inputs=inputs_for_search, logics=logics_for_search)
-        self.populate_results(rows=rows)
+        page = self.db.advanced_search(cols=cols_for_search, inputs=inputs_for_search, logics=logics_for_search,
+                                       summary=True)
+        self.populate_results(page=page,
+                              next_page=lambda cursor: self.db.advanced_search(cols=cols_for_search,
+                                                                               inputs=inputs_for_search,
+                                                                               logics=logics_for_search,
+                                                                               cursor=cursor,
+                                                                               summary=True))
+
+    def get_selected_item(self):
+        """
+        :return: the full record of the row selected in the results grid, or None if it's been deleted since
+        """
+        selected_row = self.grid_results.GetSelectedRows()[0]
+        item = self.db.get_full_item(item=self.results_table.get_item(row=selected_row))
+        if item is None:
+            print("The selected item is no longer in the database.")
+        return item
 
     def btn_view_result(self, event):
         # get info about the selected component
-        selected_row = self.grid_results.GetSelectedRows()[0]
-        selected_item = self.search_results[selected_row]
-        self.dialog_view_result.setup(item_to_show=selected_item, db=self.db)
-        self.dialog_view_result.ShowModal()
+        selected_item = self.get_selected_item()
+        if selected_item is None:
+            return
+        dialog = self.get_dialog(ViewResultDialog)
+        dialog.setup(item_to_show=selected_item, db=self.db)
+        dialog.ShowModal()
 
     def btn_checkout(self, event):
+        selected_item = self.get_selected_item()
+        if selected_item is None:
+            return
+        dialog = self.get_dialog(CheckoutDialog)
+        dialog.setup(db=self.db, item=selected_item)
+        dialog.ShowModal()
+        self.update_selected_quantity(quantity=selected_item.quantity)
+
+    def btn_checkin(self, event):
+        selected_item = self.get_selected_item()
+        if selected_item is None:
+            return
+        dialog = self.get_dialog(CheckinDialog)
+        dialog.setup(db=self.db, item=selected_item)
+        dialog.ShowModal()
+        self.update_selected_quantity(quantity=selected_item.quantity)
+
+    def update_selected_quantity(self, quantity: int) -> None:
+        """
+        Shows the quantity left after a checkout or check-in in the results grid, without searching again
+        :param quantity: the new quantity of the selected item
+        :return: None
+        """
         selected_row = self.grid_results.GetSelectedRows()[0]
-        selected_item = self.search_results[selected_row]
-        self.dialog_checkout.setup(db=self.db, item=selected_item)
-        self.dialog_checkout.ShowModal()
+        self.results_table.get_item(row=selected_row).quantity = quantity
+        self.grid_results.ForceRefresh()
 
     def btn_delete(self, event):
         dlg = wx.MessageDialog(parent=self,
@@ -299,8 +465,9 @@ class InventoryFrame(MainFrame):
             print("Deleted item.")
 
     def btn_edit(self, event):
-        selected_row = self.grid_results.GetSelectedRows()[0]
-        selected_item: ItemRecord = self.search_results[selected_row]
+        selected_item: ItemRecord = self.get_selected_item()
+        if selected_item is None:
+            return
         self.set_fields(item=selected_item)
         self.dmtx_bytes = selected_item.dmtx
         self.check_deletable()
@@ -340,7 +507,14 @@ class InventoryFrame(MainFrame):
             self.grid_results.ClearSelection()
             self.grid_results.SelectRow(row=selected_rows[-1])  # pick the last one in the selected rows
 
-    def populate_results(self, rows: list):
+    def populate_results(self, page: SearchPage, next_page):
+        """
+        Shows the first page of a search in the results grid.
+        Further pages are loaded by the grid table as the user scrolls down.
+        :param page: the first page of the search results
+        :param next_page: function taking a continuation token and returning the next page of the same search
+        :return: None
+        """
         # when this function is called, the row selection is lost.
         # Therefore, disable the buttons that need a row selected
         self.button_view.Disable()
@@ -348,27 +522,11 @@ class InventoryFrame(MainFrame):
         self.button_checkin.Disable()
         self.button_edit.Disable()
 
-        self.search_results = rows
-
-        row_count = self.grid_results.GetNumberRows()
-        new_row_count = len(rows)
-        if row_count > 0:
-            self.grid_results.DeleteRows(numRows=row_count)
-        self.grid_results.InsertRows(numRows=new_row_count)
-        for i in range(new_row_count):
-            item: ItemRecord = rows[i]
-            self.grid_results.SetCellValue(i, 0, str(item.name))
-            self.grid_results.SetCellValue(i, 1, str(item.supplier_pn))
-            self.grid_results.SetCellValue(i, 2, str(item.manufacturer_pn))
-            self.grid_results.SetCellValue(i, 3, str(item.location))
-            self.grid_results.SetCellValue(i, 4, str(item.quantity))
-            self.grid_results.SetCellValue(i, 5, str(item.category))
-            self.grid_results.SetCellValue(i, 6, str(item.description))
-            self.grid_results.SetCellValue(i, 7, str(item.supplier))
-            self.grid_results.SetCellValue(i, 8, str(item.manufacturer))
-            self.grid_results.SetCellValue(i, 9, str(item.used_by_proj))
-            self.grid_results.SetCellValue(i, 10, str(item.customer_ref))
-            self.grid_results.SetCellValue(i, 11, str(item.comment))
+        self.grid_results.ClearSelection()
+        self.results_table.set_results(page=page, next_page=next_page)
+        self.grid_results.Scroll(0, 0)  # back to the top for the new results
+        self.label_result_count.SetLabel(page.describe_total())
+        self.notebook_main_Search.Layout()
 
     def radiobox_decode_handler(self, event):
         user_selection = self.radio_box_decode.GetSelection()
@@ -384,7 +542,7 @@ class InventoryFrame(MainFrame):
             self.label_auth_status.Enable()
             self.button_auth.Enable()
 
-    def auth_complete(self):  # callback function that gets called from dkinterface
+    def auth_complete(self):  # callback function that gets called from dkinterface, through wx.CallAfter
         self.update_auth_status(auth_valid=self.dk_api.auth_valid)
 
     def update_auth_status(self, auth_valid=False):
@@ -400,56 +558,55 @@ class InventoryFrame(MainFrame):
         dialog.Destroy()  # may not need
 
     def process_frame(self, event):
-        ret, self.camera_frame = self.camera_cap.read()
-        if ret:
-            # do some conditioning magic:
-            # convert to grayscale. This seems to work the best compared to coloured and black & white
-            gray = cv2.cvtColor(self.camera_frame, cv2.COLOR_BGR2GRAY)
-
-            data_raw = decode(gray, timeout=50, max_count=1)  # 50ms timeout
-            if len(data_raw) > 0:  # got a string
-                self.camera_timer.Stop()  # stop camera frame acquisition and display
-                if platform.system() == "Windows":
-                    winsound.Beep(2500, 200)  # short beep
-                self.dmtx_bytes = data_raw[0].data
-                print("Success!")
-                print(self.dmtx_bytes)
-
-                # check if the code is present in the DB
-                item: ItemRecord = self.db.get_item_by_code(dmtx=self.dmtx_bytes)
-                if item is not None:  # the item is present in the DB
-                    print("Item is present in the DB")
-                    self.set_fields(item=item)
-                    self.check_deletable()
-                else:
-                    # find info without the DigiKey API in local mode
-                    if self.radio_box_decode.GetSelection() == 0:
-                        mfg_pn_start = self.dmtx_bytes.find(b"\x1d1P")  # manufacturer's P/N begins with this sequence
-                        mfg_pn_end = self.dmtx_bytes.find(b"\x1d", mfg_pn_start + 1)
-                        mfg_pn = str(self.dmtx_bytes[mfg_pn_start + 3: mfg_pn_end])  # skip the \x1d1P
-                        mfg_pn = mfg_pn[2:-1]  # trim out the b'' from bytes to str conversion
-
-                        qty_start = self.dmtx_bytes.find(b"\x1dQ")  # quantity
-                        qty_end = self.dmtx_bytes.find(b"\x1d", qty_start + 1)  # same as above
-                        qty = str(self.dmtx_bytes[qty_start + 2: qty_end])
-                        qty = qty[2:-1]
-
-                        # fill in the GUI fields
-                        self.text_ctrl_manufacturer_pn.SetLabel(mfg_pn)
-                        self.text_ctrl_qty.SetLabel(qty)
+        # frames are captured and decoded in the scan pipeline, only the display is done here
+        gray = self.scan_pipeline.get_latest_frame()
+        if gray is not None:
+            self.redraw_camera(gray_frame=gray)
 
-                    if self.radio_box_decode.GetSelection() == 1:  # using Digi-Key API
-                        self.get_component_info_web(dmtx_bytes=self.dmtx_bytes)
+    def process_code(self, dmtx_bytes: bytes):
+        """
+        Handles a data matrix code read by the scan pipeline. Decoding stays paused until the user saves or cancels.
+        :param dmtx_bytes: raw bytes in the code
+        :return: None
+        """
+        if not self.camera_on:  # decoded just before the camera was turned off
+            return
+        if self.checkbox_batch.GetValue():  # queue it up and carry on scanning
+            self.queue_batch_code(dmtx_bytes=dmtx_bytes)
+            self.scan_pipeline.resume_decoding()
+            return
+        self.camera_timer.Stop()  # stop the camera display on the frame with the code
+        if platform.system() == "Windows":
+            winsound.Beep(2500, 200)  # short beep
+        self.dmtx_bytes = dmtx_bytes
+        print("Success!")
+        print(self.dmtx_bytes)
+
+        # check if the code is present in the DB
+        item: ItemRecord = self.db.get_item_by_code(dmtx=self.dmtx_bytes)
+        if item is not None:  # the item is present in the DB
+            print("Item is present in the DB")
+            self.set_fields(item=item)
+            self.check_deletable()
+        else:
+            # find info without the DigiKey API in local mode
+            if self.radio_box_decode.GetSelection() == 0:
+                item = item_from_dmtx_local(dmtx_bytes=self.dmtx_bytes)
 
-                # flush the camera frames a bit
-                for i in range(20):
-                    self.camera_cap.read()
+                # fill in the GUI fields
+                self.text_ctrl_manufacturer_pn.SetLabel(item.manufacturer_pn)
+                self.text_ctrl_qty.SetLabel(str(item.quantity))
+                if item.supplier_pn != "":  # only on some labels
+                    self.text_ctrl_supplier_pn.SetLabel(item.supplier_pn)
+                if item.manufacturer != "":
+                    self.text_ctrl_manufacturer.SetLabel(item.manufacturer)
 
-            self.redraw_camera(gray_frame=gray)
-        else:
-            print("Failed to read the camera frame...")
+            if self.radio_box_decode.GetSelection() == 1:  # using Digi-Key API
+                self.get_component_info_web(dmtx_bytes=self.dmtx_bytes)
 
     def redraw_camera(self, gray_frame):
+        import numpy as np
+
         self.camera_frame = np.stack((gray_frame,) * 3, axis=-1)  # convert grayscale image to RGB format to display
 
         try:
@@ -461,41 +618,48 @@ class InventoryFrame(MainFrame):
 
     def get_component_info_web(self, dmtx_bytes: bytes):
         """
-        Retrieves component details using Digi-Key's API
+        Retrieves component details using Digi-Key's API, on a background thread so a slow or throttled response
+        doesn't freeze the window. The fields are filled in by web_lookup_done()
         :param dmtx_bytes: original data from the data matrix code
-        :return: the component information in a dictionary
+        :return: None
         """
-        api_success, barcode2d_resp = self.dk_api.product_2d_barcode(dmtx_bytes=dmtx_bytes)
+        wx.BeginBusyCursor()
+        threading.Thread(target=self.web_lookup, args=(dmtx_bytes,), name="web_lookup", daemon=True).start()
 
-        if api_success:  # OK
+    def web_lookup(self, dmtx_bytes: bytes):
+        """
+        Looks up a code with the Digi-Key API. Runs on a background thread
+        :param dmtx_bytes: original data from the data matrix code
+        :return: None
+        """
+        dk_api = self.get_dk_api()
+        if dk_api is None:
+            wx.CallAfter(self.web_lookup_done, dmtx_bytes, False, None)
+            return
+        api_success, barcode2d_resp = dk_api.product_2d_barcode(dmtx_bytes=dmtx_bytes)
+        wx.CallAfter(self.web_lookup_done, dmtx_bytes, api_success, barcode2d_resp)
+
+    def web_lookup_done(self, dmtx_bytes: bytes, api_success: bool, barcode2d_resp):
+        """
+        :param dmtx_bytes: the code looked up
+        :param api_success: True if the information was found
+        :param barcode2d_resp: response from DKAPIInterface.product_2d_barcode(), None if the API isn't set up
+        :return: None
+        """
+        wx.EndBusyCursor()
+        if dmtx_bytes != self.dmtx_bytes:  # cancelled, or another code scanned, while looking it up
+            return
+
+        if barcode2d_resp is None:
+            self.show_modal_dialog(message="The Digi-Key API is not set up, try local decode mode.",
+                                   caption="Error",
+                                   style=wx.OK | wx.ICON_ERROR)
+            self.btn_cancel(None)
+        elif api_success:  # OK
             resp_json = barcode2d_resp.json()
 
             # fill in the GUI
-            desc = resp_json["ProductDescription"]
-            item = ItemRecord(
-                has_dmtx=True,
-                pn=resp_json["DigiKeyPartNumber"],
-                desc=desc,
-                mfg_pn=resp_json["ManufacturerPartNumber"],
-                # take the first word in the description as the category; this will work in most cases
-                cat=desc.split()[0],
-                manufacturer=resp_json["ManufacturerName"],
-                qty=resp_json["Quantity"],
-                comment="Sales Order ID: {}".format(resp_json["SalesorderId"])
-            )
-
-            # check if customer reference is present
-            # customer reference if present, otherwise Digi-Key part number
-            cust_ref_start = self.dmtx_bytes.find(b"\x1dP")
-            cust_ref_end = self.dmtx_bytes.find(b"\x1d", cust_ref_start + 1)
-            cust_ref = str(self.dmtx_bytes[cust_ref_start + 2: cust_ref_end])
-            cust_ref = cust_ref[2:-1]  # trim out the b'' characters
-            if cust_ref != item.supplier_pn:  # customer reference is present
-                item.customer_ref = cust_ref
-
-            # fill in the supplier field as Digi-Key
-            item.supplier = "Digi-Key"
-
+            item = item_from_barcode_response(resp_json=resp_json, dmtx_bytes=dmtx_bytes)
             self.set_fields(item=item, skip_loc=True)
 
             print("Full response:")
@@ -509,6 +673,64 @@ class InventoryFrame(MainFrame):
                                    style=wx.OK | wx.ICON_ERROR)
             self.btn_cancel(None)
 
+    def queue_batch_code(self, dmtx_bytes: bytes):
+        """
+        Stages a code scanned in batch intake mode and starts looking it up in the background
+        :param dmtx_bytes: raw bytes in the code
+        :return: None
+        """
+        if dmtx_bytes == self.batch_last_code:  # same bag still in front of the camera
+            return
+        self.batch_last_code = dmtx_bytes
+        if not self.db.stage_scan(dmtx=dmtx_bytes):
+            print("Already in the batch")
+            return
+
+        if platform.system() == "Windows":
+            winsound.Beep(2500, 200)  # short beep
+        if self.db.get_item_by_code(dmtx=dmtx_bytes) is None:  # the ones in stock are shown as such, not committed
+            self.batch_intake.queue_scan(dmtx_bytes=dmtx_bytes, use_web=self.radio_box_decode.GetSelection() == 1)
+        if self.batch_dialog_shown():
+            self.get_dialog(BatchIntakeDialog).refresh()
+
+    def retry_batch_codes(self):
+        """
+        Looks up the staged codes that failed, or never finished because the app was closed
+        :return: None
+        """
+        for item, status, error in self.db.get_staged():
+            if status in [STAGING_PENDING, STAGING_FAILED]:
+                self.batch_intake.queue_scan(dmtx_bytes=item.dmtx, use_web=self.radio_box_decode.GetSelection() == 1)
+
+    def resolve_code(self, dmtx_bytes: bytes, use_web: bool) -> ItemRecord:
+        """
+        Finds the component information for a code. Runs in the batch intake worker threads, so no GUI or DB access
+        :param dmtx_bytes: raw bytes in the code
+        :param use_web: True to look up the code with the Digi-Key API, False to decode it locally
+        :return: the item found. Raises RuntimeError if the lookup failed
+        """
+        if not use_web:
+            return item_from_dmtx_local(dmtx_bytes=dmtx_bytes)
+
+        dk_api = self.get_dk_api()
+        if dk_api is None:
+            raise RuntimeError("The Digi-Key API is not set up")
+        api_success, barcode2d_resp = dk_api.product_2d_barcode(dmtx_bytes=dmtx_bytes)
+        if not api_success:
+            raise RuntimeError("Digi-Key lookup failed ({}): {}".format(barcode2d_resp.status_code,
+                                                                        barcode2d_resp.text))
+        return item_from_barcode_response(resp_json=barcode2d_resp.json(), dmtx_bytes=dmtx_bytes)
+
+    def batch_code_resolved(self, dmtx_bytes: bytes, item: ItemRecord, error: str):
+        self.db.update_staged(dmtx=dmtx_bytes, item=item, error=error)
+        if self.batch_dialog_shown():
+            self.get_dialog(BatchIntakeDialog).refresh()
+
+    def btn_batch_review(self, event):
+        dialog = self.get_dialog(BatchIntakeDialog)
+        dialog.setup(db=self.db, retry=self.retry_batch_codes)
+        dialog.Show()
+
     def clear_inputs(self):
         """
         Clears all input fields except location. Also clears the data matrix object
@@ -528,9 +750,6 @@ class InventoryFrame(MainFrame):
         self.dmtx_bytes = None
 
     def main_notebook_changed(self, event):
-        # clear te search results object as it won't make sense outside the search/view tab
-        self.search_results = None
-
         if self.notebook_main.GetSelection() == 1:  # switched to search tab
             # resize the columns to fit window
             grid_width = self.grid_results.GetSize().GetWidth()
@@ -545,16 +764,26 @@ class InventoryFrame(MainFrame):
 
     def on_close(self, event):
         # clean up the Digi-Key API
-        if self.dk_api.httpd is not None:
-            self.dk_api.httpd.shutdown()  # stop the server
-            self.dk_api.httpd.close()  # close the TCP socket
-
-        # release the database
+        self.batch_intake.shutdown()
+        self.dk_api_thread.join(timeout=5)  # don't hang on a token refresh or the app creation prompt
+        dk_api = self.dk_api
+        if dk_api is not None:
+            if dk_api.httpd is not None:
+                dk_api.httpd.shutdown()  # stop the server
+                dk_api.httpd.close()  # close the TCP socket
+            dk_api.session.close()
+            dk_api.response_cache.close()
+
+        # release the database, after any snapshot being taken
+        self.live_search.stop()
+        self.backup_service.stop()
         self.db.close()
 
         # stop the camera
         if self.camera_on:
             self.camera_timer.Stop()
+            if self.scan_pipeline is not None:
+                self.scan_pipeline.stop()
             self.camera_cap.release()
             self.camera_on = False
         event.Skip()  # pass on to the default window close handler
@@ -0,0 +1,181 @@
+import collections
+import math
+import time
+
+from pylibdmtx.pylibdmtx import decode
+
+from dmtx_roi import RoiTracker, expand_region
+
+MIN_SHRINK = 1
+MAX_SHRINK = 4
+DEFAULT_SHRINK = 2  # the coarse pass starts on a frame of half the width and height
+MIN_TIMEOUT = 5  # ms, shortest time limit given to the decoder, it finds nothing in less
+COARSE_SHARE = 0.5  # most of the frame budget the coarse pass can use, the rest is for the full resolution pass
+COARSE_TIMEOUT_MARGIN = 1.5  # coarse time limit as a multiple of the recent coarse decode times
+# edge threshold and scan gap of libdmtx. The defaults are the most thorough, higher values skip more of the image
+MIN_THRESHOLD = 10
+MAX_THRESHOLD = 40
+THRESHOLD_STEP = 10
+MIN_GAP_SIZE = 2
+MAX_GAP_SIZE = 4
+TUNE_INTERVAL = 15  # frames between adjustments of the settings
+STRUGGLE_FRAMES = 5  # frames in a row where something looks like a code but doesn't decode before easing off
+
+
+class AdaptiveDecoder:
+    """
+    Decodes a frame within a time budget, adjusting how hard it tries to how the recent frames went.
+    A coarse pass first looks for the code in the whole frame shrunk by libdmtx, which is quick if the code is big
+    enough. If it's not found, a full resolution pass decodes around where the last code was, then the regions that
+    look like a code, in the time left.
+    Every TUNE_INTERVAL frames the shrink is lowered if the codes were mostly only found at full resolution, or raised
+    if the coarse pass found them all, and the coarse time limit follows the time the coarse hits took. The edge
+    threshold and scan gap are raised while decoding goes well, which skips more of the image, and brought back down
+    when something looking like a code stays in view without decoding.
+    """
+    def __init__(self, budget: float, roi_tracker: RoiTracker = None, history: int = 4 * TUNE_INTERVAL):
+        """
+        :param budget: ms per frame, the decoder doesn't start anything new after that
+        :param roi_tracker: keeps track of where the code was found in the previous frames
+        :param history: frames the statistics are kept for
+        """
+        self.budget = budget
+        self.roi_tracker = roi_tracker if roi_tracker is not None else RoiTracker()
+
+        self.shrink = DEFAULT_SHRINK
+        self.coarse_timeout = max(MIN_TIMEOUT, int(budget * COARSE_SHARE))
+        self.threshold = MIN_THRESHOLD
+        self.gap_size = MIN_GAP_SIZE
+
+        # (pass that decoded: "coarse", "fine" or None, ms the coarse pass took, whether anything looked like a code)
+        self.results = collections.deque(maxlen=history)
+        self.frames = 0  # since the last adjustment
+        self.struggling = 0  # frames in a row with a likely code that didn't decode
+
+    def decode(self, gray):
+        """
+        :param gray: grayscale frame
+        :return: the raw bytes in the code, or None if no code was found in the budget
+        """
+        deadline = time.perf_counter() + self.budget / 1000
+        frame_h, frame_w = gray.shape[:2]
+
+        start = time.perf_counter()
+        dmtx_bytes, region = self.decode_region(gray, (0, 0, frame_w, frame_h), self.shrink,
+                                                min(self.coarse_timeout, self.remaining(deadline)))
+        coarse_ms = (time.perf_counter() - start) * 1000
+        if dmtx_bytes is not None:
+            self.roi_tracker.hit(region)
+            self.record("coarse", coarse_ms, True)
+            return dmtx_bytes
+
+        regions = []
+        if self.remaining(deadline) >= MIN_TIMEOUT:
+            regions = self.roi_tracker.candidate_regions(gray)
+        for candidate in regions:
+            timeout = self.remaining(deadline)
+            if timeout < MIN_TIMEOUT:
+                break
+            dmtx_bytes, region = self.decode_region(gray, candidate, MIN_SHRINK, timeout)
+            if dmtx_bytes is not None:
+                # track the code itself, not the padded candidate, unless it's the last hit being followed
+                self.roi_tracker.hit(candidate if candidate == self.roi_tracker.tracked_region else region)
+                self.record("fine", coarse_ms, True)
+                return dmtx_bytes
+        self.roi_tracker.miss()
+        self.record(None, coarse_ms, len(regions) > 0)
+        return None
+
+    @staticmethod
+    def remaining(deadline: float) -> int:
+        """
+        :return: ms left before the deadline
+        """
+        return int((deadline - time.perf_counter()) * 1000)
+
+    def decode_region(self, gray, region: tuple, shrink: int, timeout: int) -> tuple:
+        """
+        :param gray: full grayscale frame
+        :param region: (x, y, width, height) to decode
+        :param shrink: factor libdmtx shrinks the region by before looking for the code
+        :param timeout: ms
+        :return: (raw bytes, region the code is in) or (None, None)
+        """
+        if timeout < MIN_TIMEOUT:  # a timeout of 0 would mean no limit
+            return None, None
+        x, y, w, h = region
+        decoded = decode(gray[y:y + h, x:x + w], timeout=timeout, shrink=shrink, gap_size=self.gap_size,
+                         threshold=self.threshold, max_count=1)
+        if len(decoded) == 0:
+            return None, None
+
+        # the rectangle joins two opposite corners of the code, which can be at any angle, so take the square around
+        # the circle through them. libdmtx measures y from the bottom of the image
+        rect = decoded[0].rect
+        center_x = x + rect.left + rect.width / 2
+        center_y = y + h - (rect.top + rect.height / 2)
+        radius = math.hypot(rect.width, rect.height) / 2
+        frame_h, frame_w = gray.shape[:2]
+        code_region = expand_region((center_x - radius, center_y - radius, 2 * radius, 2 * radius), frame_w, frame_h,
+                                    margin=0.)
+        return decoded[0].data, code_region
+
+    def record(self, decoded_by, coarse_ms: float, likely_code: bool) -> None:
+        """
+        Keeps the statistics of a frame, and adjusts the settings every TUNE_INTERVAL frames
+        :param decoded_by: "coarse", "fine" or None if nothing decoded
+        :param coarse_ms: time the coarse pass took
+        :param likely_code: True if something that looks like a code was in the frame
+        :return: None
+        """
+        self.results.append((decoded_by, coarse_ms, likely_code))
+
+        # a code seems to be in view but doesn't decode, be thorough again straight away. The shrink is left to
+        # tune(), as text and other clutter can look like a code too
+        if decoded_by is None and likely_code:
+            self.struggling += 1
+        else:
+            self.struggling = 0
+        if self.struggling >= STRUGGLE_FRAMES:
+            self.struggling = 0
+            self.threshold = MIN_THRESHOLD
+            self.gap_size = MIN_GAP_SIZE
+
+        self.frames += 1
+        if self.frames >= TUNE_INTERVAL:
+            self.frames = 0
+            self.tune()
+
+    def tune(self) -> None:
+        coarse_hits = [coarse_ms for decoded_by, coarse_ms, _ in self.results if decoded_by == "coarse"]
+        fine_hits = sum(1 for decoded_by, _, _ in self.results if decoded_by == "fine")
+        hits = len(coarse_hits) + fine_hits
+        if hits == 0:  # nothing in view lately, nothing to go by
+            return
+
+        # shrink as much as still finds the codes
+        coarse_share = len(coarse_hits) / hits
+        if coarse_share < 0.5:
+            self.shrink = max(MIN_SHRINK, self.shrink - 1)
+        elif coarse_share == 1 and self.shrink < MAX_SHRINK:
+            self.shrink += 1
+
+        # leave the coarse pass enough time for the codes it finds, the rest goes to the full resolution pass
+        if len(coarse_hits) > 0:
+            coarse_hits.sort()
+            slow_hit = coarse_hits[int(0.9 * (len(coarse_hits) - 1))]
+            self.coarse_timeout = int(min(max(MIN_TIMEOUT, slow_hit * COARSE_TIMEOUT_MARGIN),
+                                          self.budget * COARSE_SHARE))
+
+        # decoding goes well, skip more of the image
+        misses = sum(1 for decoded_by, _, likely_code in self.results if decoded_by is None and likely_code)
+        if misses == 0:
+            self.threshold = min(MAX_THRESHOLD, self.threshold + THRESHOLD_STEP)
+            self.gap_size = min(MAX_GAP_SIZE, self.gap_size + 1)
+
+    def settings(self) -> dict:
+        """
+        :return: the current settings, for logging and the benchmark
+        """
+        return {"shrink": self.shrink, "coarse_timeout": self.coarse_timeout, "threshold": self.threshold,
+                "gap_size": self.gap_size}
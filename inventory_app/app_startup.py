@@ -0,0 +1,45 @@
+"""
+The steps of starting the app that don't need the GUI. InventoryFrame runs them, and startup_benchmark.py times the
+same functions without a display.
+"""
+from dbinterface import DbInterface, SearchPage
+from db_backup import BackupService
+from live_search import LiveSearch
+
+
+def connect_database() -> DbInterface:
+    """
+    :return: the inventory, connected to DB_FILENAME
+    """
+    db = DbInterface()
+    db.connect()
+    return db
+
+
+def start_backup_service() -> BackupService:
+    """
+    :return: the service taking the scheduled snapshots of the database, started
+    """
+    backup_service = BackupService()
+    backup_service.start()
+    return backup_service
+
+
+def first_results_page(db: DbInterface) -> SearchPage:
+    """
+    The grid only needs the summary of each record, the rest is loaded when a record is opened
+    :return: the page of records the results grid shows at startup
+    """
+    return db.get_all(summary=True)
+
+
+def start_live_search(db: DbInterface, on_results) -> LiveSearch:
+    """
+    :param db: the inventory
+    :param on_results: function(keyword, SearchPage) called on the search thread with each first page of results
+    :return: the search-as-you-type worker, started
+    """
+    return LiveSearch(search=lambda keyword: db.basic_search(keyword=keyword, summary=True),
+                      cached=lambda keyword: db.cached_basic_search(keyword=keyword, summary=True),
+                      interrupt=db.interrupt_search,
+                      on_results=on_results)
@@ -0,0 +1,108 @@
+from concurrent.futures import ThreadPoolExecutor
+import threading
+import traceback
+
+from dbinterface import ItemRecord
+from ecia_label import parse_label
+
+INTAKE_CONCURRENCY = 4  # most Digi-Key lookups in flight at once
+
+
+def item_from_barcode_response(resp_json: dict, dmtx_bytes: bytes) -> ItemRecord:
+    """
+    Fills in an ItemRecord from a Digi-Key Product2DBarcode response
+    :param resp_json: the response, decoded from JSON
+    :param dmtx_bytes: original data from the data matrix code
+    :return: the item, without a location
+    """
+    desc = resp_json["ProductDescription"]
+    item = ItemRecord(
+        has_dmtx=True,
+        pn=resp_json["DigiKeyPartNumber"],
+        desc=desc,
+        mfg_pn=resp_json["ManufacturerPartNumber"],
+        # take the first word in the description as the category; this will work in most cases
+        cat=desc.split()[0],
+        manufacturer=resp_json["ManufacturerName"],
+        qty=resp_json["Quantity"],
+        comment="Sales Order ID: {}".format(resp_json["SalesorderId"]),
+        dmtx=dmtx_bytes
+    )
+
+    # the P field holds the customer reference if one was given, otherwise the Digi-Key part number
+    label = parse_label(dmtx_bytes)
+    if label.customer_pn != "" and label.customer_pn != item.supplier_pn:  # customer reference is present
+        item.customer_ref = label.customer_pn
+
+    # fill in the supplier field as Digi-Key
+    item.supplier = "Digi-Key"
+    return item
+
+
+def item_from_dmtx_local(dmtx_bytes: bytes) -> ItemRecord:
+    """
+    Finds what information it can in the data matrix code, without the Digi-Key API
+    :param dmtx_bytes: original data from the data matrix code
+    :return: the item with the manufacturer P/N and quantity filled in, and the manufacturer and supplier P/N if the
+             label has them
+    """
+    label = parse_label(dmtx_bytes)
+    return ItemRecord(has_dmtx=True,
+                      mfg_pn=label.manufacturer_pn,
+                      qty=label.quantity if label.quantity is not None else 0,
+                      pn=label.supplier_pn,
+                      manufacturer=label.manufacturer,
+                      dmtx=dmtx_bytes)
+
+
+class BatchIntake:
+    """
+    Resolves scanned codes into items in the background, so bags can be scanned one after another without waiting
+    for the lookups. Codes already queued are ignored, and at most INTAKE_CONCURRENCY lookups run at once.
+    """
+    def __init__(self, resolve, on_resolved, max_workers: int = INTAKE_CONCURRENCY):
+        """
+        :param resolve: function taking (dmtx_bytes, use_web) and returning an ItemRecord, or raising on failure.
+                        Called from the worker threads
+        :param on_resolved: function taking (dmtx_bytes, item, error message). item is None if the lookup failed.
+                            Called from the worker threads, so GUI code should pass it on with wx.CallAfter
+        :param max_workers: most lookups running at once
+        """
+        self.resolve = resolve
+        self.on_resolved = on_resolved
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="intake")
+        self.lock = threading.Lock()
+        self.in_flight = set()  # codes being looked up
+
+    def queue_scan(self, dmtx_bytes: bytes, use_web: bool) -> bool:
+        """
+        :param dmtx_bytes: original data from the data matrix code
+        :param use_web: True to look up the code with the Digi-Key API, False to decode it locally
+        :return: True if the code was queued, False if it is already being looked up
+        """
+        with self.lock:
+            if dmtx_bytes in self.in_flight:
+                return False
+            self.in_flight.add(dmtx_bytes)
+        self.executor.submit(self.lookup, dmtx_bytes, use_web)
+        return True
+
+    def lookup(self, dmtx_bytes: bytes, use_web: bool) -> None:
+        item = None
+        error = ""
+        try:
+            item = self.resolve(dmtx_bytes, use_web)
+        except Exception as e:  # report the failure rather than losing it in the worker thread
+            traceback.print_exc()
+            error = str(e)
+        finally:
+            with self.lock:
+                self.in_flight.discard(dmtx_bytes)
+        self.on_resolved(dmtx_bytes, item, error)
+
+    def pending_count(self) -> int:
+        with self.lock:
+            return len(self.in_flight)
+
+    def shutdown(self) -> None:
+        self.executor.shutdown(wait=False)
@@ -0,0 +1,424 @@
+"""
+Deducts the parts of a project's bill of materials from the inventory. Reads CSV BOMs, including the CSV exports of
+KiCad and Altium, and the XML BOM (intermediate netlist) of KiCad. Each line is matched to the inventory by
+manufacturer P/N, supplier P/N or customer reference, then the shortfalls are reported and the whole BOM times the
+number of boards is deducted in one transaction: either every part is taken, or none are.
+
+Usage: python bom_deduction.py BOM_FILE [--builds N] [--project NAME] [--deduct]
+"""
+import argparse
+import csv
+import re
+import time
+import xml.etree.ElementTree as ElementTree
+
+from dbinterface import DbInterface, NotEnoughStock
+
+# BOM column headers, normalised with header_key(), for each of the fields used
+QUANTITY_HEADERS = ["qty", "quantity", "quantityperpcb", "qtyperpcb", "qtyperboard", "count"]
+DESIGNATOR_HEADERS = ["designator", "designators", "reference", "references", "ref", "refdes"]
+MANUFACTURER_PN_HEADERS = ["mpn", "manufacturerpartnumber", "manufacturerpartnumber1", "manufacturerpn", "mfrpn",
+                           "mfrpartnumber", "mfgpn", "partnumber"]
+SUPPLIER_PN_HEADERS = ["supplierpartnumber", "supplierpartnumber1", "supplierpn", "spn", "digikeypartnumber",
+                       "digikeypn", "digikey", "dkpn"]
+CUSTOMER_REF_HEADERS = ["customerref", "customerreference", "custref"]
+VALUE_HEADERS = ["value", "comment"]
+
+# how a BOM line was matched to the inventory
+MATCH_MANUFACTURER_PN = "Manufacturer P/N"
+MATCH_SUPPLIER_PN = "Supplier P/N"
+MATCH_CUSTOMER_REF = "Customer Ref"
+MATCH_NORMALISED = "Normalised P/N"
+
+LOOKUP_BATCH_SIZE = 500  # part numbers per query, below the old SQLite limit of 999 variables
+
+DIGIKEY_SUFFIX = "-ND"
+# Digi-Key packaging variants of the same part, before the -ND: CT cut tape, TR tape and reel, DKR Digi-Reel,
+# or -1, -2 and -6 for the same
+DIGIKEY_PACKAGING_CODES = ["-1", "-2", "-6"]
+DIGIKEY_PACKAGING_SUFFIXES = ["CT", "TR", "DKR"]
+NOT_ALPHANUMERIC_RE = re.compile(r"[^A-Z0-9]+")
+
+
+def header_key(header: str) -> str:
+    """
+    :return: the column header in lower case, without spaces or punctuation
+    """
+    return re.sub(r"[^a-z0-9]", "", header.lower())
+
+
+def normalise_part_number(part_number: str) -> str:
+    """
+    Reduces a part number to the characters that identify the part, so variants like "RC0603FR-0710KL" and
+    "rc0603fr 07 10kl", or the Digi-Key packaging variants "311-10.0KHRCT-ND" and "311-10.0KHRTR-ND", end up the same.
+    Called for every part number in the inventory, so it sticks to string methods and one regular expression
+    :param part_number: manufacturer or supplier part number
+    :return: the normalised part number, empty if there's nothing left
+    """
+    part_number = part_number.upper()
+    if part_number.endswith(DIGIKEY_SUFFIX):
+        part_number = part_number[:-len(DIGIKEY_SUFFIX)]
+        if part_number[-2:] in DIGIKEY_PACKAGING_CODES:
+            part_number = part_number[:-2]
+        for suffix in DIGIKEY_PACKAGING_SUFFIXES:
+            if part_number.endswith(suffix):
+                part_number = part_number[:-len(suffix)]
+                break
+    return NOT_ALPHANUMERIC_RE.sub("", part_number)
+
+
+def count_designators(designators: str) -> int:
+    """
+    :param designators: the designators of a BOM line, like "R1, R2, R5-R7"
+    :return: number of parts on the board
+    """
+    count = 0
+    for designator in re.split(r"[\s,;]+", designators.strip()):
+        if designator == "":
+            continue
+        designator_range = re.match(r"^([A-Za-z_]+)(\d+)-\1?(\d+)$", designator)
+        if designator_range is not None:  # R5-R7 or R5-7
+            count += abs(int(designator_range.group(3)) - int(designator_range.group(2))) + 1
+        else:
+            count += 1
+    return count
+
+
+class BomLine:
+    """
+    One line of a bill of materials: a part and how many of it are on one board
+    """
+    def __init__(self, line_number: int, quantity: int, designators: str = "", manufacturer_pn: str = "",
+                 supplier_pn: str = "", customer_ref: str = "", value: str = ""):
+        self.line_number: int = line_number  # in the BOM file, for the report
+        self.quantity: int = quantity  # per board
+        self.designators: str = designators
+        self.manufacturer_pn: str = manufacturer_pn
+        self.supplier_pn: str = supplier_pn
+        self.customer_ref: str = customer_ref
+        self.value: str = value
+
+    def describe(self) -> str:
+        """
+        :return: the most useful name of the part, for the report
+        """
+        for name in [self.manufacturer_pn, self.supplier_pn, self.customer_ref, self.value, self.designators]:
+            if name != "":
+                return name
+        return "line {}".format(self.line_number)
+
+
+class BomMatch:
+    """
+    The inventory records a BOM line was matched to, and how much of the required quantity they can give
+    """
+    def __init__(self, line: BomLine, builds: int):
+        self.line: BomLine = line
+        self.required: int = line.quantity * builds
+        self.match_type: str = None  # one of the MATCH_* values, None if nothing matched
+        self.records: list = []  # (data matrix code, quantity) of the matching records
+        # (data matrix code, quantity) taken from the matching records, shared with the other lines by allocate_stock()
+        self.allocation: list = []
+
+    @property
+    def available(self) -> int:
+        """
+        :return: the quantity this line gets, after the other lines matched to the same records took theirs
+        """
+        return sum(quantity for _, quantity in self.allocation)
+
+    @property
+    def shortfall(self) -> int:
+        return max(0, self.required - self.available)
+
+    def deductions(self) -> list:
+        """
+        :return: list of (data matrix code, quantity to deduct)
+        """
+        return list(self.allocation)
+
+
+def allocate_stock(matches: list) -> None:
+    """
+    Shares the stock of the records between the lines, so two lines matched to the same record don't both count
+    its whole quantity. The lines with the fewest records take theirs first, as the others have more to choose from,
+    and each line empties the smaller bags first
+    :param matches: list of BomMatch objects, their allocation is set
+    :return: None
+    """
+    stock = {}  # data matrix code -> quantity not taken yet
+    for match in matches:
+        stock.update(match.records)
+    for match in sorted(matches, key=lambda match: len(match.records)):
+        match.allocation = []
+        remaining = match.required
+        for dmtx in sorted((dmtx for dmtx, _ in match.records), key=lambda dmtx: stock[dmtx]):
+            if remaining <= 0:
+                break
+            taken = min(stock[dmtx], remaining)
+            if taken > 0:
+                match.allocation += [(dmtx, taken)]
+                stock[dmtx] -= taken
+                remaining -= taken
+
+
+def shared_records(matches: list) -> list:
+    """
+    Groups the lines that take from the same records, e.g. the same part on two lines, or matched by manufacturer P/N
+    on one and by supplier P/N on the other
+    :param matches: list of BomMatch objects
+    :return: list of (list of BomMatch objects, total required, quantity in stock), for the groups of more than one
+             line
+    """
+    groups = []  # [set of data matrix codes, list of BomMatch objects]
+    for match in matches:
+        codes = set(dmtx for dmtx, _ in match.records)
+        if len(codes) == 0:
+            continue
+        joined = [group for group in groups if len(group[0] & codes) > 0]
+        group_matches = []
+        for group in joined:
+            groups.remove(group)
+            codes |= group[0]
+            group_matches += group[1]
+        groups += [[codes, group_matches + [match]]]
+
+    shared = []
+    for codes, group_matches in groups:
+        if len(group_matches) < 2:
+            continue
+        stock = {}
+        for match in group_matches:
+            stock.update(match.records)
+        group_matches.sort(key=lambda match: match.line.line_number)
+        shared += [(group_matches, sum(match.required for match in group_matches), sum(stock.values()))]
+    return shared
+
+
+def read_bom(filename: str) -> list:
+    """
+    :param filename: CSV BOM, or the XML BOM of KiCad
+    :return: list of BomLine objects, with the lines that don't go on the board left out
+    """
+    if filename.lower().endswith(".xml"):
+        return read_kicad_xml_bom(filename)
+    return read_csv_bom(filename)
+
+
+def read_csv_bom(filename: str) -> list:
+    """
+    Reads a CSV BOM with a header row. Altium puts a title block above the header, so rows are skipped until one
+    has a quantity or designator column
+    :param filename: the CSV file
+    :return: list of BomLine objects
+    """
+    with open(filename, newline="", encoding="utf-8-sig") as f_bom:
+        sample = f_bom.read(16384)
+        f_bom.seek(0)
+        try:
+            dialect = csv.Sniffer().sniff(sample, delimiters=",;\t")
+        except csv.Error:  # one column, or too irregular to tell
+            dialect = csv.excel
+        rows = list(csv.reader(f_bom, dialect))
+
+    columns = None
+    lines = []
+    for row_index, row in enumerate(rows):
+        if columns is None:
+            keys = [header_key(header) for header in row]
+            if any(key in QUANTITY_HEADERS + DESIGNATOR_HEADERS for key in keys):
+                columns = keys
+            continue
+
+        fields = {}
+        for key, value in zip(columns, row):
+            fields[key] = value.strip()
+        line = bom_line_from_fields(line_number=row_index + 1, fields=fields)
+        if line is not None:
+            lines += [line]
+
+    if columns is None:
+        print("No header row with a quantity or designator column found in {}".format(filename))
+    return lines
+
+
+def first_field(fields: dict, headers: list) -> str:
+    """
+    :return: the value of the first of the headers present in the fields, or an empty string
+    """
+    for header in headers:
+        if fields.get(header, "") != "":
+            return fields[header]
+    return ""
+
+
+def bom_line_from_fields(line_number: int, fields: dict):
+    """
+    :param line_number: row in the BOM file
+    :param fields: the values of the row, by normalised header
+    :return: the BomLine, or None for rows without a part, like the totals at the end of some exports
+    """
+    designators = first_field(fields, DESIGNATOR_HEADERS)
+    quantity_text = first_field(fields, QUANTITY_HEADERS)
+    try:
+        quantity = int(float(quantity_text))
+    except ValueError:
+        quantity = count_designators(designators)
+
+    line = BomLine(line_number=line_number,
+                   quantity=quantity,
+                   designators=designators,
+                   manufacturer_pn=first_field(fields, MANUFACTURER_PN_HEADERS),
+                   supplier_pn=first_field(fields, SUPPLIER_PN_HEADERS),
+                   customer_ref=first_field(fields, CUSTOMER_REF_HEADERS),
+                   value=first_field(fields, VALUE_HEADERS))
+    if line.quantity <= 0 or (line.manufacturer_pn == "" and line.supplier_pn == "" and line.customer_ref == ""):
+        return None
+    return line
+
+
+def read_kicad_xml_bom(filename: str) -> list:
+    """
+    Reads the XML BOM that KiCad's BOM tool hands to its plugins, one line per part with the same fields
+    :param filename: the XML file
+    :return: list of BomLine objects
+    """
+    grouped = {}  # (manufacturer P/N, supplier P/N, customer ref) -> BomLine
+    for comp in ElementTree.parse(filename).getroot().iter("comp"):
+        fields = {}
+        for field in comp.iter("field"):
+            fields[header_key(field.get("name", ""))] = (field.text or "").strip()
+        fields.update({"qty": "1",  # each comp is one part
+                       "reference": comp.get("ref", ""),
+                       "value": comp.findtext("value", default="").strip()})
+        line = bom_line_from_fields(line_number=len(grouped) + 1, fields=fields)
+        if line is None:
+            continue
+
+        key = (line.manufacturer_pn, line.supplier_pn, line.customer_ref)
+        if key in grouped:
+            grouped[key].quantity += 1
+            grouped[key].designators += ", " + line.designators
+        else:
+            grouped[key] = line
+    return list(grouped.values())
+
+
+def match_bom(db: DbInterface, lines: list, builds: int = 1) -> list:
+    """
+    Finds the inventory records for each BOM line. Exact part numbers (ignoring the case) are looked up through the
+    indexes, a batch at a time. Lines still unmatched are then looked up by normalised part number, in a hash map
+    built from the inventory once.
+    :param db: the inventory
+    :param lines: list of BomLine objects
+    :param builds: number of boards to build
+    :return: list of BomMatch objects, in the order of the lines
+    """
+    matches = [BomMatch(line=line, builds=builds) for line in lines]
+
+    for match_type, attr in [(MATCH_MANUFACTURER_PN, "manufacturer_pn"),
+                             (MATCH_SUPPLIER_PN, "supplier_pn"),
+                             (MATCH_CUSTOMER_REF, "customer_ref")]:
+        unmatched = [match for match in matches if match.match_type is None and getattr(match.line, attr) != ""]
+        if len(unmatched) == 0:
+            continue
+        found = db.find_stock(column=match_type, values=[getattr(match.line, attr) for match in unmatched],
+                              batch_size=LOOKUP_BATCH_SIZE)
+        for match in unmatched:
+            records = found.get(getattr(match.line, attr).lower(), [])
+            if len(records) > 0:
+                match.match_type = match_type
+                match.records = records
+
+    unmatched = [match for match in matches if match.match_type is None]
+    if len(unmatched) > 0:
+        wanted = set()
+        for match in unmatched:
+            wanted.update([normalise_part_number(match.line.manufacturer_pn),
+                           normalise_part_number(match.line.supplier_pn)])
+        wanted.discard("")
+
+        by_part_number = {}  # normalised part number -> list of (data matrix code, quantity), only the ones wanted
+        for manufacturer_pn, supplier_pn, dmtx, quantity in db.get_part_numbers():
+            for part_number in {normalise_part_number(manufacturer_pn or ""), normalise_part_number(supplier_pn or "")}:
+                if part_number in wanted:
+                    by_part_number.setdefault(part_number, []).append((dmtx, quantity))
+        for match in unmatched:
+            for part_number in [match.line.manufacturer_pn, match.line.supplier_pn]:
+                records = by_part_number.get(normalise_part_number(part_number), [])
+                if len(records) > 0:
+                    match.match_type = MATCH_NORMALISED
+                    match.records = records
+                    break
+
+    allocate_stock(matches)
+    return matches
+
+
+def print_report(matches: list, builds: int) -> None:
+    print("{} BOM lines, {} board(s)".format(len(matches), builds))
+    print("{:<6} {:<28} {:>8} {:>9} {:>9}  {}".format("Line", "Part", "Required", "Available", "Shortfall",
+                                                     "Matched by"))
+    for match in matches:
+        print("{:<6} {:<28} {:>8} {:>9} {:>9}  {}".format(match.line.line_number, match.line.describe()[:28],
+                                                         match.required, match.available, match.shortfall,
+                                                         match.match_type or "NOT FOUND"))
+    short = [match for match in matches if match.shortfall > 0]
+    print("{} line(s) short".format(len(short)))
+
+    shared = shared_records(matches)
+    if len(shared) > 0:
+        print("Lines taking from the same records:")
+        print("{:<20} {:<28} {:>8} {:>9} {:>9}".format("Lines", "Part", "Required", "In stock", "Shortfall"))
+        for group_matches, required, in_stock in shared:
+            line_numbers = ", ".join(str(match.line.line_number) for match in group_matches)
+            print("{:<20} {:<28} {:>8} {:>9} {:>9}".format(line_numbers[:20], group_matches[0].line.describe()[:28],
+                                                           required, in_stock, max(0, required - in_stock)))
+
+
+def deduct_bom(db: DbInterface, matches: list, project: str) -> bool:
+    """
+    Takes the parts of the whole BOM out of the inventory in one transaction
+    :param db: the inventory
+    :param matches: from match_bom()
+    :param project: project the parts are used by
+    :return: True if every part was deducted, False if nothing was as some parts are short
+    """
+    if any(match.shortfall > 0 for match in matches):
+        print("Not enough stock for the whole BOM, nothing deducted.")
+        return False
+
+    changes = []
+    for match in matches:
+        changes += [(dmtx, -quantity) for dmtx, quantity in match.deductions()]
+    try:
+        db.adjust_quantities(changes=changes, project=project)
+    except NotEnoughStock as e:  # taken by someone else since the report
+        print("{}, nothing deducted.".format(e))
+        return False
+    return True
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Match a bill of materials to the inventory and deduct it")
+    parser.add_argument("bom", help="CSV BOM (KiCad, Altium or any with a header row), or KiCad XML BOM")
+    parser.add_argument("--builds", type=int, default=1, help="number of boards to build")
+    parser.add_argument("--project", default="", help="project using the parts, recorded with the checkouts")
+    parser.add_argument("--deduct", action="store_true", help="deduct the parts; otherwise only report")
+    args = parser.parse_args()
+
+    db = DbInterface()
+    db.connect()
+    start = time.perf_counter()
+    lines = read_bom(args.bom)
+    matches = match_bom(db=db, lines=lines, builds=args.builds)
+    print_report(matches=matches, builds=args.builds)
+    print("Matched in {:.0f} ms".format((time.perf_counter() - start) * 1000))
+
+    if args.deduct and deduct_bom(db=db, matches=matches, project=args.project or None):
+        print("Deducted the BOM from the inventory.")
+    db.close()
+
+
+if __name__ == "__main__":
+    main()
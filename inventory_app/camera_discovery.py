@@ -0,0 +1,240 @@
+"""
+Finds the cameras connected, and what resolutions and frame rates they can capture at. The devices are probed at the
+same time, each on its own thread with a timeout, so a camera that's slow to respond doesn't hold up the rest.
+On Linux the devices are listed from /dev/video* and opened with V4L2; on Windows indices 0 to MAX_CAMERA_INDEX - 1
+are tried with DirectShow. The results are cached in CAMERA_CACHE_FILENAME, so the app starts without probing again.
+
+Running this file scans and prints the cameras: python camera_discovery.py [--cached]
+"""
+import argparse
+import glob
+import json
+import os
+import platform
+import re
+import threading
+import time
+import traceback
+
+CAMERA_CACHE_FILENAME = "AppData/cameras.json"
+MAX_CAMERA_INDEX = 5  # indices tried where the devices can't be listed
+PROBE_TIMEOUT = 5.  # s, for each device to open and read a frame
+# tried on each camera, it reports back the nearest it supports
+PROBE_RESOLUTIONS = [(640, 480), (800, 600), (1280, 720), (1920, 1080), (2592, 1944), (3840, 2160)]
+VIDEO_DEVICE_RE = re.compile(r"/dev/video(\d+)$")
+
+
+class CameraInfo:
+    """
+    A camera found by the scan
+    """
+    def __init__(self, index: int, backend: str, name: str = "", path: str = "", modes: list = None):
+        self.index = index  # for cv2.VideoCapture()
+        self.backend = backend  # name of the OpenCV backend, without the "CAP_" in front
+        self.name = name  # from the driver, if known
+        self.path = path  # device file, on Linux
+        self.modes = modes if modes is not None else []  # [width, height, fps], as reported by the camera
+
+    def label(self) -> str:
+        """
+        :return: text for the camera drop-down box
+        """
+        text = "{}".format(self.index)
+        if self.name != "":
+            text += ": {}".format(self.name)
+        if len(self.modes) > 0:
+            width, height, _ = max(self.modes, key=lambda mode: mode[0] * mode[1])
+            text += " ({}x{})".format(width, height)
+        return text
+
+    def to_dict(self) -> dict:
+        return {"index": self.index, "backend": self.backend, "name": self.name, "path": self.path,
+                "modes": self.modes}
+
+    @staticmethod
+    def from_dict(values: dict):
+        return CameraInfo(index=values["index"], backend=values["backend"], name=values.get("name", ""),
+                          path=values.get("path", ""), modes=values.get("modes", []))
+
+
+def camera_backend() -> str:
+    """
+    :return: name of the OpenCV backend to open cameras with on this platform
+    """
+    system = platform.system()
+    if system == "Linux":
+        return "V4L2"
+    if system == "Windows":
+        # direct show. Removes this warning:
+        # https://stackoverflow.com/questions/59596748/warn0-global-sourcereadercbsourcereadercb-terminating-async-callback-wa
+        return "DSHOW"
+    return "ANY"
+
+
+def open_camera(camera: CameraInfo):
+    """
+    :return: an opened cv2.VideoCapture for the camera
+    """
+    from cv2 import cv2
+
+    return cv2.VideoCapture(camera.index, getattr(cv2, "CAP_" + camera.backend))
+
+
+def candidate_devices() -> list:
+    """
+    Lists the devices that could be cameras, without opening them
+    :return: list of CameraInfo objects, not probed yet
+    """
+    backend = camera_backend()
+    if backend != "V4L2":
+        return [CameraInfo(index=index, backend=backend) for index in range(MAX_CAMERA_INDEX)]
+
+    candidates = []
+    for path in glob.glob("/dev/video*"):
+        match = VIDEO_DEVICE_RE.match(path)
+        if match is None:
+            continue
+        sys_dir = "/sys/class/video4linux/video{}".format(match.group(1))
+        try:
+            # a camera has more than one node, for capture and for metadata. The capture one is the first
+            with open(os.path.join(sys_dir, "index")) as f_in:
+                if int(f_in.read()) != 0:
+                    continue
+            with open(os.path.join(sys_dir, "name")) as f_in:
+                name = f_in.read().strip()
+        except (OSError, ValueError):  # no sysfs, probe it anyway
+            name = ""
+        candidates += [CameraInfo(index=int(match.group(1)), backend=backend, name=name, path=path)]
+    return sorted(candidates, key=lambda camera: camera.index)
+
+
+def probe_camera(camera: CameraInfo) -> bool:
+    """
+    Opens the camera, reads a frame, and fills in the modes with the resolutions in PROBE_RESOLUTIONS it supports
+    :param camera: the device to probe
+    :return: True if a frame was read, i.e. the camera works
+    """
+    from cv2 import cv2
+
+    cap = open_camera(camera)
+    try:
+        if not cap.isOpened() or not cap.read()[0]:
+            return False
+        modes = []
+        for width, height in PROBE_RESOLUTIONS:
+            cap.set(cv2.CAP_PROP_FRAME_WIDTH, width)
+            cap.set(cv2.CAP_PROP_FRAME_HEIGHT, height)
+            mode = [int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)), int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT)),
+                    round(cap.get(cv2.CAP_PROP_FPS), 2)]
+            if mode[0] > 0 and mode[1] > 0 and mode not in modes:  # unsupported ones come back as the nearest
+                modes += [mode]
+        camera.modes = sorted(modes)
+        return True
+    finally:
+        cap.release()
+
+
+def scan_cameras(timeout: float = PROBE_TIMEOUT) -> list:
+    """
+    Probes all the candidate devices at the same time
+    :param timeout: s, devices that haven't answered by then are left out. Their threads are left to finish by
+                    themselves, as a VideoCapture can't be cancelled
+    :return: list of CameraInfo objects of the working cameras, by index
+    """
+    found = {}  # index: CameraInfo
+
+    def probe(camera: CameraInfo):
+        try:
+            if probe_camera(camera):
+                found[camera.index] = camera
+        except Exception as e:
+            print("Failed to probe camera {}: {}".format(camera.index, e))
+            traceback.print_exc()
+
+    threads = []
+    for camera in candidate_devices():
+        thread = threading.Thread(target=probe, args=(camera,), name="camera_probe", daemon=True)
+        thread.start()
+        threads += [(camera, thread)]
+    deadline = time.monotonic() + timeout
+    for camera, thread in threads:
+        thread.join(timeout=max(deadline - time.monotonic(), 0.))
+        if thread.is_alive():
+            print("Camera {} didn't respond in {} s".format(camera.index, timeout))
+    return [found[index] for index in sorted(found)]
+
+
+def device_signature() -> list:
+    """
+    :return: what's connected, as far as can be told without opening the devices. None where the devices can't
+             be listed
+    """
+    if camera_backend() != "V4L2":
+        return None
+    return [[camera.path, camera.name] for camera in candidate_devices()]
+
+
+def load_cached_cameras(filename: str = CAMERA_CACHE_FILENAME) -> list:
+    """
+    :return: list of CameraInfo objects from the last scan, or None if there's none, or the devices connected have
+             changed since
+    """
+    try:
+        with open(filename, encoding="utf-8") as f_in:
+            cache = json.load(f_in)
+        if cache.get("backend") != camera_backend() or cache.get("signature") != device_signature():
+            return None
+        return [CameraInfo.from_dict(values) for values in cache["cameras"]]
+    except (OSError, ValueError, KeyError, TypeError):  # missing, or not a cache this version wrote
+        return None
+
+
+def save_cached_cameras(cameras: list, filename: str = CAMERA_CACHE_FILENAME) -> None:
+    cache = {
+        "backend": camera_backend(),
+        "signature": device_signature(),
+        "scanned": time.time(),
+        "cameras": [camera.to_dict() for camera in cameras],
+    }
+    try:
+        os.makedirs(os.path.dirname(filename) or ".", exist_ok=True)
+        with open(filename + ".partial", "w", encoding="utf-8") as f_out:
+            json.dump(cache, f_out, indent=2)
+        os.replace(filename + ".partial", filename)
+    except OSError as e:
+        print("Failed to save the camera list: {}".format(e))
+
+
+def discover_cameras(refresh: bool = False, timeout: float = PROBE_TIMEOUT) -> list:
+    """
+    Gets the cameras from the cache, or scans for them if the cache is out of date
+    :param refresh: True to scan even if the cache is up to date, e.g. when the user asks to
+    :param timeout: s, for each device to respond
+    :return: list of CameraInfo objects of the working cameras
+    """
+    if not refresh:
+        cameras = load_cached_cameras()
+        if cameras is not None:
+            return cameras
+    cameras = scan_cameras(timeout=timeout)
+    save_cached_cameras(cameras)
+    return cameras
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Scan for cameras and print what they support")
+    parser.add_argument("--cached", action="store_true", help="use the cached list if it's up to date")
+    parser.add_argument("--timeout", type=float, default=PROBE_TIMEOUT, help="s, for each device to respond")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    cameras = discover_cameras(refresh=not args.cached, timeout=args.timeout)
+    print("Found {} cameras in {:.3f} s".format(len(cameras), time.perf_counter() - start))
+    for camera in cameras:
+        print("{} ({})".format(camera.label(), camera.path or camera.backend))
+        for width, height, fps in camera.modes:
+            print("  {}x{} at {} fps".format(width, height, fps))
+
+
+if __name__ == "__main__":
+    main()
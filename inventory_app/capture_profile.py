@@ -0,0 +1,120 @@
+"""
+Capture profiles: the resolution, frame rate, codec and driver buffer the camera is opened with. Higher resolutions
+read smaller codes but take longer to decode, so the profile is a trade-off between the two. decode_benchmark.py
+--profiles shows how each one does.
+
+The profile is set in the [camera] section of the config file:
+    [camera]
+    profile = balanced
+and any of width, height, fps, fourcc and buffer_size there override the profile's. A section named
+[camera NAME] overrides them for one camera only, NAME being the name python camera_discovery.py shows for it, or
+its index if it has no name.
+"""
+import configparser
+
+from dbinterface import CONFIG_FILENAME
+
+
+class CaptureProfile:
+    """
+    Settings to open a camera with
+    """
+    def __init__(self, name: str, width: int, height: int, fps: float, fourcc: str = "MJPG", buffer_size: int = 1):
+        self.name = name
+        self.width = width
+        self.height = height
+        self.fps = fps
+        self.fourcc = fourcc  # codec from the camera. MJPG gets higher resolutions and rates through USB 2 than YUYV
+        self.buffer_size = buffer_size  # frames queued in the driver, 1 so the frame read is the newest one
+
+    def __str__(self):
+        return "{} {}x{} at {:g} fps, {}, buffer {}".format(self.name, self.width, self.height, self.fps,
+                                                             self.fourcc or "default codec", self.buffer_size)
+
+
+CAPTURE_PROFILES = {
+    "fast": CaptureProfile("fast", 640, 480, 30),
+    "balanced": CaptureProfile("balanced", 1280, 720, 30),
+    "detail": CaptureProfile("detail", 1920, 1080, 15),
+}
+DEFAULT_CAPTURE_PROFILE = "fast"
+
+
+def load_capture_profile(camera_name: str = "", config_filename: str = CONFIG_FILENAME) -> CaptureProfile:
+    """
+    :param camera_name: name of the camera, for its own section in the config file
+    :param config_filename: the config file
+    :return: the profile set in the config file, DEFAULT_CAPTURE_PROFILE if there's none
+    """
+    config = configparser.ConfigParser()
+    config.read(config_filename)
+    settings = {}
+    for section in ["camera", "camera " + camera_name]:
+        if config.has_section(section):
+            settings.update(config.items(section))
+
+    name = settings.get("profile", DEFAULT_CAPTURE_PROFILE)
+    if name not in CAPTURE_PROFILES:
+        print("Unknown capture profile {}, using {}".format(name, DEFAULT_CAPTURE_PROFILE))
+        name = DEFAULT_CAPTURE_PROFILE
+    base = CAPTURE_PROFILES[name]
+    try:
+        return CaptureProfile(name=name,
+                              width=int(settings.get("width", base.width)),
+                              height=int(settings.get("height", base.height)),
+                              fps=float(settings.get("fps", base.fps)),
+                              fourcc=settings.get("fourcc", base.fourcc),
+                              buffer_size=int(settings.get("buffer_size", base.buffer_size)))
+    except ValueError as e:
+        print("Invalid camera setting in {}, using the {} profile: {}".format(config_filename, name, e))
+        return base
+
+
+def negotiate_profile(profile: CaptureProfile, modes: list) -> CaptureProfile:
+    """
+    Picks the resolution the camera supports that's nearest to the profile's. The frame rate is left to the driver
+    to match, as the rates found by camera_discovery depend on the codec it happened to be using
+    :param profile: the profile wanted
+    :param modes: [width, height, fps] supported by the camera, from camera_discovery. Empty if not known
+    :return: the profile, with the resolution changed to one the camera supports
+    """
+    if len(modes) == 0:
+        return profile
+    area = profile.width * profile.height
+    width, height, _ = min(modes, key=lambda mode: (abs(mode[0] * mode[1] - area), -mode[0] * mode[1]))
+    return CaptureProfile(name=profile.name, width=width, height=height, fps=profile.fps, fourcc=profile.fourcc,
+                          buffer_size=profile.buffer_size)
+
+
+def camera_profile(camera) -> CaptureProfile:
+    """
+    :param camera: CameraInfo from camera_discovery
+    :return: the profile from the config file for the camera, at a resolution it supports
+    """
+    return negotiate_profile(load_capture_profile(camera.name or str(camera.index)), camera.modes)
+
+
+def apply_capture_profile(camera_cap, profile: CaptureProfile) -> CaptureProfile:
+    """
+    Sets the profile on an opened camera. The driver may not take all the settings
+    :param camera_cap: opened cv2.VideoCapture object
+    :param profile: the settings
+    :return: the settings the camera ended up with
+    """
+    from cv2 import cv2
+
+    if profile.fourcc:
+        # before the resolution, as some drivers only offer the higher ones with MJPG
+        camera_cap.set(cv2.CAP_PROP_FOURCC, cv2.VideoWriter_fourcc(*profile.fourcc))
+    camera_cap.set(cv2.CAP_PROP_FRAME_WIDTH, profile.width)
+    camera_cap.set(cv2.CAP_PROP_FRAME_HEIGHT, profile.height)
+    camera_cap.set(cv2.CAP_PROP_FPS, profile.fps)
+    camera_cap.set(cv2.CAP_PROP_BUFFERSIZE, profile.buffer_size)
+
+    fourcc = int(camera_cap.get(cv2.CAP_PROP_FOURCC))
+    return CaptureProfile(name=profile.name,
+                          width=int(camera_cap.get(cv2.CAP_PROP_FRAME_WIDTH)),
+                          height=int(camera_cap.get(cv2.CAP_PROP_FRAME_HEIGHT)),
+                          fps=camera_cap.get(cv2.CAP_PROP_FPS),
+                          fourcc="".join(chr((fourcc >> (8 * i)) & 0xff) for i in range(4)).strip("\x00"),
+                          buffer_size=int(camera_cap.get(cv2.CAP_PROP_BUFFERSIZE)))
@@ -1,6 +1,6 @@
 import wx
-from Inventory_GUI import ViewResultDialog_GUI, CheckoutDialog_GUI
-from dbinterface import ItemRecord, DbInterface
+from Inventory_GUI import ViewResultDialog_GUI, CheckoutDialog_GUI, CheckinDailog_GUI
+from dbinterface import ItemRecord, DbInterface, STAGING_FAILED, STAGING_IN_INVENTORY
 
 import collections
 
@@ -11,6 +11,7 @@ class ViewResultDialog(ViewResultDialog_GUI):
         self.db = None
         self.item = None
         self.checkout_dialog = CheckoutDialog(parent=self)
+        self.checkin_dialog = CheckinDialog(parent=self)
 
     def setup(self, item_to_show: ItemRecord, db: DbInterface):
         self.db = db
@@ -44,6 +45,22 @@ class ViewResultDialog(ViewResultDialog_GUI):
         self.checkout_dialog.setup(db=self.db, item=self.item)
         self.checkout_dialog.ShowModal()
 
+    def btn_checkin(self, event):
+        self.checkin_dialog.setup(db=self.db, item=self.item)
+        self.checkin_dialog.ShowModal()
+
+
+def item_display_name(item: ItemRecord) -> str:
+    """
+    :return: the name to show for an item in the dialogues. At least one of the 3 fields should be present
+    """
+    if item.manufacturer_pn != "":
+        return item.manufacturer_pn
+    elif item.supplier_pn != "":
+        return item.supplier_pn
+    else:
+        return item.name
+
 
 class CheckoutDialog(CheckoutDialog_GUI):
     def __init__(self, *args, **kwargs):
@@ -55,18 +72,15 @@ class CheckoutDialog(CheckoutDialog_GUI):
         self.db = db  # SQLite database connection to the model
         self.item = item
 
-        # populate the display fields. At least one of these 3 fields should be present
-        if item.manufacturer_pn != "":
-            name_to_show = item.manufacturer_pn
-        elif item.supplier_pn != "":
-            name_to_show = item.supplier_pn
-        else:
-            name_to_show = item.name
+        # the item may have been checked out somewhere else since it was loaded
+        current_item = db.get_item_by_code(dmtx=item.dmtx)
+        if current_item is not None:
+            item.quantity = current_item.quantity
 
-        # set the range limit for quantity deduction
+        # set the range limit for quantity deduction. The database checks it again when deducting
         self.spin_ctrl_checkout_quantity.SetRange(0, item.quantity)
 
-        self.label_checkout_item_name.SetLabel(name_to_show)
+        self.label_checkout_item_name.SetLabel(item_display_name(item))
         self.text_ctrl_proj.SetValue(item.used_by_proj)
         self.label_quantity.SetLabel(str(item.quantity))
         self.Fit()
@@ -75,12 +89,164 @@ class CheckoutDialog(CheckoutDialog_GUI):
         item: ItemRecord = self.item  # "type cast"
         db: DbInterface = self.db
 
-        item.used_by_proj = self.text_ctrl_proj.GetValue()
         to_deduct: int = self.spin_ctrl_checkout_quantity.GetValue()
-        item.quantity -= to_deduct
+        if to_deduct == 0:
+            wx.MessageBox("Enter the quantity to check out.", "Check Out", wx.OK | wx.ICON_WARNING, self)
+            return
+        new_quantity = db.adjust_quantity(dmtx=item.dmtx, delta=-to_deduct, project=self.text_ctrl_proj.GetValue())
+        if new_quantity is None:  # taken by someone else in the meantime
+            wx.MessageBox("Not enough left to check out {}. The quantity has been updated.".format(to_deduct),
+                          "Check Out", wx.OK | wx.ICON_WARNING, self)
+            self.setup(db=db, item=item)
+            return
 
-        db.update_component(item=item)
+        item.used_by_proj = self.text_ctrl_proj.GetValue()
+        item.quantity = new_quantity
         self.Show(show=False)
 
     def btn_checkout_cancel(self, event):
         self.Show(show=False)
+
+
+class CheckinDialog(CheckinDailog_GUI):
+    def __init__(self, *args, **kwargs):
+        CheckinDailog_GUI.__init__(self, *args, **kwargs)  # invoke constructor of the parent class
+        self.db = None
+        self.item = None
+        self.spin_ctrl_checkin_quantity.SetRange(0, 1000000)
+        # the generated label was copied over from the checkout dialogue
+        for child in self.GetChildren():
+            if isinstance(child, wx.StaticText) and child.GetLabel() == "Quantity to deduct:":
+                child.SetLabel("Quantity to return:")
+
+    def setup(self, db, item: ItemRecord):
+        self.db = db  # SQLite database connection to the model
+        self.item = item
+        self.label_checkin_item_name.SetLabel(item_display_name(item))
+        self.spin_ctrl_checkin_quantity.SetValue(0)
+        self.Fit()
+
+    def btn_checkin_ok(self, event):
+        item: ItemRecord = self.item  # "type cast"
+        db: DbInterface = self.db
+
+        to_return: int = self.spin_ctrl_checkin_quantity.GetValue()
+        if to_return == 0:
+            wx.MessageBox("Enter the quantity to return.", "Check In", wx.OK | wx.ICON_WARNING, self)
+            return
+        new_quantity = db.adjust_quantity(dmtx=item.dmtx, delta=to_return)
+        if new_quantity is None:
+            wx.MessageBox("The item is no longer in the database.", "Check In", wx.OK | wx.ICON_WARNING, self)
+            return
+
+        item.quantity = new_quantity
+        self.Show(show=False)
+
+    def btn_checkin_cancel(self, event):
+        self.Show(show=False)
+
+
+class BatchIntakeDialog(wx.Dialog):
+    """
+    Review of the codes scanned in batch intake mode, before they're committed to the inventory together
+    """
+    def __init__(self, *args, **kwargs):
+        kwargs["style"] = kwargs.get("style", 0) | wx.DEFAULT_DIALOG_STYLE | wx.RESIZE_BORDER
+        wx.Dialog.__init__(self, *args, **kwargs)
+        self.SetTitle("Batch Intake")
+        self.db = None
+        self.retry = None  # function to look up the failed codes again
+        self.staged = []  # (ItemRecord, status, error) shown in the list
+
+        font = wx.Font(12, wx.FONTFAMILY_DEFAULT, wx.FONTSTYLE_NORMAL, wx.FONTWEIGHT_NORMAL, 0, "Segoe UI")
+        self.list_ctrl_staged = wx.ListCtrl(self, wx.ID_ANY, size=(760, 360),
+                                            style=wx.LC_HRULES | wx.LC_REPORT | wx.LC_VRULES | wx.LC_SINGLE_SEL)
+        self.list_ctrl_staged.AppendColumn("Status", width=90)
+        self.list_ctrl_staged.AppendColumn("Supplier P/N", width=160)
+        self.list_ctrl_staged.AppendColumn("Manufacturer P/N", width=180)
+        self.list_ctrl_staged.AppendColumn("Quantity", width=80)
+        self.list_ctrl_staged.AppendColumn("Description / Error", width=240)
+        self.text_ctrl_location = wx.TextCtrl(self, wx.ID_ANY, "")
+        self.button_retry = wx.Button(self, wx.ID_ANY, "Retry Failed")
+        self.button_remove = wx.Button(self, wx.ID_ANY, "Remove Selected")
+        self.button_commit = wx.Button(self, wx.ID_ANY, "Commit All")
+        self.button_close = wx.Button(self, wx.ID_ANY, "Close")
+        for control in [self.list_ctrl_staged, self.text_ctrl_location, self.button_retry,
+                        self.button_remove, self.button_commit, self.button_close]:
+            control.SetFont(font)
+
+        sizer_main = wx.BoxSizer(wx.VERTICAL)
+        sizer_main.Add(self.list_ctrl_staged, 1, wx.ALL | wx.EXPAND, 5)
+        sizer_buttons = wx.BoxSizer(wx.HORIZONTAL)
+        label_location = wx.StaticText(self, wx.ID_ANY, "Location: *")
+        label_location.SetFont(font)
+        sizer_buttons.Add(label_location, 0, wx.ALIGN_CENTER | wx.ALL, 5)
+        sizer_buttons.Add(self.text_ctrl_location, 1, wx.ALL | wx.EXPAND, 5)
+        sizer_buttons.Add(self.button_retry, 0, wx.ALL, 5)
+        sizer_buttons.Add(self.button_remove, 0, wx.ALL, 5)
+        sizer_buttons.Add(self.button_commit, 0, wx.ALL, 5)
+        sizer_buttons.Add(self.button_close, 0, wx.ALL, 5)
+        sizer_main.Add(sizer_buttons, 0, wx.EXPAND, 0)
+        self.SetSizer(sizer_main)
+        sizer_main.Fit(self)
+        self.Layout()
+
+        self.Bind(wx.EVT_BUTTON, self.btn_retry, self.button_retry)
+        self.Bind(wx.EVT_BUTTON, self.btn_remove, self.button_remove)
+        self.Bind(wx.EVT_BUTTON, self.btn_commit, self.button_commit)
+        self.Bind(wx.EVT_BUTTON, self.btn_close, self.button_close)
+
+    def setup(self, db: DbInterface, retry):
+        self.db = db
+        self.retry = retry
+        self.refresh()
+
+    def refresh(self):
+        """
+        Reloads the staged codes, e.g. when a lookup has finished
+        :return: None
+        """
+        if self.db is None:
+            return
+        self.staged = self.db.get_staged()
+        self.list_ctrl_staged.DeleteAllItems()
+        for item, status, error in self.staged:
+            index = self.list_ctrl_staged.InsertItem(self.list_ctrl_staged.GetItemCount(), status)
+            self.list_ctrl_staged.SetItem(index, 1, item.supplier_pn or "")
+            self.list_ctrl_staged.SetItem(index, 2, item.manufacturer_pn or "")
+            self.list_ctrl_staged.SetItem(index, 3, str(item.quantity or ""))
+            if status in [STAGING_FAILED, STAGING_IN_INVENTORY]:
+                self.list_ctrl_staged.SetItem(index, 4, error or "")
+            else:
+                self.list_ctrl_staged.SetItem(index, 4, item.description or "")
+
+    def btn_retry(self, event):
+        self.retry()
+
+    def btn_remove(self, event):
+        index = self.list_ctrl_staged.GetFirstSelected()
+        if index == wx.NOT_FOUND:
+            return
+        self.db.remove_staged(dmtx=self.staged[index][0].dmtx)
+        self.refresh()
+
+    def btn_commit(self, event):
+        location = self.text_ctrl_location.GetValue()
+        if location == "":
+            dialog = wx.MessageDialog(self, "The Location field can't be empty", "Error", wx.OK | wx.ICON_ERROR)
+            dialog.ShowModal()
+            dialog.Destroy()
+            return
+        committed = self.db.commit_staged(location=location)
+        print("Committed {} items from the batch intake".format(committed))
+        self.refresh()
+        in_inventory = sum(1 for _, status, _ in self.staged if status == STAGING_IN_INVENTORY)
+        if in_inventory > 0:
+            dialog = wx.MessageDialog(self, "{} of the codes are already in the inventory and were not committed. "
+                                            "Scan them outside batch mode to edit them".format(in_inventory),
+                                      "Info", wx.OK | wx.ICON_INFORMATION)
+            dialog.ShowModal()
+            dialog.Destroy()
+
+    def btn_close(self, event):
+        self.Show(show=False)
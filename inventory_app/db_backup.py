@@ -0,0 +1,366 @@
+"""
+Backs up the inventory database while the app is using it, on a schedule, and restores it from the snapshots.
+The snapshots are taken with SQLite's online backup API a few pages at a time, so saves and searches carry on in
+between, unlike copying the file, which can catch it halfway through a save.
+
+Usage: python db_backup.py backup|list|verify|restore [SNAPSHOT]
+"""
+import argparse
+import configparser
+from datetime import datetime
+import gzip
+import os
+import shutil
+import sqlite3
+import sys
+import threading
+import time
+import traceback
+
+from dbinterface import DB_FILENAME, CONFIG_FILENAME, BUSY_TIMEOUT
+
+BACKUP_DIR = "AppData/backups"
+BACKUP_INTERVAL = 24  # hours between scheduled snapshots
+BACKUP_KEEP_LAST = 7  # most recent snapshots always kept
+BACKUP_KEEP_DAILY = 30  # days for which the newest snapshot of the day is also kept
+BACKUP_COMPRESS = True  # gzip the snapshots
+
+BACKUP_PAGES_PER_STEP = 64  # database pages copied at a time
+BACKUP_STEP_SLEEP = 0.005  # s, pause between the steps, for the app's own connections to get the locks
+SNAPSHOT_PREFIX = "inventory-"
+SNAPSHOT_TIME_FORMAT = "%Y%m%d-%H%M%S"
+SNAPSHOT_EXTENSIONS = [".db", ".db.gz"]
+
+
+def copy_database(source: sqlite3.Connection, dest_filename: str, pages: int = BACKUP_PAGES_PER_STEP,
+                  sleep: float = BACKUP_STEP_SLEEP) -> None:
+    """
+    Copies a database into a new file with the backup API, a few pages at a time. If another connection writes to
+    the source in between, SQLite starts the copy over, so the result is always a consistent snapshot
+    :param source: connection to the database to copy
+    :param dest_filename: file for the copy, overwritten if present
+    :param pages: pages copied per step
+    :param sleep: s, pause between the steps
+    :return: None
+    """
+    dest = sqlite3.connect(dest_filename)
+    try:
+        source.backup(dest, pages=pages, sleep=sleep)
+        # the snapshot is a single file, whatever journal mode the source uses
+        dest.execute("PRAGMA journal_mode=DELETE")
+    finally:
+        dest.close()
+
+
+def compress_file(filename: str) -> str:
+    """
+    Replaces a file with its gzipped version
+    :return: the name of the compressed file
+    """
+    gz_filename = filename + ".gz"
+    with open(filename, "rb") as f_in, gzip.open(gz_filename, "wb") as f_out:
+        shutil.copyfileobj(f_in, f_out)
+    os.remove(filename)
+    return gz_filename
+
+
+def integrity_problems(filename: str) -> list:
+    """
+    :param filename: SQLite database file, not compressed
+    :return: list of the problems found by PRAGMA integrity_check, empty if the database is fine
+    """
+    conn = sqlite3.connect(filename)
+    try:
+        results = [row[0] for row in conn.execute("PRAGMA integrity_check")]
+    except sqlite3.DatabaseError as e:  # not a database at all
+        return [str(e)]
+    finally:
+        conn.close()
+    if results == ["ok"]:
+        return []
+    return results
+
+
+def snapshot_time(filename: str):
+    """
+    :param filename: snapshot file name, with or without the directory
+    :return: datetime the snapshot was taken, or None if it is not a snapshot file
+    """
+    name = os.path.basename(filename)
+    for extension in SNAPSHOT_EXTENSIONS:
+        if name.startswith(SNAPSHOT_PREFIX) and name.endswith(extension):
+            try:
+                return datetime.strptime(name[len(SNAPSHOT_PREFIX):-len(extension)], SNAPSHOT_TIME_FORMAT)
+            except ValueError:
+                return None
+    return None
+
+
+def list_snapshots(backup_dir: str = BACKUP_DIR) -> list:
+    """
+    :return: list of (datetime, file name) of the snapshots in the directory, the newest first
+    """
+    if not os.path.isdir(backup_dir):
+        return []
+    snapshots = []
+    for name in os.listdir(backup_dir):
+        taken = snapshot_time(name)
+        if taken is not None:
+            snapshots += [(taken, os.path.join(backup_dir, name))]
+    snapshots.sort(reverse=True)
+    return snapshots
+
+
+def expired_snapshots(snapshots: list, keep_last: int = BACKUP_KEEP_LAST, keep_daily: int = BACKUP_KEEP_DAILY,
+                      now: datetime = None) -> list:
+    """
+    Works out which snapshots the retention policy drops: the newest keep_last snapshots are kept, and for each of
+    the last keep_daily days, the newest snapshot taken that day
+    :param snapshots: from list_snapshots(), the newest first
+    :param keep_last: number of most recent snapshots to keep
+    :param keep_daily: number of days to keep one snapshot for
+    :param now: the current time, for testing
+    :return: list of the file names to delete
+    """
+    if now is None:
+        now = datetime.now()
+    kept_days = set()
+    expired = []
+    for index, (taken, filename) in enumerate(snapshots):
+        day = taken.date()
+        if index < keep_last:
+            kept_days.add(day)
+        elif day not in kept_days and (now.date() - day).days < keep_daily:
+            kept_days.add(day)
+        else:
+            expired += [filename]
+    return expired
+
+
+def take_snapshot(db_filename: str = DB_FILENAME, backup_dir: str = BACKUP_DIR, compress: bool = BACKUP_COMPRESS,
+                  pages: int = BACKUP_PAGES_PER_STEP, sleep: float = BACKUP_STEP_SLEEP) -> str:
+    """
+    Backs up the database into a new snapshot file and checks the copy
+    :param db_filename: the database to back up
+    :param backup_dir: directory for the snapshots, created if needed
+    :param compress: True to gzip the snapshot
+    :param pages: pages copied per step
+    :param sleep: s, pause between the steps
+    :return: file name of the snapshot
+    :raises sqlite3.DatabaseError: if the copy fails the integrity check, after deleting it
+    """
+    os.makedirs(backup_dir, exist_ok=True)
+    name = SNAPSHOT_PREFIX + datetime.now().strftime(SNAPSHOT_TIME_FORMAT)
+    filename = os.path.join(backup_dir, name + ".db")
+    partial_filename = filename + ".partial"  # not listed as a snapshot until it is complete
+
+    source = sqlite3.connect(db_filename, timeout=BUSY_TIMEOUT)
+    try:
+        source.execute("PRAGMA query_only=1")
+        copy_database(source=source, dest_filename=partial_filename, pages=pages, sleep=sleep)
+    finally:
+        source.close()
+
+    problems = integrity_problems(partial_filename)
+    if len(problems) > 0:
+        os.remove(partial_filename)
+        raise sqlite3.DatabaseError("Snapshot failed the integrity check: {}".format("; ".join(problems[:5])))
+    os.replace(partial_filename, filename)
+    if compress:
+        filename = compress_file(filename)
+    return filename
+
+
+def prune_snapshots(backup_dir: str = BACKUP_DIR, keep_last: int = BACKUP_KEEP_LAST,
+                    keep_daily: int = BACKUP_KEEP_DAILY) -> list:
+    """
+    Deletes the snapshots the retention policy drops, see expired_snapshots()
+    :return: list of the deleted file names
+    """
+    expired = expired_snapshots(list_snapshots(backup_dir), keep_last=keep_last, keep_daily=keep_daily)
+    for filename in expired:
+        os.remove(filename)
+    return expired
+
+
+def open_snapshot(snapshot: str, work_filename: str) -> str:
+    """
+    :param snapshot: snapshot file, compressed or not
+    :param work_filename: file to decompress a compressed snapshot into
+    :return: the file name of the uncompressed snapshot
+    """
+    if not snapshot.endswith(".gz"):
+        return snapshot
+    with gzip.open(snapshot, "rb") as f_in, open(work_filename, "wb") as f_out:
+        shutil.copyfileobj(f_in, f_out)
+    return work_filename
+
+
+def verify_snapshot(snapshot: str) -> list:
+    """
+    :param snapshot: snapshot file, compressed or not
+    :return: list of the problems found by the integrity check, empty if the snapshot is fine
+    """
+    work_filename = snapshot + ".verify"
+    try:
+        return integrity_problems(open_snapshot(snapshot, work_filename))
+    except (OSError, EOFError) as e:  # damaged gzip file
+        return [str(e)]
+    finally:
+        if os.path.exists(work_filename):
+            os.remove(work_filename)
+
+
+def restore_snapshot(snapshot: str, db_filename: str = DB_FILENAME) -> bool:
+    """
+    Replaces the database with a snapshot, after checking the snapshot. The app should be closed, as its open
+    connections would keep the pages they have cached. The database is written through the backup API rather than
+    by replacing the file, so an existing -wal file can't be replayed over the restored data
+    :param snapshot: snapshot file, compressed or not
+    :param db_filename: the database to restore
+    :return: True if restored, False if the snapshot failed the integrity check and nothing was changed
+    """
+    work_filename = db_filename + ".restore"
+    try:
+        try:
+            snapshot_filename = open_snapshot(snapshot, work_filename)
+            problems = integrity_problems(snapshot_filename)
+        except (OSError, EOFError) as e:  # damaged gzip file
+            problems = [str(e)]
+        if len(problems) > 0:
+            print("Snapshot {} failed the integrity check, database NOT restored:".format(snapshot))
+            for problem in problems[:10]:
+                print("  " + problem)
+            return False
+
+        source = sqlite3.connect(snapshot_filename)
+        dest = sqlite3.connect(db_filename, timeout=BUSY_TIMEOUT)
+        try:
+            source.backup(dest)
+        finally:
+            source.close()
+            dest.close()
+    finally:
+        if os.path.exists(work_filename):
+            os.remove(work_filename)
+
+    problems = integrity_problems(db_filename)
+    if len(problems) > 0:
+        print("Restored database failed the integrity check: {}".format("; ".join(problems[:5])))
+        return False
+    return True
+
+
+class BackupService:
+    """
+    Takes a snapshot of the database on a background thread every BACKUP_INTERVAL hours, counted from the newest
+    snapshot so restarting the app doesn't reset the schedule, and prunes the old ones.
+    The settings can be changed in the [backup] section of the config file: interval (hours, 0 to turn the
+    scheduled backups off), keep_last, keep_daily and compress.
+    """
+    def __init__(self, db_filename: str = DB_FILENAME, backup_dir: str = BACKUP_DIR):
+        config = configparser.ConfigParser()
+        config.read(CONFIG_FILENAME)
+        self.db_filename = db_filename
+        self.backup_dir = config.get("backup", "directory", fallback=backup_dir)
+        self.interval = config.getfloat("backup", "interval", fallback=BACKUP_INTERVAL) * 3600  # s
+        self.keep_last = config.getint("backup", "keep_last", fallback=BACKUP_KEEP_LAST)
+        self.keep_daily = config.getint("backup", "keep_daily", fallback=BACKUP_KEEP_DAILY)
+        self.compress = config.getboolean("backup", "compress", fallback=BACKUP_COMPRESS)
+
+        self.lock = threading.Lock()  # one snapshot at a time
+        self.stopping = threading.Event()
+        self.thread = None
+        self.last_snapshot = None  # file name of the newest snapshot taken by this service
+
+    def start(self) -> None:
+        if self.interval <= 0:
+            return
+        self.stopping.clear()
+        self.thread = threading.Thread(target=self.schedule_loop, name="backup", daemon=True)
+        self.thread.start()
+
+    def stop(self) -> None:
+        """
+        Stops the schedule. A snapshot being taken is finished first, so the database can be closed afterwards
+        :return: None
+        """
+        self.stopping.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+    def backup_now(self):
+        """
+        Takes a snapshot and prunes the old ones. Can be called from any thread
+        :return: the file name of the snapshot, or None if it failed
+        """
+        with self.lock:
+            try:
+                start = time.perf_counter()
+                self.last_snapshot = take_snapshot(db_filename=self.db_filename, backup_dir=self.backup_dir,
+                                                   compress=self.compress)
+                print("Database backed up to {} in {:.1f} s".format(self.last_snapshot,
+                                                                     time.perf_counter() - start))
+                prune_snapshots(backup_dir=self.backup_dir, keep_last=self.keep_last, keep_daily=self.keep_daily)
+                return self.last_snapshot
+            except (sqlite3.Error, OSError):  # try again at the next interval
+                print("Database backup failed!")
+                traceback.print_exc()
+                return None
+
+    def seconds_until_due(self) -> float:
+        snapshots = list_snapshots(self.backup_dir)
+        if len(snapshots) == 0:
+            return 0.
+        age = (datetime.now() - snapshots[0][0]).total_seconds()
+        return max(0., self.interval - age)
+
+    def schedule_loop(self) -> None:
+        while not self.stopping.is_set():
+            if self.stopping.wait(timeout=self.seconds_until_due()):
+                break
+            if self.backup_now() is None:
+                self.stopping.wait(timeout=min(self.interval, 3600))  # don't retry a failing backup straight away
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Back up, check and restore the inventory database")
+    parser.add_argument("action", choices=["backup", "list", "verify", "restore"])
+    parser.add_argument("snapshot", nargs="?", help="snapshot to verify or restore, the newest if left out")
+    parser.add_argument("--db", default=DB_FILENAME, help="database file")
+    args = parser.parse_args()
+
+    service = BackupService(db_filename=args.db)
+    if args.action == "backup":
+        if service.backup_now() is None:
+            return 1
+        return 0
+
+    snapshots = list_snapshots(service.backup_dir)
+    if args.action == "list":
+        for taken, filename in snapshots:
+            print("{}  {:>10} bytes  {}".format(taken, os.path.getsize(filename), filename))
+        return 0
+
+    snapshot = args.snapshot
+    if snapshot is None:
+        if len(snapshots) == 0:
+            print("No snapshots in {}".format(service.backup_dir))
+            return 1
+        snapshot = snapshots[0][1]
+    if args.action == "verify":
+        problems = verify_snapshot(snapshot)
+        for problem in problems[:10]:
+            print(problem)
+        print("{}: {}".format(snapshot, "OK" if len(problems) == 0 else "FAILED"))
+        return 0 if len(problems) == 0 else 1
+
+    if not restore_snapshot(snapshot, db_filename=args.db):
+        return 1
+    print("Restored {} from {}".format(args.db, snapshot))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,11 +1,119 @@
+from collections import OrderedDict
+from contextlib import contextmanager
+import configparser
+import copy
+import platform
+import queue
 import sqlite3
+import threading
+import time
 import traceback
 
+DB_FILENAME = "AppData/inventory.db"
+CONFIG_FILENAME = "AppData/inventory.ini"  # the optional [database] section overrides the settings below
+
+# WAL lets searches read the database while a save is writing to it. It needs the database on a local disk,
+# so the README explains switching to DELETE for network locations
+JOURNAL_MODE = "WAL"
+JOURNAL_MODES = ["WAL", "DELETE", "TRUNCATE", "PERSIST"]  # the journal modes that keep the database safe
+READER_POOL_SIZE = 4  # most connections reading the database at once
+BUSY_TIMEOUT = 5  # seconds to wait for another connection or instance to release a lock
+MMAP_SIZE = 256 * 1024 * 1024  # bytes of the file read through memory mapping, 0 to turn it off
+CACHE_SIZE = 16 * 1024  # KiB of page cache per connection
+
+# columns of "FSAE47 Inventory" that can be searched, in table order
+SEARCH_COLUMNS = ["Name", "Supplier P/N", "Manufacturer P/N", "Location", "Quantity", "Category", "Description",
+                  "Supplier", "Manufacturer", "Used by Project", "Customer Ref", "Comment"]
+
+# columns in the full-text index. The quantity is left out, as it changes with every stock movement and each change
+# would rewrite the record's index entry. It's searched in the table instead
+FTS_COLUMNS = [col for col in SEARCH_COLUMNS if col != "Quantity"]
+
+# columns looked up by exact values or prefixes, with a case-insensitive index each
+INDEXED_COLUMNS = ["Supplier P/N", "Manufacturer P/N", "Location", "Used by Project", "Customer Ref"]
+
+# how a search term matches, see parse_search_term()
+MATCH_SUBSTRING = "substring"
+MATCH_PREFIX = "prefix"
+MATCH_EXACT = "exact"
+
+# the trigram tokenizer can't match anything shorter than 3 characters
+FTS_MIN_KEYWORD_LEN = 3
+
+# FROM clause for searches going through the full-text index
+FTS_FROM_SQL = 'FROM "FSAE47 Inventory FTS" ' \
+               'JOIN "FSAE47 Inventory" ON "FSAE47 Inventory".rowid = "FSAE47 Inventory FTS".rowid '
+
+# status of the scans in the intake staging table
+STAGING_PENDING = "Pending"
+STAGING_RESOLVED = "Resolved"
+STAGING_FAILED = "Failed"
+STAGING_IN_INVENTORY = "In Inventory"  # not stored, get_staged() reports it for codes already in the inventory
+
+# turns an INSERT into "FSAE47 Inventory" into an upsert, updating the record with the same data matrix code.
+# The quantity is left alone, as it only changes through the stock movements
+UPSERT_CONFLICT_SQL = 'ON CONFLICT("Dmtx Raw") DO UPDATE SET ' + \
+                      ', '.join('"{0}" = excluded."{0}"'.format(col) for col in SEARCH_COLUMNS if col != "Quantity")
+
+# why the stock of an item changed, for the "Reason" column of "Stock Movements"
+MOVEMENT_OPENING = "Opening"  # quantity from before the movements were recorded
+MOVEMENT_ADD = "Add"  # saved from a scan or the edit tab, the quantity is set to the one entered
+MOVEMENT_EDIT = "Edit"
+MOVEMENT_CHECKOUT = "Checkout"
+MOVEMENT_CHECKIN = "Checkin"
+MOVEMENT_DELETE = "Delete"
+
+# columns of "Stock Movements" written by the movement SQL below, in order
+MOVEMENT_COLUMNS_SQL = '"Dmtx Raw", "Delta", "Balance", "Project", "Timestamp", "Station", "Reason"'
+
+# adds an item without stock, which then comes in as a movement. Takes ItemRecord.to_db_row() without the quantity
+INSERT_ITEM_SQL = 'INSERT INTO "FSAE47 Inventory" VALUES(?, ?, ?, ?, 0, ?, ?, ?, ?, ?, ?, ?, ?) '
+
+# adds an item with its stock, after its first movement is recorded with NEW_ITEM_MOVEMENT_SQL. The trigger on
+# "Stock Movements" finds no item to update then, so the quantity is written once. Takes ItemRecord.to_db_row()
+NEW_ITEM_SQL = 'INSERT INTO "FSAE47 Inventory" VALUES(?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?) '
+NEW_ITEM_MOVEMENT_SQL = 'INSERT INTO "Stock Movements"(' + MOVEMENT_COLUMNS_SQL + ') ' \
+                        'VALUES(:dmtx, :qty, :qty, :proj, :ts, :station, :reason)'
+
+# records a movement bringing the quantity of an item to :qty, if it isn't there already.
+# The trigger on "Stock Movements" then updates the quantity
+SET_QUANTITY_SQL = 'INSERT INTO "Stock Movements"(' + MOVEMENT_COLUMNS_SQL + ') ' \
+                   'SELECT "Dmtx Raw", :qty - "Quantity", :qty, :proj, :ts, :station, :reason ' \
+                   'FROM "FSAE47 Inventory" WHERE "Dmtx Raw" = :dmtx AND "Quantity" != :qty'
+
+SEARCH_PAGE_SIZE = 100  # number of records fetched at a time for display
+COUNT_ESTIMATE_CAP = 1000  # searches stop counting the matches beyond this, and show "1000+"
+DMTX_SERIAL_DIGITS = 7  # digits of the numbers used in place of the data matrix code, padded with zeros
+LIST_DESCRIPTION_LEN = 100  # characters of the description fetched for list views
+EXPORT_CHUNK_SIZE = 5000  # records fetched at a time when streaming the whole table
+ITEM_CACHE_SIZE = 256  # records kept in memory for looking up scanned codes
+SEARCH_CACHE_SIZE = 32  # first pages of recent basic searches kept in memory, for search-as-you-type
+
+# columns selected for list views, in the table order: the data matrix code is left out (NULL) and the description
+# is shortened, as the code can be long and neither is needed until the record is opened
+LIST_COLUMNS_SQL = ", ".join('"FSAE47 Inventory"."{}"'.format(col) if col != "Description" else
+                             'substr("FSAE47 Inventory"."Description", 1, {})'.format(LIST_DESCRIPTION_LEN)
+                             for col in SEARCH_COLUMNS) + ", NULL"
+
+
+class NotEnoughStock(Exception):
+    """
+    Raised inside a write transaction to roll it back when an item doesn't have the quantity being taken
+    """
+    def __init__(self, dmtx: bytes):
+        super().__init__("Not enough stock of {}".format(dmtx))
+        self.dmtx = dmtx
+
 
 class ItemRecord:
     """
-    Corresponds to a record in the database. Useful for passing information around
+    Corresponds to a record in the database. Useful for passing information around.
+    Uses __slots__ instead of a __dict__ per object, as a search can load many thousands of them.
     """
+    __slots__ = ["name", "supplier_pn", "manufacturer_pn", "location", "quantity", "category", "description",
+                 "supplier", "manufacturer", "used_by_proj", "customer_ref", "comment", "dmtx", "has_dmtx",
+                 "rowid", "rank", "is_summary"]
+
     def __init__(self,
                  has_dmtx,
                  loc: str = "",
@@ -40,37 +148,332 @@ class ItemRecord:
         # If it's true and dmtx is empty, the object is not ready to be stored into the DB
         self.has_dmtx = has_dmtx
 
+        self.rowid = None  # rowid in "FSAE47 Inventory", for records loaded from the database
+        self.rank = None  # bm25 rank in the search that found the record, None if not ranked
+        # True for records loaded for a list view, without the data matrix code and with a shortened description.
+        # DbInterface.get_full_item() loads the rest
+        self.is_summary = False
+
     @classmethod
     def from_db_row(cls, db_row: tuple):
-        dmtx = db_row[12]
-        if (dmtx is not None) and (dmtx != b""):
-            has_dmtx = True
-        else:
-            has_dmtx = False
-
-        return cls(
-            has_dmtx=has_dmtx,
-            name=db_row[0],
-            pn=db_row[1],
-            mfg_pn=db_row[2],
-            loc=db_row[3],
-            qty=db_row[4],
-            cat=db_row[5],
-            desc=db_row[6],
-            supplier=db_row[7],
-            manufacturer=db_row[8],
-            proj=db_row[9],
-            cust_ref=db_row[10],
-            comment=db_row[11],
-            dmtx=db_row[12]
-        )
-
-
-def db_rows_to_itemrecords(db_rows: list):
-    results = []
-    for row in db_rows:
-        results += [ItemRecord.from_db_row(db_row=row)]
-    return results
+        """
+        Builds the record straight from a row, without going through __init__
+        :param db_row: the 13 columns of the database in order, optionally followed by the rowid and the rank
+        :return: the ItemRecord object
+        """
+        item = cls.__new__(cls)
+        (item.name, item.supplier_pn, item.manufacturer_pn, item.location, item.quantity, item.category,
+         item.description, item.supplier, item.manufacturer, item.used_by_proj, item.customer_ref, item.comment,
+         item.dmtx) = db_row[:13]
+        item.has_dmtx = (item.dmtx is not None) and (item.dmtx != b"")
+        item.rowid = db_row[13] if len(db_row) > 13 else None
+        item.rank = db_row[14] if len(db_row) > 14 else None
+        item.is_summary = False
+        return item
+
+    @classmethod
+    def from_summary_row(cls, db_row: tuple):
+        """
+        Builds a record from a row selected with LIST_COLUMNS_SQL
+        :param db_row: the row, followed by the rowid and the rank
+        :return: the ItemRecord object, with is_summary set
+        """
+        item = cls.from_db_row(db_row=db_row)
+        item.has_dmtx = False  # not known until the full record is loaded
+        item.is_summary = True
+        return item
+
+    def to_db_row(self, quantity: bool = True) -> tuple:
+        """
+        :param quantity: False to leave out the quantity, which is stored through the stock movements
+        :return: the values of the record, in the column order of the database
+        """
+        if not quantity:
+            return (self.name,
+                    self.supplier_pn,
+                    self.manufacturer_pn,
+                    self.location,
+                    self.category,
+                    self.description,
+                    self.supplier,
+                    self.manufacturer,
+                    self.used_by_proj,
+                    self.customer_ref,
+                    self.comment,
+                    self.dmtx)
+        return (self.name,
+                self.supplier_pn,
+                self.manufacturer_pn,
+                self.location,
+                self.quantity,
+                self.category,
+                self.description,
+                self.supplier,
+                self.manufacturer,
+                self.used_by_proj,
+                self.customer_ref,
+                self.comment,
+                self.dmtx)
+
+
+def dmtx_serial_bytes(dmtx_ser_int: int) -> bytes:
+    """
+    :return: the number used in place of the data matrix code, as stored in the database
+    """
+    return bytes("{:0{}d}".format(dmtx_ser_int, DMTX_SERIAL_DIGITS), "ascii")
+
+
+def is_dmtx_serial(dmtx: bytes) -> bool:
+    """
+    :return: True if the code has the format of dmtx_serial_bytes(), not e.g. a barcode that is also all digits
+    """
+    return dmtx is not None and len(dmtx) == DMTX_SERIAL_DIGITS and dmtx.isdigit()
+
+
+class SearchPage:
+    """
+    One page of search results, with the continuation token for fetching the next page
+    """
+    def __init__(self, items: list, cursor, total_estimate: int = None, total_is_exact: bool = False):
+        self.items: list = items  # the ItemRecord objects in this page
+        # opaque token to pass back into the search for the next page. None if this is the last page
+        self.cursor: tuple = cursor
+        # number of matches, counted up to COUNT_ESTIMATE_CAP. Only filled in for the first page, None otherwise
+        self.total_estimate: int = total_estimate
+        self.total_is_exact: bool = total_is_exact  # False if the counting stopped at the cap
+
+    def describe_total(self) -> str:
+        """
+        :return: the number of matches for showing, like "42 results" or "1000+ results". Empty after the first page
+        """
+        if self.total_estimate is None:
+            return ""
+        return "{}{} result{}".format(self.total_estimate, "" if self.total_is_exact else "+",
+                                      "" if self.total_estimate == 1 else "s")
+
+
+class LruCache:
+    """
+    Keeps the most recently used values in memory, like the records of scanned codes or the results of searches.
+    DbInterface clears it on every write
+    """
+    def __init__(self, capacity: int, copy_values: bool = False):
+        """
+        :param capacity: most values kept
+        :param copy_values: True to store and hand out copies, for values that callers may change
+        """
+        self.capacity = capacity
+        self.copy_values = copy_values
+        self.lock = threading.Lock()  # lookups can come from any thread
+        self.values = OrderedDict()  # the least recently used first
+        # counts the clears, so a lookup that started before a write can't put the old value back afterwards
+        self.generation = 0
+
+    def get(self, key):
+        """
+        :return: the cached value, or None if it's not cached
+        """
+        with self.lock:
+            value = self.values.get(key)
+            if value is None:
+                return None
+            self.values.move_to_end(key)
+            return copy.copy(value) if self.copy_values else value
+
+    def put(self, key, value, generation: int) -> None:
+        """
+        :param key: the key to find the value by
+        :param value: the value just loaded from the database
+        :param generation: value of self.generation from before the value was loaded
+        :return: None
+        """
+        with self.lock:
+            if generation != self.generation:  # written since, the value may be out of date
+                return
+            self.values[key] = copy.copy(value) if self.copy_values else value
+            self.values.move_to_end(key)
+            if len(self.values) > self.capacity:
+                self.values.popitem(last=False)
+
+    def clear(self) -> None:
+        with self.lock:
+            self.values.clear()
+            self.generation += 1
+
+
+def item_row_factory(db_cur: sqlite3.Cursor, db_row: tuple) -> ItemRecord:
+    """
+    Row factory for cursors selecting whole records, so the rows come out of the cursor as ItemRecord objects
+    """
+    return ItemRecord.from_db_row(db_row=db_row)
+
+
+def summary_row_factory(db_cur: sqlite3.Cursor, db_row: tuple) -> ItemRecord:
+    """
+    Row factory for cursors selecting LIST_COLUMNS_SQL
+    """
+    return ItemRecord.from_summary_row(db_row=db_row)
+
+
+def fts_phrase(keyword: str) -> str:
+    """
+    Quotes a search keyword as an FTS5 phrase, so that the user input is never parsed as query syntax
+    :param keyword: search keyword as typed by the user
+    :return: the keyword as an FTS5 string
+    """
+    return '"' + keyword.replace('"', '""') + '"'
+
+
+def parse_search_term(keyword: str) -> tuple:
+    """
+    Works out how a search term should match. Terms in double quotes like "RC0603FR-07" match the whole field,
+    terms ending with * like RC0603* match the start of the field, and anything else matches anywhere in the field.
+    Exact and prefix matches on the INDEXED_COLUMNS are looked up in the index instead of scanning the table.
+    :param keyword: search term as typed by the user
+    :return: (one of the MATCH_* values, the term without the quotes or *)
+    """
+    if len(keyword) > 2 and keyword.startswith('"') and keyword.endswith('"'):
+        return MATCH_EXACT, keyword[1:-1]
+    if len(keyword.rstrip("*")) > 0 and keyword.endswith("*"):
+        return MATCH_PREFIX, keyword.rstrip("*")
+    return MATCH_SUBSTRING, keyword
+
+
+class ConnectionManager:
+    """
+    Hands out connections to the SQLite file, so that different threads don't share a cursor.
+    There is one writer connection, used by one thread at a time, and a small pool of read-only connections.
+    In WAL mode the readers see the last committed data and don't wait for the writer, and the other way around.
+    """
+    def __init__(self, filename: str, journal_mode: str = JOURNAL_MODE, mmap_size: int = MMAP_SIZE,
+                 pool_size: int = READER_POOL_SIZE):
+        """
+        :param filename: file name for the database file
+        :param journal_mode: one of JOURNAL_MODES
+        :param mmap_size: bytes of the file read through memory mapping, 0 to turn it off
+        :param pool_size: most connections reading the database at once
+        """
+        journal_mode = journal_mode.upper()
+        if journal_mode not in JOURNAL_MODES:  # put into the SQL directly, so check it first
+            raise ValueError("Unsupported journal mode: {}".format(journal_mode))
+        self.filename = filename
+        self.mmap_size = int(mmap_size)
+
+        self.write_conn = self.open_connection()
+        self.write_lock = threading.RLock()
+        self.write_depth = 0  # number of nested writer() blocks in the thread holding the lock
+        self.commit_listeners = []  # functions called after each write transaction is committed
+        # only reads PRAGMA data_version, so checking for writes from other instances doesn't wait for the writer
+        self.version_conn = self.open_connection()
+        self.version_conn.execute("PRAGMA query_only=ON")
+        self.version_lock = threading.Lock()
+
+        # the journal mode is stored in the database file, so it only needs to be set on one connection
+        self.journal_mode = self.write_conn.execute("PRAGMA journal_mode={}".format(journal_mode)).fetchone()[0]
+        self.journal_mode = self.journal_mode.upper()
+        if self.journal_mode != journal_mode:
+            print("Could not set the journal mode to {}, using {}".format(journal_mode, self.journal_mode))
+        if self.journal_mode == "WAL":
+            # only the checkpoints wait for the disk. A power cut may lose the last few saves but can't corrupt the
+            # database, which is not the case for NORMAL with the other journal modes
+            self.write_conn.execute("PRAGMA synchronous=NORMAL")
+
+        self.idle_readers = queue.LifoQueue()  # reader connections not in use, the most recently used first
+        self.reader_slots = threading.BoundedSemaphore(pool_size)
+        self.readers = []  # every reader connection opened, for closing them
+        self.readers_lock = threading.Lock()
+        self.active_readers = {}  # thread id -> reader connection lent to it
+
+    def open_connection(self) -> sqlite3.Connection:
+        # transactions are started explicitly by writer(), instead of by the sqlite3 module
+        conn = sqlite3.connect(self.filename, timeout=BUSY_TIMEOUT, isolation_level=None, check_same_thread=False)
+        conn.execute("PRAGMA mmap_size={}".format(self.mmap_size))
+        conn.execute("PRAGMA cache_size={}".format(-CACHE_SIZE))  # negative for KiB instead of pages
+        return conn
+
+    @contextmanager
+    def writer(self):
+        """
+        Runs a block in a write transaction, committed at the end of the block or rolled back if it raises.
+        Blocks nested in the same thread are part of the outermost transaction.
+        BEGIN IMMEDIATE takes the write lock at the start, so a transaction never fails halfway through because
+        another instance is writing; it waits for up to BUSY_TIMEOUT instead.
+        :return: cursor of the writer connection
+        """
+        with self.write_lock:
+            if self.write_depth > 0:
+                self.write_depth += 1
+                try:
+                    yield self.write_conn.cursor()
+                finally:
+                    self.write_depth -= 1
+                return
+
+            self.write_conn.execute("BEGIN IMMEDIATE")
+            self.write_depth = 1
+            try:
+                yield self.write_conn.cursor()
+                self.write_conn.execute("COMMIT")
+                for listener in self.commit_listeners:
+                    listener()
+            except BaseException:
+                if self.write_conn.in_transaction:  # some errors already roll the transaction back
+                    self.write_conn.execute("ROLLBACK")
+                raise
+            finally:
+                self.write_depth = 0
+
+    @contextmanager
+    def reader(self):
+        """
+        Lends a read-only connection for a block, waiting if all READER_POOL_SIZE of them are in use
+        :return: cursor of the reader connection
+        """
+        with self.reader_slots:
+            try:
+                conn = self.idle_readers.get_nowait()
+            except queue.Empty:
+                conn = self.open_connection()
+                conn.execute("PRAGMA query_only=ON")
+                with self.readers_lock:
+                    self.readers += [conn]
+            with self.readers_lock:
+                self.active_readers[threading.get_ident()] = conn
+            try:
+                yield conn.cursor()
+            finally:
+                with self.readers_lock:  # not interrupted by interrupt_reader() once it's lent to another thread
+                    self.active_readers.pop(threading.get_ident(), None)
+                self.idle_readers.put(conn)
+
+    def interrupt_reader(self, thread_id: int) -> None:
+        """
+        Cancels the query a thread is running on a reader connection, which then raises sqlite3.OperationalError.
+        Does nothing if the thread is not using a reader
+        :param thread_id: threading.get_ident() of the thread
+        :return: None
+        """
+        with self.readers_lock:
+            conn = self.active_readers.get(thread_id)
+            if conn is not None:
+                conn.interrupt()
+
+    def external_data_version(self) -> int:
+        """
+        :return: a number that changes whenever anything commits to the database, this instance's writer included
+        """
+        with self.version_lock:
+            return self.version_conn.execute("PRAGMA data_version").fetchone()[0]
+
+    def close(self) -> None:
+        with self.write_lock:
+            self.write_conn.close()
+        with self.version_lock:
+            self.version_conn.close()
+        with self.readers_lock:
+            for conn in self.readers:
+                conn.close()
+            self.readers = []
 
 
 class DbInterface:
@@ -78,89 +481,301 @@ class DbInterface:
     Interface to the SQLite database. Corresponds to the model in MVC
     """
     def __init__(self):
-        self.db_conn = None  # SQLite connection object
-        self.db_cur = None  # SQLite cursor object
+        self.connections = None  # ConnectionManager handing out the SQLite connections
+        self.fts_enabled = False  # True if the full-text index is available for searching
+        self.station = platform.node()  # name of this computer, recorded with the stock movements
+        self.item_cache = LruCache(capacity=ITEM_CACHE_SIZE, copy_values=True)  # data matrix code -> ItemRecord
+        self.search_cache = LruCache(capacity=SEARCH_CACHE_SIZE)  # (keyword, page size, summary) -> SearchPage
+        self.data_version = None  # from ConnectionManager.external_data_version(), when the caches were last checked
 
-    def connect(self, filename: str = "AppData/inventory.db") -> None:
+    def connect(self, filename: str = DB_FILENAME, journal_mode: str = None, mmap_size: int = None) -> None:
         """
         Connect to a SQLite file at the same directory. If there's no table with the matching name, create one.
         :param filename: file name for the database file
+        :param journal_mode: one of JOURNAL_MODES. None to use the config file, or JOURNAL_MODE if it's not set there
+        :param mmap_size: bytes of the file read through memory mapping. None to use the config file, or MMAP_SIZE
         :return: None
         """
-        self.db_conn = sqlite3.connect(filename)
-        self.db_cur = self.db_conn.cursor()
+        config = configparser.ConfigParser()
+        config.read(CONFIG_FILENAME)
+        if journal_mode is None:
+            journal_mode = config.get("database", "journal_mode", fallback=JOURNAL_MODE)
+        if mmap_size is None:
+            mmap_size = config.getint("database", "mmap_size", fallback=MMAP_SIZE)
+        self.station = config.get("database", "station", fallback=self.station)
+        self.connections = ConnectionManager(filename=filename, journal_mode=journal_mode, mmap_size=mmap_size)
+        self.connections.commit_listeners += [self.own_write_committed]
+        self.data_version = self.connections.external_data_version()
+
+        with self.connections.writer() as db_cur:
+            self.create_tables(db_cur=db_cur)
+        self.setup_fts()
 
+    def create_tables(self, db_cur: sqlite3.Cursor) -> None:
         # Create the database if not present
-        self.db_cur.execute('CREATE TABLE IF NOT EXISTS "FSAE47 Inventory" ('
-                            '"Name"	TEXT,'
-                            '"Supplier P/N"	TEXT,'
-                            '"Manufacturer P/N"	TEXT,'
-                            '"Location"	TEXT NOT NULL,'
-                            '"Quantity"	INTEGER NOT NULL CHECK("Quantity">=0),'
-                            '"Category"	TEXT,'
-                            '"Description"	TEXT,'
-                            '"Supplier"	TEXT,'
-                            '"Manufacturer"	TEXT,'
-                            '"Used by Project"	TEXT,'
-                            '"Customer Ref"	TEXT,'
-                            '"Comment"	TEXT,'
-                            '"Dmtx Raw"	BLOB NOT NULL,'
-                            # Making the data matrix the primary key to speed up searching by code
-                            'PRIMARY KEY("Dmtx Raw"));')
-
-        self.db_cur.execute('CREATE TABLE IF NOT EXISTS "DB_CFG" ('
-                            '"key" TEXT NOT NULL PRIMARY KEY UNIQUE,'
-                            '"value" TEXT'
-                            ');')
+        db_cur.execute('CREATE TABLE IF NOT EXISTS "FSAE47 Inventory" ('
+                       '"Name"	TEXT,'
+                       '"Supplier P/N"	TEXT,'
+                       '"Manufacturer P/N"	TEXT,'
+                       '"Location"	TEXT NOT NULL,'
+                       '"Quantity"	INTEGER NOT NULL CHECK("Quantity">=0),'
+                       '"Category"	TEXT,'
+                       '"Description"	TEXT,'
+                       '"Supplier"	TEXT,'
+                       '"Manufacturer"	TEXT,'
+                       '"Used by Project"	TEXT,'
+                       '"Customer Ref"	TEXT,'
+                       '"Comment"	TEXT,'
+                       '"Dmtx Raw"	BLOB NOT NULL,'
+                       # Making the data matrix the primary key to speed up searching by code
+                       'PRIMARY KEY("Dmtx Raw"));')
+
+        db_cur.execute('CREATE TABLE IF NOT EXISTS "DB_CFG" ('
+                       '"key" TEXT NOT NULL PRIMARY KEY UNIQUE,'
+                       '"value" TEXT'
+                       ');')
 
         # test if the config is there
-        self.db_cur.execute('SELECT * FROM "DB_CFG" WHERE "key"="dmtx_ser"')
-        if len(self.db_cur.fetchall()) == 0:  # config not present
-            self.db_cur.execute('INSERT INTO "DB_CFG" VALUES(:key, :value)',
-                                {
-                                    "key": "dmtx_ser",
-                                    "value": "0"
-                                })  # a number in place of the data matrix code if that's not present
-        self.db_conn.commit()
+        db_cur.execute('SELECT * FROM "DB_CFG" WHERE "key"="dmtx_ser"')
+        if len(db_cur.fetchall()) == 0:  # config not present
+            db_cur.execute('INSERT INTO "DB_CFG" VALUES(:key, :value)',
+                           {
+                               "key": "dmtx_ser",
+                               "value": "0"
+                           })  # a number in place of the data matrix code if that's not present
+
+        # scans from the batch intake mode wait here until they're reviewed and committed to the inventory
+        db_cur.execute('CREATE TABLE IF NOT EXISTS "Intake Staging" ('
+                       '"Name"	TEXT,'
+                       '"Supplier P/N"	TEXT,'
+                       '"Manufacturer P/N"	TEXT,'
+                       '"Location"	TEXT,'
+                       '"Quantity"	INTEGER,'
+                       '"Category"	TEXT,'
+                       '"Description"	TEXT,'
+                       '"Supplier"	TEXT,'
+                       '"Manufacturer"	TEXT,'
+                       '"Used by Project"	TEXT,'
+                       '"Customer Ref"	TEXT,'
+                       '"Comment"	TEXT,'
+                       '"Dmtx Raw"	BLOB NOT NULL,'
+                       '"Status" TEXT NOT NULL,'  # one of the STAGING_* values
+                       '"Error" TEXT,'
+                       'PRIMARY KEY("Dmtx Raw"));')
+
+        # NOCASE, as the searches ignore the case
+        for col in INDEXED_COLUMNS:
+            db_cur.execute('CREATE INDEX IF NOT EXISTS "FSAE47 Inventory {0}" '
+                           'ON "FSAE47 Inventory"("{0}" COLLATE NOCASE)'.format(col))
+
+        self.create_ledger(db_cur=db_cur)
+
+    def create_ledger(self, db_cur: sqlite3.Cursor) -> None:
+        """
+        Creates the stock movement ledger: every change to the stock of an item, which is never updated or deleted.
+        "FSAE47 Inventory".Quantity is kept at the sum of the movements of the item by a trigger.
+        Databases created before the ledger existed start with a movement for each of the current quantities.
+        :param db_cur: cursor of the writer connection
+        :return: None
+        """
+        db_cur.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name = 'Stock Movements'")
+        ledger_present = len(db_cur.fetchall()) > 0
+
+        db_cur.execute('CREATE TABLE IF NOT EXISTS "Stock Movements" ('
+                       '"Id" INTEGER PRIMARY KEY,'
+                       '"Dmtx Raw" BLOB NOT NULL,'  # kept after the item is deleted
+                       '"Delta" INTEGER NOT NULL,'
+                       '"Balance" INTEGER NOT NULL,'  # quantity after the movement, so past levels are one lookup
+                       '"Project" TEXT,'
+                       '"Timestamp" INTEGER NOT NULL,'  # unix time
+                       '"Station" TEXT,'  # computer the movement was made on
+                       '"Reason" TEXT NOT NULL'  # one of the MOVEMENT_* values
+                       ');')
+        if not ledger_present:
+            db_cur.execute('INSERT INTO "Stock Movements"(' + MOVEMENT_COLUMNS_SQL + ') '
+                           'SELECT "Dmtx Raw", "Quantity", "Quantity", "Used by Project", ?, ?, ? '
+                           'FROM "FSAE47 Inventory" WHERE "Quantity" != 0',
+                           (int(time.time()), self.station, MOVEMENT_OPENING))
+
+        # created after the opening movements, which are already counted in the quantities
+        db_cur.execute('CREATE TRIGGER IF NOT EXISTS "Stock Movements insert" '
+                       'AFTER INSERT ON "Stock Movements" BEGIN '
+                       'UPDATE "FSAE47 Inventory" SET "Quantity" = "Quantity" + new."Delta" '
+                       'WHERE "Dmtx Raw" = new."Dmtx Raw"; '
+                       'END;')
+        for action in ["UPDATE", "DELETE"]:
+            db_cur.execute('CREATE TRIGGER IF NOT EXISTS "Stock Movements no {0}" '
+                           'BEFORE {1} ON "Stock Movements" BEGIN '
+                           'SELECT RAISE(ABORT, \'stock movements are append-only\'); '
+                           'END;'.format(action.lower(), action))
+
+        # stock of an item over time, and consumption by project. Both cover their queries
+        db_cur.execute('CREATE INDEX IF NOT EXISTS "Stock Movements Item" '
+                       'ON "Stock Movements"("Dmtx Raw", "Timestamp", "Id", "Balance")')
+        db_cur.execute('CREATE INDEX IF NOT EXISTS "Stock Movements Project" '
+                       'ON "Stock Movements"("Project" COLLATE NOCASE, "Timestamp", "Reason", "Dmtx Raw", "Delta")')
+
+    def setup_fts(self) -> None:
+        """
+        Creates the FTS5 full-text index over the searchable columns, and the triggers keeping it in sync with
+        "FSAE47 Inventory". Databases created before the index existed are migrated in place by building the index
+        from the existing records.
+        :return: None
+        """
+        cols_sql = ", ".join('"{}"'.format(col) for col in FTS_COLUMNS)
+        new_cols_sql = ", ".join('new."{}"'.format(col) for col in FTS_COLUMNS)
+        old_cols_sql = ", ".join('old."{}"'.format(col) for col in FTS_COLUMNS)
+        try:
+            with self.connections.writer() as db_cur:
+                db_cur.execute("SELECT name FROM sqlite_master "
+                               "WHERE type = 'table' AND name = 'FSAE47 Inventory FTS'")
+                index_present = len(db_cur.fetchall()) > 0
+
+                if index_present:
+                    db_cur.execute('PRAGMA table_info("FSAE47 Inventory FTS")')
+                    if [row[1] for row in db_cur.fetchall()] != FTS_COLUMNS:  # built over other columns, start again
+                        for trigger in ["insert", "delete", "update"]:
+                            db_cur.execute('DROP TRIGGER IF EXISTS "FSAE47 Inventory FTS {}"'.format(trigger))
+                        db_cur.execute('DROP TABLE "FSAE47 Inventory FTS"')
+                        index_present = False
+
+                # external content table, so the text is not stored twice.
+                # The trigram tokenizer matches any substring of 3+ characters, like LIKE '%kw%' did
+                db_cur.execute('CREATE VIRTUAL TABLE IF NOT EXISTS "FSAE47 Inventory FTS" USING fts5('
+                               '{}, '
+                               'content="FSAE47 Inventory", '
+                               'content_rowid="rowid", '
+                               'tokenize="trigram"'
+                               ');'.format(cols_sql))
+
+                db_cur.execute('CREATE TRIGGER IF NOT EXISTS "FSAE47 Inventory FTS insert" '
+                               'AFTER INSERT ON "FSAE47 Inventory" BEGIN '
+                               'INSERT INTO "FSAE47 Inventory FTS"(rowid, {0}) VALUES (new.rowid, {1}); '
+                               'END;'.format(cols_sql, new_cols_sql))
+                db_cur.execute('CREATE TRIGGER IF NOT EXISTS "FSAE47 Inventory FTS delete" '
+                               'AFTER DELETE ON "FSAE47 Inventory" BEGIN '
+                               'INSERT INTO "FSAE47 Inventory FTS"("FSAE47 Inventory FTS", rowid, {0}) '
+                               'VALUES (\'delete\', old.rowid, {1}); '
+                               'END;'.format(cols_sql, old_cols_sql))
+                db_cur.execute('CREATE TRIGGER IF NOT EXISTS "FSAE47 Inventory FTS update" '
+                               'AFTER UPDATE OF {0} ON "FSAE47 Inventory" BEGIN '
+                               'INSERT INTO "FSAE47 Inventory FTS"("FSAE47 Inventory FTS", rowid, {0}) '
+                               'VALUES (\'delete\', old.rowid, {1}); '
+                               'INSERT INTO "FSAE47 Inventory FTS"(rowid, {0}) VALUES (new.rowid, {2}); '
+                               'END;'.format(cols_sql, old_cols_sql, new_cols_sql))
+
+                if not index_present:  # index newly created, fill it in with the existing records
+                    db_cur.execute('INSERT INTO "FSAE47 Inventory FTS"("FSAE47 Inventory FTS") VALUES (\'rebuild\')')
+        except sqlite3.OperationalError:  # SQLite built without FTS5 or older than 3.34
+            print("Full-text search is not available in this SQLite build, searching without the index.")
+            traceback.print_exc()
+            self.fts_enabled = False
+            return
+        self.fts_enabled = True
 
     def add_component(self, item: ItemRecord) -> None:
-        if item.dmtx is None or item.dmtx == b"":  # assign a number to ensure uniqueness
-            if item.has_dmtx:
-                print("ItemRecord object not ready to store! Abort saving...")
-                return
-            self.db_cur.execute('SELECT * FROM "DB_CFG" WHERE "key"="dmtx_ser"')
-            res = self.db_cur.fetchall()  # returns a list
-            if len(res) == 1:
-                res = res[0]  # take the first (and only) row in the querying result
-                dmtx_ser_int = int(res[1])  # a row is in tuple
-                dmtx_ser_str = "{:07d}".format(dmtx_ser_int)
-                item.dmtx = bytes(dmtx_ser_str, "ascii")
-
-                # write the incremented value back into the DB
-                dmtx_ser_int += 1
-                self.db_cur.execute('UPDATE "DB_CFG"'
-                                    'SET "value"="{}"'
-                                    'WHERE "key"="dmtx_ser"'
-                                    ''.format(dmtx_ser_int))
+        with self.connections.writer() as db_cur:
+            if item.dmtx is None or item.dmtx == b"":  # assign a number to ensure uniqueness
+                if item.has_dmtx:
+                    print("ItemRecord object not ready to store! Abort saving...")
+                    return
+                dmtx_ser_int = self.reserve_dmtx_serials(db_cur=db_cur, count=1)
+                if dmtx_ser_int is None:
+                    print("Error in the config table! (No dmtx_ser)")
+                    print("Record NOT saved.")
+                    return
+                item.dmtx = dmtx_serial_bytes(dmtx_ser_int)
+            self.insert_new_items(db_cur=db_cur, items=[item])
+
+    @staticmethod
+    def reserve_dmtx_serials(db_cur: sqlite3.Cursor, count: int):
+        """
+        Takes a block of numbers to use in place of the data matrix code, for items that don't have one.
+        Runs in the caller's write transaction, so the numbers are given back if it is rolled back.
+        :param db_cur: cursor from ConnectionManager.writer()
+        :param count: how many numbers to take
+        :return: the first number in the block, or None if the config table is broken
+        """
+        db_cur.execute('UPDATE "DB_CFG" '
+                       'SET "value" = CAST("value" AS INTEGER) + ? '
+                       'WHERE "key" = \'dmtx_ser\'', (count, ))
+        if db_cur.rowcount != 1:
+            return None
+        db_cur.execute('SELECT "value" FROM "DB_CFG" WHERE "key" = \'dmtx_ser\'')
+        return int(db_cur.fetchone()[0]) - count
+
+    @staticmethod
+    def skip_dmtx_serials(db_cur: sqlite3.Cursor, items: list) -> None:
+        """
+        Moves the next number to use in place of the data matrix code past the numbers some items already have, e.g.
+        items exported from another database, so the next item without a code doesn't get one of them.
+        Runs in the caller's write transaction.
+        :param db_cur: cursor from ConnectionManager.writer()
+        :param items: list of ItemRecord objects
+        :return: None
+        """
+        serials = [int(item.dmtx) for item in items if is_dmtx_serial(item.dmtx)]
+        if len(serials) == 0:
+            return
+        db_cur.execute('UPDATE "DB_CFG" '
+                       'SET "value" = max(CAST("value" AS INTEGER), ?) '
+                       'WHERE "key" = \'dmtx_ser\'', (max(serials) + 1, ))
+
+    def bulk_upsert(self, items: list) -> int:
+        """
+        Saves many items in one transaction: new items are added and the ones already in the database (by data matrix
+        code) are updated. Items without a code get numbers from one block in the config table,
+        after the numbers the other items already have.
+        Either all the items are saved, or none are.
+        :param items: list of ItemRecord objects
+        :return: number of items saved
+        """
+        no_dmtx = []
+        with_dmtx = []
+        for item in items:
+            if item.dmtx is None or item.dmtx == b"":
+                if item.has_dmtx:
+                    print("ItemRecord object not ready to store! Abort saving...")
+                    return 0
+                no_dmtx += [item]
             else:
-                print("Error in the config table! (Multiple dmtx_ser)")
-                print("Record NOT saved.")
-                return
-        self.db_cur.execute('INSERT INTO "FSAE47 Inventory" VALUES(?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
-                            (item.name,
-                             item.supplier_pn,
-                             item.manufacturer_pn,
-                             item.location,
-                             item.quantity,
-                             item.category,
-                             item.description,
-                             item.supplier,
-                             item.manufacturer,
-                             item.used_by_proj,
-                             item.customer_ref,
-                             item.comment,
-                             item.dmtx))
-        self.db_conn.commit()
+                with_dmtx += [item]
+
+        try:
+            with self.connections.writer() as db_cur:
+                # checked before anything is written, as leaving the block early still commits
+                db_cur.execute('SELECT count(*) FROM "DB_CFG" WHERE "key" = \'dmtx_ser\'')
+                if db_cur.fetchone()[0] != 1:
+                    print("Error in the config table! (No dmtx_ser)")
+                    print("Records NOT saved.")
+                    return 0
+                self.skip_dmtx_serials(db_cur=db_cur, items=with_dmtx)
+                if len(no_dmtx) > 0:
+                    dmtx_ser_int = self.reserve_dmtx_serials(db_cur=db_cur, count=len(no_dmtx))
+                    for item in no_dmtx:
+                        item.dmtx = dmtx_serial_bytes(dmtx_ser_int)
+                        dmtx_ser_int += 1
+
+                # the numbers just taken are new, only the items that came with a code can already be there.
+                # A code repeated in the items is added once, then updated by the later ones
+                existing = self.existing_codes(db_cur=db_cur, codes=[item.dmtx for item in with_dmtx])
+                new_items = list(no_dmtx)
+                updated_items = []
+                for item in with_dmtx:
+                    if item.dmtx in existing:
+                        updated_items += [item]
+                    else:
+                        new_items += [item]
+                        existing.add(item.dmtx)
+                self.insert_new_items(db_cur=db_cur, items=new_items)
+                db_cur.executemany(INSERT_ITEM_SQL + UPSERT_CONFLICT_SQL,
+                                   [item.to_db_row(quantity=False) for item in updated_items])
+                self.set_quantities(db_cur=db_cur, items=updated_items, reason=MOVEMENT_ADD)
+        except sqlite3.Error:  # rolled back by writer()
+            for item in no_dmtx:  # the numbers were given back
+                item.dmtx = b""
+            raise
+        return len(items)
 
     def update_component(self, item: ItemRecord):
         """
@@ -174,7 +789,6 @@ class DbInterface:
                      '"Supplier P/N" = ?, ' \
                      '"Manufacturer P/N" = ?, ' \
                      '"Location" = ?, ' \
-                     '"Quantity" = ?, ' \
                      '"Category" = ?, ' \
                      '"Description" = ?, ' \
                      '"Supplier" = ?, ' \
@@ -184,114 +798,518 @@ class DbInterface:
                      '"Comment" = ?' \
                      'WHERE ' \
                      '"Dmtx Raw" = ?'
-        self.db_cur.execute(update_sql,
-                            (item.name,
-                             item.supplier_pn,
-                             item.manufacturer_pn,
-                             item.location,
-                             item.quantity,
-                             item.category,
-                             item.description,
-                             item.supplier,
-                             item.manufacturer,
-                             item.used_by_proj,
-                             item.customer_ref,
-                             item.comment,
-                             item.dmtx
-                             )
+        with self.connections.writer() as db_cur:
+            db_cur.execute(update_sql,
+                           (item.name,
+                            item.supplier_pn,
+                            item.manufacturer_pn,
+                            item.location,
+                            item.category,
+                            item.description,
+                            item.supplier,
+                            item.manufacturer,
+                            item.used_by_proj,
+                            item.customer_ref,
+                            item.comment,
+                            item.dmtx
                             )
-        self.db_conn.commit()
-
-    def basic_search(self, keyword: str) -> list:
-        """
-        searches the given keyword in every column of the database
-        :return: list of results, as ItemRecord objects
-        """
-        search_limit = 200
-        basic_search_sql = 'SELECT * FROM "FSAE47 Inventory" WHERE' \
-                           '(' \
-                           '"Name" LIKE {0} ESCAPE {1}' \
-                           'OR "Supplier P/N" LIKE {0} ESCAPE {1}' \
-                           'OR "Manufacturer P/N" LIKE {0} ESCAPE {1}' \
-                           'OR "Location" LIKE {0} ESCAPE {1}' \
-                           'OR "Quantity" LIKE {0} ESCAPE {1}' \
-                           'OR "Category" LIKE {0} ESCAPE {1}' \
-                           'OR "Description" LIKE {0} ESCAPE {1}' \
-                           'OR "Supplier" LIKE {0} ESCAPE {1}' \
-                           'OR "Manufacturer" LIKE {0} ESCAPE {1}' \
-                           'OR "Used by Project" LIKE {0} ESCAPE {1}' \
-                           'OR "Customer Ref" LIKE {0} ESCAPE {1}' \
-                           'OR "Comment" LIKE {0} ESCAPE {1}' \
-                           ')' \
-                           'LIMIT {2}'
-        basic_search_sql = basic_search_sql.format(":kw", "'\\'", search_limit)  # add in the LIKE and ESCAPE keyword
-        self.db_cur.execute(basic_search_sql, {"kw": "%"+keyword+"%"})
-        rows = self.db_cur.fetchall()
-        return db_rows_to_itemrecords(db_rows=rows)
-
-    def advanced_search(self, cols: list, inputs: list, logics: list) -> list:
+                           )
+            self.set_quantities(db_cur=db_cur, items=[item], reason=MOVEMENT_EDIT)
+
+    def insert_new_items(self, db_cur: sqlite3.Cursor, items: list) -> None:
+        """
+        Adds items that are not in the database yet at their quantities, each with an Add movement. Cheaper than
+        INSERT_ITEM_SQL and set_quantities(), which update each new record, and its index entry, a second time
+        :param db_cur: cursor from ConnectionManager.writer()
+        :param items: list of ItemRecord objects with their data matrix codes, none of them in the database
+        :return: None
+        """
+        time_now = int(time.time())
+        db_cur.executemany(NEW_ITEM_MOVEMENT_SQL,
+                           [{"dmtx": item.dmtx,
+                             "qty": item.quantity,
+                             "proj": item.used_by_proj,
+                             "ts": time_now,
+                             "station": self.station,
+                             "reason": MOVEMENT_ADD} for item in items if item.quantity != 0])
+        db_cur.executemany(NEW_ITEM_SQL, [item.to_db_row() for item in items])
+
+    @staticmethod
+    def existing_codes(db_cur: sqlite3.Cursor, codes: list, batch_size: int = 500) -> set:
+        """
+        :param db_cur: cursor of any connection
+        :param codes: data matrix codes
+        :param batch_size: codes per query, to stay below the limit on the number of SQL variables
+        :return: the codes that are in the database
+        """
+        existing = set()
+        for start in range(0, len(codes), batch_size):
+            batch = codes[start:start + batch_size]
+            db_cur.execute('SELECT "Dmtx Raw" FROM "FSAE47 Inventory" WHERE "Dmtx Raw" IN ({})'.format(
+                ", ".join("?" * len(batch))), batch)
+            existing.update(row[0] for row in db_cur.fetchall())
+        return existing
+
+    def set_quantities(self, db_cur: sqlite3.Cursor, items: list, reason: str) -> None:
+        """
+        Records the stock movements bringing items to their quantities. Items already at their quantity are skipped
+        :param db_cur: cursor from ConnectionManager.writer()
+        :param items: list of ItemRecord objects, already in "FSAE47 Inventory"
+        :param reason: one of the MOVEMENT_* values
+        :return: None
+        """
+        time_now = int(time.time())
+        db_cur.executemany(SET_QUANTITY_SQL,
+                           [{"dmtx": item.dmtx,
+                             "qty": item.quantity,
+                             "proj": item.used_by_proj,
+                             "ts": time_now,
+                             "station": self.station,
+                             "reason": reason} for item in items])
+
+    def adjust_quantity(self, dmtx: bytes, delta: int, project: str = None):
+        """
+        Adds to or takes from the quantity of an item in one statement, so checkouts from different instances
+        can't overwrite each other, and the quantity never goes below 0. Recorded as a checkout or check-in movement
+        :param dmtx: data matrix code of the item
+        :param delta: quantity to add, negative to take away
+        :param project: project using the item, None to leave it as it is
+        :return: the new quantity, or None if the item is not present or there isn't enough left
+        :raises ValueError: if delta is 0, which would record a movement of nothing
+        """
+        if delta == 0:
+            raise ValueError("Nothing to check out or in, the quantity to adjust by is 0")
+        reason = MOVEMENT_CHECKOUT if delta < 0 else MOVEMENT_CHECKIN
+        with self.connections.writer() as db_cur:
+            db_cur.execute('INSERT INTO "Stock Movements"(' + MOVEMENT_COLUMNS_SQL + ') '
+                           'SELECT "Dmtx Raw", :delta, "Quantity" + :delta, coalesce(:proj, "Used by Project"), '
+                           ':ts, :station, :reason '
+                           'FROM "FSAE47 Inventory" WHERE "Dmtx Raw" = :dmtx AND "Quantity" + :delta >= 0',
+                           {"delta": delta, "proj": project, "ts": int(time.time()), "station": self.station,
+                            "reason": reason, "dmtx": dmtx})
+            if db_cur.rowcount != 1:
+                return None
+            if project is not None:
+                db_cur.execute('UPDATE "FSAE47 Inventory" SET "Used by Project" = ? WHERE "Dmtx Raw" = ?',
+                               (project, dmtx))
+            # still in the same transaction, so this is the quantity the update left
+            db_cur.execute('SELECT "Quantity" FROM "FSAE47 Inventory" WHERE "Dmtx Raw" = ?', (dmtx, ))
+            return db_cur.fetchone()[0]
+
+    def adjust_quantities(self, changes: list, project: str = None) -> list:
+        """
+        Adjusts the quantities of many items in one transaction, like taking all the parts of a BOM.
+        Either every change is made, or none are
+        :param changes: list of (data matrix code, quantity to add, negative to take away)
+        :param project: project using the items, None to leave them as they are
+        :return: the new quantities, in the order of the changes
+        :raises NotEnoughStock: if an item is not present or there isn't enough left, after rolling everything back
+        """
+        quantities = []
+        with self.connections.writer():
+            for dmtx, delta in changes:
+                quantity = self.adjust_quantity(dmtx=dmtx, delta=delta, project=project)
+                if quantity is None:
+                    raise NotEnoughStock(dmtx)
+                quantities += [quantity]
+        return quantities
+
+    def find_stock(self, column: str, values: list, batch_size: int = 500) -> dict:
+        """
+        Looks up many exact values (ignoring the case) of an indexed column at once, a batch per query
+        :param column: one of INDEXED_COLUMNS
+        :param values: the values to look for
+        :param batch_size: values per query, to stay below the limit on the number of SQL variables
+        :return: dictionary of the value in lower case -> list of (data matrix code, quantity) of the matching items
+        """
+        if column not in INDEXED_COLUMNS:
+            raise ValueError("{} is not an indexed column".format(column))
+        values = list({value.lower() for value in values})
+        found = {}
+        with self.connections.reader() as db_cur:
+            for start in range(0, len(values), batch_size):
+                batch = values[start:start + batch_size]
+                db_cur.execute('SELECT "{0}", "Dmtx Raw", "Quantity" FROM "FSAE47 Inventory" '
+                               'WHERE "{0}" COLLATE NOCASE IN ({1})'.format(column, ", ".join("?" * len(batch))),
+                               batch)
+                for value, dmtx, quantity in db_cur:
+                    found.setdefault(value.lower(), []).append((dmtx, quantity))
+        return found
+
+    def get_part_numbers(self) -> list:
+        """
+        :return: list of (manufacturer P/N, supplier P/N, data matrix code, quantity) of every item
+        """
+        with self.connections.reader() as db_cur:
+            db_cur.execute('SELECT "Manufacturer P/N", "Supplier P/N", "Dmtx Raw", "Quantity" '
+                           'FROM "FSAE47 Inventory"')
+            return db_cur.fetchall()
+
+    def get_movements(self, dmtx: bytes) -> list:
+        """
+        :param dmtx: data matrix code of the item
+        :return: list of (delta, balance, project, timestamp, station, reason) for the item, the oldest first
+        """
+        with self.connections.reader() as db_cur:
+            db_cur.execute('SELECT "Delta", "Balance", "Project", "Timestamp", "Station", "Reason" '
+                           'FROM "Stock Movements" WHERE "Dmtx Raw" = ? ORDER BY "Timestamp", "Id"', (dmtx, ))
+            return db_cur.fetchall()
+
+    def stock_at(self, dmtx: bytes, timestamp: int) -> int:
+        """
+        :param dmtx: data matrix code of the item
+        :param timestamp: unix time
+        :return: quantity of the item at that time, from the balance of the last movement before it
+        """
+        with self.connections.reader() as db_cur:
+            db_cur.execute('SELECT "Balance" FROM "Stock Movements" WHERE "Dmtx Raw" = ? AND "Timestamp" <= ? '
+                           'ORDER BY "Timestamp" DESC, "Id" DESC LIMIT 1', (dmtx, timestamp))
+            row = db_cur.fetchone()
+        if row is None:  # not added yet
+            return 0
+        return row[0]
+
+    def project_consumption(self, project: str, since: int = 0, until: int = None) -> list:
+        """
+        Works out how much of each item a project has used, as checkouts less check-ins
+        :param project: name of the project, ignoring the case
+        :param since: unix time to count from
+        :param until: unix time to count up to, None for now
+        :return: list of (data matrix code, quantity used), the most used first
+        """
+        if until is None:
+            until = int(time.time()) + 1
+        with self.connections.reader() as db_cur:
+            db_cur.execute('SELECT "Dmtx Raw", -sum("Delta") AS "Used" FROM "Stock Movements" '
+                           'WHERE "Project" = :proj COLLATE NOCASE '
+                           'AND "Timestamp" >= :since AND "Timestamp" < :until '
+                           'AND "Reason" IN (:checkout, :checkin) '
+                           'GROUP BY "Dmtx Raw" ORDER BY "Used" DESC',
+                           {"proj": project, "since": since, "until": until,
+                            "checkout": MOVEMENT_CHECKOUT, "checkin": MOVEMENT_CHECKIN})
+            return db_cur.fetchall()
+
+    def search_page(self, from_sql: str, where_sql: str, params: dict, ranked: bool,
+                    cursor: tuple = None, page_size: int = SEARCH_PAGE_SIZE, summary: bool = False) -> SearchPage:
+        """
+        Fetches one page of a search using keyset pagination, so later pages cost the same as the first one.
+        Ranked searches are ordered by (bm25 rank, rowid), the rest by rowid with the newest records first.
+        :param from_sql: FROM clause of the search, including any JOIN
+        :param where_sql: conditions of the search, empty for all records
+        :param params: named parameters used in where_sql
+        :param ranked: True if from_sql includes the full-text index and the results should be ranked
+        :param cursor: continuation token from the previous page, None for the first page
+        :param page_size: maximum number of records in the page
+        :param summary: True to only fetch what list views show, see LIST_COLUMNS_SQL
+        :return: the page of results as a SearchPage
+        """
+        page_sql, page_params = self.search_page_sql(from_sql=from_sql, where_sql=where_sql, params=params,
+                                                     ranked=ranked, cursor=cursor, page_size=page_size,
+                                                     summary=summary)
+        total_estimate = None
+        total_is_exact = False
+        with self.connections.reader() as db_cur:
+            db_cur.row_factory = summary_row_factory if summary else item_row_factory
+            db_cur.execute(page_sql, page_params)
+            items = db_cur.fetchall()
+
+            # count the matches only when starting a search, and only if they don't all fit in the page.
+            # The count stops at the cap to keep it cheap
+            if cursor is None:
+                if len(items) <= page_size:  # all in the page, nothing more to count
+                    total_estimate = len(items)
+                else:
+                    total_estimate = COUNT_ESTIMATE_CAP + 1
+                    if page_size < COUNT_ESTIMATE_CAP:
+                        db_cur.row_factory = None
+                        db_cur.execute(self.search_count_sql(from_sql=from_sql, where_sql=where_sql), params)
+                        total_estimate = db_cur.fetchone()[0]
+                total_is_exact = total_estimate <= COUNT_ESTIMATE_CAP
+                total_estimate = min(total_estimate, COUNT_ESTIMATE_CAP)
+
+        next_cursor = None
+        if len(items) > page_size:
+            del items[page_size:]
+            next_cursor = (items[-1].rank, items[-1].rowid)  # of the last record in the page
+
+        return SearchPage(items=items, cursor=next_cursor, total_estimate=total_estimate,
+                          total_is_exact=total_is_exact)
+
+    @staticmethod
+    def search_count_sql(from_sql: str, where_sql: str) -> str:
+        """
+        :return: SQL counting the matches of a search up to COUNT_ESTIMATE_CAP + 1, with the same parameters
+        """
+        count_where_sql = ""
+        if where_sql != "":
+            count_where_sql = "WHERE " + where_sql + " "
+        return 'SELECT count(*) FROM (SELECT 1 ' + from_sql + count_where_sql + \
+               'LIMIT {})'.format(COUNT_ESTIMATE_CAP + 1)
+
+    @staticmethod
+    def search_page_sql(from_sql: str, where_sql: str, params: dict, ranked: bool,
+                        cursor: tuple = None, page_size: int = SEARCH_PAGE_SIZE, summary: bool = False) -> tuple:
+        """
+        Builds the queries for search_page(), which takes the same parameters
+        :return: (SQL for the page, its parameters)
+        """
+        conditions = []
+        if where_sql != "":
+            conditions += ["(" + where_sql + ")"]
+        params = dict(params)
+
+        columns_sql = LIST_COLUMNS_SQL if summary else '"FSAE47 Inventory".*'
+        if ranked:
+            select_sql = 'SELECT ' + columns_sql + ', "FSAE47 Inventory".rowid, "FSAE47 Inventory FTS".rank '
+            order_sql = 'ORDER BY "FSAE47 Inventory FTS".rank, "FSAE47 Inventory".rowid '
+            if cursor is not None:
+                conditions += ['("FSAE47 Inventory FTS".rank > :cursor_rank '
+                               'OR ("FSAE47 Inventory FTS".rank = :cursor_rank '
+                               'AND "FSAE47 Inventory".rowid > :cursor_rowid))']
+                params["cursor_rank"], params["cursor_rowid"] = cursor
+        else:
+            select_sql = 'SELECT ' + columns_sql + ', "FSAE47 Inventory".rowid, NULL '
+            order_sql = 'ORDER BY "FSAE47 Inventory".rowid DESC '
+            if cursor is not None:
+                conditions += ['"FSAE47 Inventory".rowid < :cursor_rowid']
+                params["cursor_rowid"] = cursor[1]
+
+        page_where_sql = ""
+        if len(conditions) > 0:
+            page_where_sql = "WHERE " + " AND ".join(conditions) + " "
+
+        # fetch one extra row to find out if there's another page
+        page_sql = select_sql + from_sql + page_where_sql + order_sql + "LIMIT {}".format(page_size + 1)
+        return page_sql, params
+
+    def basic_search(self, keyword: str, cursor: tuple = None, page_size: int = SEARCH_PAGE_SIZE,
+                     summary: bool = False) -> SearchPage:
+        """
+        searches the given keyword in every column of the database. The quantity is only searched for keywords too
+        short for the full-text index, as it is not in the index
+        Uses the full-text index when available, with the best matches (by bm25) first.
+        :param keyword: the keyword to search for
+        :param cursor: continuation token from the previous page, None for the first page
+        :param page_size: maximum number of records in the page
+        :param summary: True to only fetch what list views show, see LIST_COLUMNS_SQL
+        :return: a page of results, as a SearchPage
+        """
+        if cursor is not None:
+            return self.basic_search_uncached(keyword=keyword, cursor=cursor, page_size=page_size, summary=summary)
+
+        # the first pages are cached, as search-as-you-type repeats them when backspacing
+        page = self.cached_basic_search(keyword=keyword, page_size=page_size, summary=summary)
+        if page is None:
+            generation = self.search_cache.generation
+            page = self.basic_search_uncached(keyword=keyword, page_size=page_size, summary=summary)
+            self.search_cache.put(key=(keyword, page_size, summary), value=page, generation=generation)
+        return page
+
+    def cached_basic_search(self, keyword: str, page_size: int = SEARCH_PAGE_SIZE, summary: bool = False):
+        """
+        :return: the first page of a basic search if it can be answered from the cache, None otherwise
+        """
+        self.check_external_writes()
+        page = self.search_cache.get((keyword, page_size, summary))
+        if page is not None:
+            return page
+        # every match of a longer keyword also matches the start of it, so a refinement of a search without
+        # any matches doesn't have any either
+        for end in range(len(keyword) - 1, 0, -1):
+            page = self.search_cache.get((keyword[:end], page_size, summary))
+            if page is not None and len(page.items) == 0:
+                return page
+        return None
+
+    def basic_search_uncached(self, keyword: str, cursor: tuple = None, page_size: int = SEARCH_PAGE_SIZE,
+                              summary: bool = False) -> SearchPage:
+        """
+        basic_search() without the cache, which takes the same parameters
+        :return: a page of results, as a SearchPage
+        """
+        if self.fts_enabled and len(keyword) >= FTS_MIN_KEYWORD_LEN:
+            return self.search_page(from_sql=FTS_FROM_SQL,
+                                    where_sql='"FSAE47 Inventory FTS" MATCH :query',
+                                    params={"query": fts_phrase(keyword)},
+                                    ranked=True,
+                                    cursor=cursor,
+                                    page_size=page_size,
+                                    summary=summary)
+
+        # keyword too short for the trigram index, fall back to scanning the table
+        basic_search_sql = '"Name" LIKE {0} ESCAPE {1} ' \
+                           'OR "Supplier P/N" LIKE {0} ESCAPE {1} ' \
+                           'OR "Manufacturer P/N" LIKE {0} ESCAPE {1} ' \
+                           'OR "Location" LIKE {0} ESCAPE {1} ' \
+                           'OR "Quantity" LIKE {0} ESCAPE {1} ' \
+                           'OR "Category" LIKE {0} ESCAPE {1} ' \
+                           'OR "Description" LIKE {0} ESCAPE {1} ' \
+                           'OR "Supplier" LIKE {0} ESCAPE {1} ' \
+                           'OR "Manufacturer" LIKE {0} ESCAPE {1} ' \
+                           'OR "Used by Project" LIKE {0} ESCAPE {1} ' \
+                           'OR "Customer Ref" LIKE {0} ESCAPE {1} ' \
+                           'OR "Comment" LIKE {0} ESCAPE {1}'
+        basic_search_sql = basic_search_sql.format(":kw", "'\\'")  # add in the LIKE and ESCAPE keyword
+        return self.search_page(from_sql='FROM "FSAE47 Inventory" ',
+                                where_sql=basic_search_sql,
+                                params={"kw": "%"+keyword+"%"},
+                                ranked=False,
+                                cursor=cursor,
+                                page_size=page_size,
+                                summary=summary)
+
+    def advanced_search(self, cols: list, inputs: list, logics: list,
+                        cursor: tuple = None, page_size: int = SEARCH_PAGE_SIZE, summary: bool = False) -> SearchPage:
         """
         Searches the database based on field, keyword and logic between them.
-        Hard-coded to work with up to 3 inputs and 2 logic choices.
-        Inputs are assumed to be not empty.
+        Works with up to 3 inputs and 2 logic choices, as laid out in the GUI.
+        Inputs are assumed to be not empty. See parse_search_term() for how the inputs match.
         :param cols: list of the column/field names
         :param inputs: list of search keywords
         :param logics: list of logic choices ("AND"/"OR") between the search fields
-        :return: list of results, as ItemRecord objects
-        """
-        search_limit = 200
-        if len(cols) == 1:
-            advanced_search_sql = 'SELECT * FROM "FSAE47 Inventory" WHERE' \
-                                  '"{1}" LIKE :kw ESCAPE {0}' \
-                                  'LIMIT {2}'.format( "'\\'", cols[0], search_limit)
-            params = {
-                "kw": "%"+inputs[0]+"%"
-            }
-            self.db_cur.execute(advanced_search_sql, params)
-            rows = self.db_cur.fetchall()
-            return db_rows_to_itemrecords(db_rows=rows)
-        if len(cols) == 2:
-            advanced_search_sql = 'SELECT * FROM "FSAE47 Inventory" WHERE' \
-                                  '(' \
-                                  '"{1}" LIKE :kw1 ESCAPE {0}' \
-                                  '{2} "{3}" LIKE :kw2 ESCAPE {0}' \
-                                  ')' \
-                                  'LIMIT {4}'.format("'\\'", cols[0], logics[0], cols[1], search_limit)
-            params = {
-                "kw1": "%"+inputs[0]+"%",
-                "kw2": "%"+inputs[1]+"%"
-            }
-            self.db_cur.execute(advanced_search_sql, params)
-            rows = self.db_cur.fetchall()
-            return db_rows_to_itemrecords(db_rows=rows)
-        if len(cols) == 3:
-            advanced_search_sql = 'SELECT * FROM "FSAE47 Inventory" WHERE' \
-                                  '(' \
-                                  '"{1}" LIKE :kw1 ESCAPE {0}' \
-                                  '{2} "{3}" LIKE :kw2 ESCAPE {0}' \
-                                  '{4} "{5}" LIKE :kw3 ESCAPE {0}' \
-                                  ')' \
-                                  'LIMIT {6}'.format("'\\'", cols[0], logics[0], cols[1], logics[1], cols[2],
-                                                     search_limit)
-            params = {
-                "kw1": "%"+inputs[0]+"%",
-                "kw2": "%"+inputs[1]+"%",
-                "kw3": "%"+inputs[2]+"%"
-            }
-            self.db_cur.execute(advanced_search_sql, params)
-            rows = self.db_cur.fetchall()
-            return db_rows_to_itemrecords(db_rows=rows)
+        :param cursor: continuation token from the previous page, None for the first page
+        :param page_size: maximum number of records in the page
+        :param summary: True to only fetch what list views show, see LIST_COLUMNS_SQL
+        :return: a page of results, as a SearchPage
+        """
+        for col in cols:
+            if col not in SEARCH_COLUMNS:  # column names are put into the SQL directly, so check them first
+                print("Unknown column for searching: {}".format(col))
+                return SearchPage(items=[], cursor=None, total_estimate=0, total_is_exact=True)
+
+        from_sql, where_sql, params, ranked = self.advanced_search_query(cols=cols, inputs=inputs, logics=logics)
+        return self.search_page(from_sql=from_sql,
+                                where_sql=where_sql,
+                                params=params,
+                                ranked=ranked,
+                                cursor=cursor,
+                                page_size=page_size,
+                                summary=summary)
+
+    def advanced_search_query(self, cols: list, inputs: list, logics: list) -> tuple:
+        """
+        Builds the search for advanced_search(), which takes the same parameters. The columns must be checked first.
+        :return: (from_sql, where_sql, params, ranked) to pass onto search_page()
+        """
+        terms = [parse_search_term(keyword) for keyword in inputs]
+        substring_only = all(match == MATCH_SUBSTRING for match, _ in terms)
+
+        if substring_only and self.fts_enabled and min(len(keyword) for keyword in inputs) >= FTS_MIN_KEYWORD_LEN \
+                and all(col in FTS_COLUMNS for col in cols):
+            # build a query like: {"Name"} : "res" AND {"Location"} : "A01"
+            query = '{{"{}"}} : {}'.format(cols[0], fts_phrase(inputs[0]))
+            for i in range(1, len(cols)):
+                query += ' {} {{"{}"}} : {}'.format(logics[i - 1], cols[i], fts_phrase(inputs[i]))
+            return FTS_FROM_SQL, '"FSAE47 Inventory FTS" MATCH :query', {"query": query}, True
+
+        # each term as a condition of its own: the index for exact and prefix matches on the INDEXED_COLUMNS,
+        # the full-text index for other substrings when available, and LIKE for the rest
+        where_sql = ""
+        params = {}
+        for i in range(len(cols)):
+            match, keyword = terms[i]
+            kw_name = "kw{}".format(i)
+            if match == MATCH_EXACT:
+                condition = '"{}" = :{} COLLATE NOCASE'.format(cols[i], kw_name)
+                params[kw_name] = keyword
+            elif match == MATCH_PREFIX and cols[i] in INDEXED_COLUMNS:
+                # as a range, which can use the index unlike LIKE 'kw%' on a column that isn't declared NOCASE.
+                # U+10FFFF sorts after any character that can follow the prefix
+                condition = '("{0}" >= :{1} COLLATE NOCASE AND "{0}" < :{1}_end COLLATE NOCASE)'.format(cols[i],
+                                                                                                       kw_name)
+                params[kw_name] = keyword
+                params[kw_name + "_end"] = keyword + "\U0010ffff"
+            elif match == MATCH_PREFIX:
+                condition = '"{}" LIKE :{} ESCAPE {}'.format(cols[i], kw_name, "'\\'")
+                params[kw_name] = keyword + "%"
+            elif self.fts_enabled and len(keyword) >= FTS_MIN_KEYWORD_LEN and cols[i] in FTS_COLUMNS:
+                condition = '"FSAE47 Inventory".rowid IN (SELECT rowid FROM "FSAE47 Inventory FTS" ' \
+                            'WHERE "FSAE47 Inventory FTS" MATCH :{})'.format(kw_name)
+                params[kw_name] = '{{"{}"}} : {}'.format(cols[i], fts_phrase(keyword))
+            else:
+                condition = '"{}" LIKE :{} ESCAPE {}'.format(cols[i], kw_name, "'\\'")
+                params[kw_name] = "%" + keyword + "%"
+
+            if i > 0:
+                where_sql += " {} ".format(logics[i - 1])
+            where_sql += condition
+        return 'FROM "FSAE47 Inventory" ', where_sql, params, False
+
+    def query_plan(self, sql: str, params: dict) -> list:
+        """
+        :return: the steps SQLite would take to run a query, from EXPLAIN QUERY PLAN, as strings
+        """
+        with self.connections.reader() as db_cur:
+            db_cur.execute("EXPLAIN QUERY PLAN " + sql, params)
+            return [row[3] for row in db_cur.fetchall()]
+
+    def interrupt_search(self, thread_id: int) -> None:
+        """
+        Cancels the search a thread is running, which then raises sqlite3.OperationalError
+        :param thread_id: threading.get_ident() of the thread
+        :return: None
+        """
+        self.connections.interrupt_reader(thread_id=thread_id)
+
+    def clear_caches(self) -> None:
+        self.item_cache.clear()
+        self.search_cache.clear()
+
+    def own_write_committed(self) -> None:
+        """
+        Clears the caches after a write from this instance. The data version is taken first, so the write isn't
+        taken for another instance's at the next check, while a write from another instance after it still is
+        :return: None
+        """
+        data_version = self.connections.external_data_version()
+        self.clear_caches()
+        self.data_version = data_version
+
+    def check_external_writes(self) -> None:
+        """
+        Clears the caches if another instance saved something since the last check
+        :return: None
+        """
+        data_version = self.connections.external_data_version()
+        if data_version != self.data_version:
+            self.data_version = data_version
+            self.clear_caches()
 
     def get_item_by_code(self, dmtx: bytes):
+        """
+        Looks up a record by its data matrix code, from the cache if it was looked up recently
+        :param dmtx: data matrix code of the item
+        :return: the ItemRecord, or None if not found
+        """
+        self.check_external_writes()
+        item = self.item_cache.get(dmtx)
+        if item is not None:
+            return item
+
+        generation = self.item_cache.generation
         get_sql = 'SELECT * FROM "FSAE47 Inventory" WHERE' \
               '"Dmtx Raw" = ?' \
               'LIMIT 1'
-        self.db_cur.execute(get_sql, (dmtx, ))
-        rows = self.db_cur.fetchall()
-        if len(rows) > 0:
-            return ItemRecord.from_db_row(db_row=rows[0])
-        else:
-            return None
+        with self.connections.reader() as db_cur:
+            db_cur.row_factory = item_row_factory
+            db_cur.execute(get_sql, (dmtx, ))
+            item = db_cur.fetchone()
+        if item is not None:
+            self.item_cache.put(key=dmtx, value=item, generation=generation)
+        return item
+
+    def get_full_item(self, item: ItemRecord):
+        """
+        Loads the rest of a record fetched for a list view, before it's opened
+        :param item: ItemRecord object from a search with summary=True, or a full record
+        :return: the full record, or None if it's been deleted since
+        """
+        if not item.is_summary:
+            return item
+        with self.connections.reader() as db_cur:
+            db_cur.row_factory = item_row_factory
+            db_cur.execute('SELECT *, rowid FROM "FSAE47 Inventory" WHERE rowid = ?', (item.rowid, ))
+            return db_cur.fetchone()
 
     def remove_component(self, dmtx: bytes) -> bool:
         """
@@ -299,33 +1317,144 @@ class DbInterface:
         :param dmtx:
         :return: True if the deletion was successful, False otherwise
         """
-        # check item presence
-        res = self.get_item_by_code(dmtx=dmtx)
-        if res is None:  # item not present
-            return False
-
         del_sql = 'DELETE FROM "FSAE47 Inventory" ' \
                   'WHERE "Dmtx Raw" = ?'
 
-        self.db_cur.execute(del_sql, (dmtx, ))
-        self.db_conn.commit()  # save changes
-        return True
+        with self.connections.writer() as db_cur:
+            # the stock leaves with the item, while its movements stay in the ledger
+            db_cur.execute(SET_QUANTITY_SQL, {"dmtx": dmtx, "qty": 0, "proj": None, "ts": int(time.time()),
+                                              "station": self.station, "reason": MOVEMENT_DELETE})
+            db_cur.execute(del_sql, (dmtx, ))
+            return db_cur.rowcount > 0  # nothing deleted if the item was not present
 
-    def get_all(self):
+    def get_all(self, cursor: tuple = None, page_size: int = SEARCH_PAGE_SIZE, summary: bool = False) -> SearchPage:
         """
-        Gets some entries from the DB for display
-        :return:
+        Gets entries from the DB for display, the newest first
+        :param cursor: continuation token from the previous page, None for the first page
+        :param page_size: maximum number of records in the page
+        :param summary: True to only fetch what list views show, see LIST_COLUMNS_SQL
+        :return: a page of results, as a SearchPage
+        """
+        return self.search_page(from_sql='FROM "FSAE47 Inventory" ',
+                                where_sql="",
+                                params={},
+                                ranked=False,
+                                cursor=cursor,
+                                page_size=page_size,
+                                summary=summary)
+
+    def iter_items(self, chunk_size: int = EXPORT_CHUNK_SIZE):
+        """
+        Streams every record out of the database, a chunk at a time, so exporting doesn't need the whole table in
+        memory. The records come from one read transaction, so saves made meanwhile are not included.
+        Holds a reader connection until the generator is exhausted or closed
+        :param chunk_size: records fetched at a time
+        :return: generator of lists of ItemRecord objects, in rowid order
+        """
+        with self.connections.reader() as db_cur:
+            db_cur.row_factory = item_row_factory
+            try:
+                db_cur.execute("BEGIN")  # the chunks come from the same snapshot, in any journal mode
+                db_cur.execute('SELECT *, rowid FROM "FSAE47 Inventory" ORDER BY rowid')
+                while True:
+                    items = db_cur.fetchmany(chunk_size)
+                    if len(items) == 0:
+                        break
+                    yield items
+            finally:
+                db_cur.execute("COMMIT")
+
+    def stage_scan(self, dmtx: bytes) -> bool:
+        """
+        Adds a scanned code to the intake staging table, to be looked up
+        :param dmtx: raw bytes in the data matrix code
+        :return: True if the code was added, False if it was already staged
+        """
+        with self.connections.writer() as db_cur:
+            db_cur.execute('INSERT OR IGNORE INTO "Intake Staging"("Dmtx Raw", "Status") VALUES(?, ?)',
+                           (dmtx, STAGING_PENDING))
+            return db_cur.rowcount > 0
+
+    def update_staged(self, dmtx: bytes, item: ItemRecord = None, error: str = "") -> None:
+        """
+        Stores the result of looking up a staged code
+        :param dmtx: raw bytes in the data matrix code
+        :param item: the item found, or None if the lookup failed
+        :param error: what went wrong if the lookup failed
+        :return: None
+        """
+        with self.connections.writer() as db_cur:
+            if item is None:
+                db_cur.execute('UPDATE "Intake Staging" SET "Status" = ?, "Error" = ? WHERE "Dmtx Raw" = ?',
+                               (STAGING_FAILED, error, dmtx))
+            else:
+                db_cur.execute('UPDATE "Intake Staging" SET '
+                               '"Name" = ?, "Supplier P/N" = ?, "Manufacturer P/N" = ?, "Location" = ?, '
+                               '"Quantity" = ?, "Category" = ?, "Description" = ?, "Supplier" = ?, '
+                               '"Manufacturer" = ?, "Used by Project" = ?, "Customer Ref" = ?, "Comment" = ?, '
+                               '"Status" = ?, "Error" = NULL '
+                               'WHERE "Dmtx Raw" = ?',
+                               (item.name,
+                                item.supplier_pn,
+                                item.manufacturer_pn,
+                                item.location,
+                                item.quantity,
+                                item.category,
+                                item.description,
+                                item.supplier,
+                                item.manufacturer,
+                                item.used_by_proj,
+                                item.customer_ref,
+                                item.comment,
+                                STAGING_RESOLVED,
+                                dmtx))
+
+    def get_staged(self) -> list:
+        """
+        :return: list of (ItemRecord, status, error message) for every staged code, in scanning order. Codes already
+                 in the inventory have the STAGING_IN_INVENTORY status, as commit_staged() leaves them out
+        """
+        with self.connections.reader() as db_cur:
+            db_cur.execute('SELECT "Intake Staging".*, "FSAE47 Inventory"."Dmtx Raw" IS NOT NULL '
+                           'FROM "Intake Staging" '
+                           'LEFT JOIN "FSAE47 Inventory" '
+                           'ON "FSAE47 Inventory"."Dmtx Raw" = "Intake Staging"."Dmtx Raw" '
+                           'ORDER BY "Intake Staging".rowid')
+            rows = db_cur.fetchall()
+        staged = []
+        for row in rows:
+            if row[15]:
+                staged += [(ItemRecord.from_db_row(db_row=row[:13]), STAGING_IN_INVENTORY,
+                            "Already in the inventory, scan it outside batch mode to edit it")]
+            else:
+                staged += [(ItemRecord.from_db_row(db_row=row[:13]), row[13], row[14])]
+        return staged
+
+    def remove_staged(self, dmtx: bytes) -> None:
+        with self.connections.writer() as db_cur:
+            db_cur.execute('DELETE FROM "Intake Staging" WHERE "Dmtx Raw" = ?', (dmtx, ))
+
+    def commit_staged(self, location: str) -> int:
+        """
+        Moves every resolved staged item into the inventory in one transaction, so either all of them are saved or
+        none are. Codes already in the inventory are left in the staging table, as the lookup only has the label's
+        details, which would overwrite what was entered for the item
+        :param location: where the items are stored
+        :return: number of items committed
         """
-        self.db_cur.execute('SELECT * '
-                            'FROM "FSAE47 Inventory" '
-                            'ORDER BY "_rowid_" DESC '
-                            'LIMIT 50')
-        rows = self.db_cur.fetchall()
-        return db_rows_to_itemrecords(db_rows=rows)
+        with self.connections.writer() as db_cur:  # rolled back on errors, leaving both tables as they were
+            db_cur.execute('SELECT * FROM "Intake Staging" WHERE "Status" = ? AND "Dmtx Raw" NOT IN '
+                           '(SELECT "Dmtx Raw" FROM "FSAE47 Inventory")', (STAGING_RESOLVED, ))
+            items = [ItemRecord.from_db_row(db_row=row[:13]) for row in db_cur.fetchall()]
+            for item in items:
+                item.location = location
+            self.insert_new_items(db_cur=db_cur, items=items)
+            db_cur.executemany('DELETE FROM "Intake Staging" WHERE "Dmtx Raw" = ?', [(item.dmtx, ) for item in items])
+        return len(items)
 
     def close(self) -> None:
         """
-        Closes the SQLite connection
+        Closes the SQLite connections
         :return:
         """
-        self.db_conn.close()
+        self.connections.close()
@@ -0,0 +1,212 @@
+"""
+Offline benchmark for the data matrix decoding path. Generates synthetic Digi-Key and Mouser style
+ECIA (ANSI MH10.8.2) codes at varied sizes, rotations, blur, noise and lighting, runs them through the same
+grayscale + decode functions as the scan pipeline, and reports the decode success rate and latency.
+No camera or GUI is needed. With --profiles, the frames are made at the resolution of each capture profile instead,
+to compare what each one costs in latency against how many codes it reads.
+
+Usage: python decode_benchmark.py [--count N] [--seed S] [--width W --height H] [--profiles]
+"""
+import argparse
+import random
+import time
+
+from pylibdmtx.pylibdmtx import encode
+from cv2 import cv2
+import numpy as np
+
+from scan_pipeline import to_gray, decode_gray, decode_gray_regions
+from dmtx_roi import RoiTracker
+from adaptive_decode import AdaptiveDecoder
+from ecia_label import GS, RS, EOT
+from capture_profile import CAPTURE_PROFILES
+
+
+def digikey_payload(rng: random.Random) -> bytes:
+    """
+    :return: the content of a Digi-Key bag label code, with random field values
+    """
+    dk_pn = "{}-{}-ND".format(rng.randint(100, 9999), rng.randint(1, 99))
+    fields = ["P" + dk_pn,
+              "1PRC0603FR-07{}KL".format(rng.randint(1, 999)),
+              "K",
+              "1K{}".format(rng.randint(10000000, 99999999)),
+              "10K{}".format(rng.randint(10000000, 99999999)),
+              "9D{:02d}{:02d}".format(rng.randint(18, 30), rng.randint(1, 52)),
+              "1T{}".format(rng.randint(100000, 999999)),
+              "11K1",
+              "4LTW",
+              "Q{}".format(rng.choice([1, 5, 10, 25, 100, 1000])),
+              "11ZPICK",
+              "12Z{}".format(rng.randint(1000000, 9999999)),
+              "13Z{}".format(rng.randint(100000, 999999)),
+              "20Z" + "0" * 60]
+    return ("[)>" + RS + "06" + GS + GS.join(fields) + RS + EOT).encode("ascii")
+
+
+def mouser_payload(rng: random.Random) -> bytes:
+    """
+    :return: the content of a Mouser bag label code, with random field values
+    """
+    fields = ["K{}".format(rng.randint(1000, 9999)),
+              "14K{:03d}".format(rng.randint(1, 99)),
+              "1PGRM188R71H{}KA01D".format(rng.randint(100, 999)),
+              "Q{}".format(rng.choice([1, 10, 50, 100])),
+              "11K{}".format(rng.randint(10000000, 99999999)),
+              "4LJP",
+              "1VMurata"]
+    return (">[)>" + RS + "06" + GS + GS.join(fields) + RS + EOT).encode("ascii")
+
+
+def render_code(payload: bytes) -> np.ndarray:
+    """
+    :return: the data matrix code as a grayscale image, one pixel per module plus the encoder's quiet zone
+    """
+    encoded = encode(payload)
+    rgb = np.frombuffer(encoded.pixels, np.uint8).reshape((encoded.height, encoded.width, encoded.bpp // 8))
+    return cv2.cvtColor(rgb, cv2.COLOR_RGB2GRAY)
+
+
+def synthetic_frame(payload: bytes, rng: random.Random, width: int, height: int) -> np.ndarray:
+    """
+    Places a code onto a cluttered background the way a bag would appear in front of the webcam
+    :return: BGR frame, like what the camera delivers
+    """
+    code = render_code(payload)
+    side = rng.randint(int(0.15 * height), int(0.6 * height))  # size of the code in the frame
+    code = cv2.resize(code, (side, side), interpolation=cv2.INTER_NEAREST)
+
+    # rotate with white corners, like the bag around the label
+    angle = rng.uniform(-45, 45)
+    diag = int(side * 1.5)
+    canvas = np.full((diag, diag), 255, np.uint8)
+    offset = (diag - side) // 2
+    canvas[offset:offset + side, offset:offset + side] = code
+    rotation = cv2.getRotationMatrix2D((diag / 2, diag / 2), angle, 1.0)
+    canvas = cv2.warpAffine(canvas, rotation, (diag, diag), borderValue=255)
+
+    # background with some printed text around, then the label somewhere in the frame
+    frame = np.full((height, width), rng.randint(90, 200), np.uint8)
+    for _ in range(4):
+        cv2.putText(frame, "RES 10K 1% 0603", (rng.randint(0, width // 2), rng.randint(20, height)),
+                    cv2.FONT_HERSHEY_SIMPLEX, rng.uniform(0.5, 1.2), rng.randint(0, 60), 2)
+    diag = min(diag, width, height)
+    canvas = canvas[:diag, :diag]
+    x = rng.randint(0, width - diag)
+    y = rng.randint(0, height - diag)
+    frame[y:y + diag, x:x + diag] = canvas
+
+    # focus, lighting and sensor noise
+    blur = rng.choice([0, 0, 3, 5])
+    if blur > 0:
+        frame = cv2.GaussianBlur(frame, (blur, blur), 0)
+    contrast = rng.uniform(0.5, 1.0)
+    brightness = rng.uniform(-40, 40)
+    gradient = np.linspace(rng.uniform(-40, 0), rng.uniform(0, 40), width)[np.newaxis, :]  # uneven lighting
+    noise = np.random.default_rng(rng.randint(0, 2 ** 32 - 1)).normal(0, rng.uniform(0, 12), frame.shape)
+    frame = ((frame - 128.) * contrast + 128 + brightness + gradient + noise).clip(0, 255).astype(np.uint8)
+    return cv2.cvtColor(frame, cv2.COLOR_GRAY2BGR)
+
+
+def iter_samples(count: int, seed: int, width: int, height: int):
+    """
+    :return: generator of (BGR frame, expected bytes), made one at a time so large frames don't fill the memory
+    """
+    rng = random.Random(seed)
+    for _ in range(count):
+        if rng.random() < 0.7:
+            payload = digikey_payload(rng)
+        else:
+            payload = mouser_payload(rng)
+        yield synthetic_frame(payload, rng, width, height), payload
+
+
+def make_samples(count: int, seed: int, width: int, height: int) -> list:
+    """
+    :return: list of (BGR frame, expected bytes)
+    """
+    return list(iter_samples(count, seed, width, height))
+
+
+def run_decoder(name: str, decode_frame, samples: list) -> dict:
+    """
+    Runs one decoding strategy over all the samples and prints its statistics
+    :param name: name of the strategy, for the report
+    :param decode_frame: function taking a BGR frame and returning the decoded bytes or None
+    :param samples: list or generator of (BGR frame, expected bytes)
+    :return: the statistics as a dictionary
+    """
+    latencies = []
+    successes = 0
+    for frame, expected in samples:
+        start = time.perf_counter()
+        result = decode_frame(frame)
+        latencies += [(time.perf_counter() - start) * 1000]
+        if result == expected:
+            successes += 1
+
+    latencies = np.array(latencies)
+    stats = {
+        "name": name,
+        "success_rate": successes / len(latencies),
+        "p50": float(np.percentile(latencies, 50)),
+        "p95": float(np.percentile(latencies, 95)),
+        "p99": float(np.percentile(latencies, 99)),
+        "fps": len(latencies) / (latencies.sum() / 1000),
+    }
+    print("{name:<12} success {success_rate:6.1%}  p50 {p50:6.1f} ms  p95 {p95:6.1f} ms  p99 {p99:6.1f} ms  "
+          "{fps:6.1f} frames/s".format(**stats))
+    return stats
+
+
+def compare_profiles(count: int, seed: int) -> None:
+    """
+    Decodes frames at the resolution of each capture profile, and estimates what the scan pipeline gets with it
+    :param count: number of frames per profile
+    :param seed: random seed, the same codes are used for each profile
+    :return: None
+    """
+    results = []
+    for profile in CAPTURE_PROFILES.values():
+        print("Decoding {} frames at {}x{}...".format(count, profile.width, profile.height))
+        samples = iter_samples(count, seed, profile.width, profile.height)
+        stats = run_decoder(profile.name, lambda frame: decode_gray_regions(to_gray(frame), roi_tracker=RoiTracker()),
+                            samples)
+        results += [(profile, stats)]
+
+    print("Profile       resolution     success  frames decoded/s  capture to result p50")
+    for profile, stats in results:
+        # the decoder can't go faster than the camera, and a frame waits in the driver's buffer before it's read
+        rate = min(profile.fps, stats["fps"])
+        latency = profile.buffer_size * 1000 / profile.fps + stats["p50"]
+        print("{:<12}  {:>4}x{:<4} {:>3g} fps {:6.1%}  {:16.1f}  {:18.1f} ms".format(
+            profile.name, profile.width, profile.height, profile.fps, stats["success_rate"], rate, latency))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the data matrix decoding path on synthetic frames")
+    parser.add_argument("--count", type=int, default=200, help="number of frames to generate")
+    parser.add_argument("--seed", type=int, default=47, help="random seed, for repeatable runs")
+    parser.add_argument("--width", type=int, default=640, help="frame width")
+    parser.add_argument("--height", type=int, default=480, help="frame height")
+    parser.add_argument("--profiles", action="store_true", help="compare the capture profiles instead")
+    args = parser.parse_args()
+
+    if args.profiles:
+        compare_profiles(args.count, args.seed)
+        return
+
+    print("Generating {} frames at {}x{}...".format(args.count, args.width, args.height))
+    samples = make_samples(args.count, args.seed, args.width, args.height)
+
+    # a new tracker per frame, as every sample is a different bag at a different place
+    run_decoder("full frame", lambda frame: decode_gray(to_gray(frame)), samples)
+    run_decoder("regions", lambda frame: decode_gray_regions(to_gray(frame), roi_tracker=RoiTracker()), samples)
+    # one decoder for all the frames, so it tunes itself as it goes, at the budget of the app's 15 fps
+    adaptive = AdaptiveDecoder(budget=1000. / 15)
+    run_decoder("adaptive", lambda frame: adaptive.decode(to_gray(frame)), samples)
+    print("adaptive settings at the end: {}".format(adaptive.settings()))
+
+
+if __name__ == "__main__":
+    main()
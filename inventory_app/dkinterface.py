@@ -6,10 +6,161 @@ import http.server
 import socketserver
 from urllib.parse import parse_qs, urlparse, urlencode
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import ssl
+import sqlite3
+import json
+import time
+import collections
 
 AUTH_RESP_PORT = 4443
 
+REQUEST_TIMEOUT = (5, 10)  # s, (connect, read) time limits for API requests
+MAX_RETRIES = 2  # retries for connection errors, 429 and 5xx responses
+RETRY_BACKOFF = 0.5  # s, waits 0.5, 1... between retries, unless the server says otherwise in Retry-After
+RETRY_AFTER_MAX = 5  # s, longest wait for a Retry-After header. With the limits above a request gives up in under 1 min
+POOL_SIZE = 8  # kept-alive connections, enough for concurrent lookups
+
+CACHE_FILENAME = "AppData/dk_cache.db"
+CACHE_TTL = 90 * 24 * 3600  # s, cached responses older than this are fetched again when online
+CACHE_MAX_ENTRIES = 10000  # least recently used responses are dropped beyond this
+
+
+class APIStats:
+    """
+    Latency and failure counts of the requests made to the Digi-Key API
+    """
+    def __init__(self, history: int = 100):
+        self.lock = threading.Lock()  # requests can be made from several threads
+        self.request_count = 0
+        self.failure_count = 0  # requests that raised or didn't get a 2xx response
+        self.latencies = collections.deque(maxlen=history)  # s, of the most recent requests
+
+    def record(self, latency: float, success: bool) -> None:
+        with self.lock:
+            self.request_count += 1
+            if not success:
+                self.failure_count += 1
+            self.latencies.append(latency)
+
+    def summary(self) -> dict:
+        """
+        :return: counts, and the mean and worst latency of the recent requests in ms
+        """
+        with self.lock:
+            latencies = sorted(self.latencies)
+            summary = {
+                "requests": self.request_count,
+                "failures": self.failure_count,
+                "mean_ms": 0.,
+                "max_ms": 0.,
+            }
+            if len(latencies) > 0:
+                summary["mean_ms"] = sum(latencies) / len(latencies) * 1000
+                summary["max_ms"] = latencies[-1] * 1000
+        return summary
+
+
+class ApiRetry(Retry):
+    """
+    Retry policy that doesn't wait longer than RETRY_AFTER_MAX when the server asks to with Retry-After, as a
+    throttled API can ask for minutes
+    """
+    def get_retry_after(self, response):
+        retry_after = super().get_retry_after(response)
+        if retry_after is None:
+            return None
+        return min(retry_after, RETRY_AFTER_MAX)
+
+
+def make_api_session() -> requests.Session:
+    """
+    Creates the HTTP session for the API. Connections are kept alive between requests, so only the first request
+    pays for the TCP and TLS handshakes. Idempotent requests are retried with backoff on connection errors,
+    429 and 5xx responses, honouring the Retry-After header up to RETRY_AFTER_MAX.
+    :return: the session
+    """
+    retry = ApiRetry(total=MAX_RETRIES,
+                     backoff_factor=RETRY_BACKOFF,
+                     status_forcelist=[429, 500, 502, 503, 504],
+                     respect_retry_after_header=True,
+                     raise_on_status=False)  # hand back the last response once out of retries
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=POOL_SIZE, max_retries=retry)
+    session = requests.Session()
+    session.mount("https://", adapter)
+    return session
+
+
+class LocalResponse:
+    """
+    Stands in for a requests Response when the API wasn't reached, either because the response came from the cache
+    or because the request failed
+    """
+    def __init__(self, text: str, status_code: int = 200):
+        self.text = text
+        self.status_code = status_code
+
+    def json(self):
+        return json.loads(self.text)
+
+
+class DKResponseCache:
+    """
+    Persistent cache of Product2DBarcode responses, keyed by the raw data matrix bytes. The same bag always decodes
+    to the same bytes, so scanning it again doesn't need another round trip to Digi-Key.
+    """
+    def __init__(self, filename: str = CACHE_FILENAME, ttl: int = CACHE_TTL, max_entries: int = CACHE_MAX_ENTRIES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.lock = threading.Lock()  # the connection is shared with the threads doing lookups
+        self.db_conn = sqlite3.connect(filename, check_same_thread=False)
+        # it's only a cache: losing the last few writes in a power cut is fine, waiting for the disk on every hit isn't
+        self.db_conn.execute("PRAGMA journal_mode=WAL")
+        self.db_conn.execute("PRAGMA synchronous=NORMAL")
+        self.db_conn.execute('CREATE TABLE IF NOT EXISTS "Product2DBarcode Cache" ('
+                             '"Dmtx Raw" BLOB NOT NULL PRIMARY KEY,'
+                             '"Response" TEXT NOT NULL,'
+                             '"Fetched" INTEGER NOT NULL,'  # unix timestamps
+                             '"Last Used" INTEGER NOT NULL'
+                             ');')
+        self.db_conn.execute('CREATE INDEX IF NOT EXISTS "Product2DBarcode Cache Last Used" '
+                             'ON "Product2DBarcode Cache"("Last Used")')
+        self.db_conn.commit()
+
+    def get(self, dmtx_bytes: bytes, allow_expired: bool = False):
+        """
+        :param dmtx_bytes: original data from the data matrix code
+        :param allow_expired: True to also return responses older than the TTL, e.g. when the API can't be reached
+        :return: the response text, or None if it's not in the cache
+        """
+        time_now = int(time.time())
+        with self.lock:
+            row = self.db_conn.execute('SELECT "Response", "Fetched" FROM "Product2DBarcode Cache" '
+                                       'WHERE "Dmtx Raw" = ?', (dmtx_bytes, )).fetchone()
+            if row is None:
+                return None
+            if not allow_expired and time_now - row[1] > self.ttl:
+                return None
+            self.db_conn.execute('UPDATE "Product2DBarcode Cache" SET "Last Used" = ? WHERE "Dmtx Raw" = ?',
+                                 (time_now, dmtx_bytes))
+            self.db_conn.commit()
+        return row[0]
+
+    def put(self, dmtx_bytes: bytes, response_text: str) -> None:
+        time_now = int(time.time())
+        with self.lock:
+            self.db_conn.execute('INSERT OR REPLACE INTO "Product2DBarcode Cache" VALUES(?, ?, ?, ?)',
+                                 (dmtx_bytes, response_text, time_now, time_now))
+            # expired entries are kept while there's room, as a fallback for when the API can't be reached
+            self.db_conn.execute('DELETE FROM "Product2DBarcode Cache" WHERE "Dmtx Raw" IN ('
+                                 'SELECT "Dmtx Raw" FROM "Product2DBarcode Cache" '
+                                 'ORDER BY "Last Used" DESC LIMIT -1 OFFSET ?)', (self.max_entries, ))
+            self.db_conn.commit()
+
+    def close(self) -> None:
+        self.db_conn.close()
+
 
 class DKAPIInterface:
     def __init__(self, auth_complete_callback=None):
@@ -37,6 +188,11 @@ class DKAPIInterface:
 
         self.PRODUCT2DBARCODE_URL = "https://api.digikey.com/Barcoding/v3/Product2DBarcodes/"
 
+        # pooled connections to the API, and statistics about the requests
+        self.session = make_api_session()
+        self.stats = APIStats()
+        self.token_lock = threading.Lock()
+
         # http server objects to serve the redirect URI at localhost
         self.http_handler = None
         self.http_thread = None
@@ -50,6 +206,9 @@ class DKAPIInterface:
         self.auth_valid = False
         self.refresh_valid = False
 
+        # responses of previous scans. Opened first, so they can be looked up even if the API can't be reached
+        self.response_cache = DKResponseCache()
+
         # try to read the config file
         self.config = configparser.ConfigParser()
         open_cfg_ret = self.config.read(self.CONFIG_FILENAME)
@@ -68,7 +227,10 @@ class DKAPIInterface:
             self.load_tokens()
 
             # check if the tokens are valid
-            self.check_access_token()
+            try:
+                self.check_access_token()
+            except requests.RequestException as e:  # offline, tried again on the next lookup
+                print("Could not refresh the access token, the Digi-Key API can't be reached: {}".format(e))
 
         # callback that gets called when the user authorisation is complete
         self.auth_complete_callback = auth_complete_callback
@@ -118,6 +280,23 @@ class DKAPIInterface:
         # start the user browser to begin the authorisation process
         webbrowser.open(self.AUTH_URL)
 
+    def api_request(self, method: str, url: str, **kwargs) -> requests.Response:
+        """
+        Makes a request through the pooled session, with time limits, and records it in the statistics
+        :param method: HTTP method
+        :param url: URL to request
+        :param kwargs: passed on to requests
+        :return: the response. Raises requests.RequestException if the API couldn't be reached
+        """
+        start = time.perf_counter()
+        try:
+            resp = self.session.request(method, url, timeout=REQUEST_TIMEOUT, **kwargs)
+        except requests.RequestException:
+            self.stats.record(latency=time.perf_counter() - start, success=False)
+            raise
+        self.stats.record(latency=time.perf_counter() - start, success=resp.ok)
+        return resp
+
     def get_access_token(self, auth_code: str):
         """
         Gets the access token from Digi-Key and stores them into the object attributes
@@ -139,9 +318,10 @@ class DKAPIInterface:
                                                          self.CLIENT_SECRET,
                                                          self.REDIRECT_URL)
         print("Requesting access token...")
-        access_resp = requests.post(url=self.ACCESS_URL,
-                                    headers={'Content-Type': 'application/x-www-form-urlencoded'},
-                                    data=req_str)
+        access_resp = self.api_request("POST",
+                                       url=self.ACCESS_URL,
+                                       headers={'Content-Type': 'application/x-www-form-urlencoded'},
+                                       data=req_str)
         if access_resp.status_code == 200:  # OK
             # extract and store tokens
             access_resp_json = access_resp.json()
@@ -183,9 +363,10 @@ class DKAPIInterface:
                                                     self.CLIENT_SECRET,
                                                     self.refresh_token)
         print("Requesting refresh token...")
-        refresh_resp = requests.post(url=self.ACCESS_URL,
-                                     headers={'Content-Type': 'application/x-www-form-urlencoded'},
-                                     data=req_str)
+        refresh_resp = self.api_request("POST",
+                                        url=self.ACCESS_URL,
+                                        headers={'Content-Type': 'application/x-www-form-urlencoded'},
+                                        data=req_str)
         if refresh_resp.status_code == 200:  # OK
             # extract and store tokens
             refresh_resp_json = refresh_resp.json()
@@ -232,7 +413,7 @@ class DKAPIInterface:
                 success, resp = self.refresh_access_token()
                 if not success:
                     print("Failed to refresh the access token! Full response:")
-                    print(resp.json())
+                    print(resp.text)  # not always JSON, e.g. from a proxy or an outage page
                 else:  # successfully refreshed token
                     print("Successfully refreshed the access token")
                     self.auth_valid = True
@@ -240,20 +421,42 @@ class DKAPIInterface:
             self.auth_valid = True
 
     def product_2d_barcode(self, dmtx_bytes: bytes):
-        success = False
-        self.check_access_token()
+        """
+        Looks up the product information of a Digi-Key data matrix code. Codes scanned before are answered from the
+        cache. If the API can't be reached or refuses the request, an expired cached response is used if there's one.
+        :param dmtx_bytes: original data from the data matrix code
+        :return: success: bool, True if the information was found
+                 resp: requests.models.Response, or a LocalResponse if the API wasn't reached
+        """
+        cached = self.response_cache.get(dmtx_bytes=dmtx_bytes)
+        if cached is not None:
+            return True, LocalResponse(text=cached)
 
+        success = False
         encoded_dmtx = urlencode([("", dmtx_bytes)])[1:]  # URL encode into an argument pair then trim out the "="
         url = "{}{}".format(self.PRODUCT2DBARCODE_URL,
                             encoded_dmtx)
-        barcode2d_resp = requests.get(url,
-                                      headers={
-                                          "accept": "application/json",
-                                          "Authorization": "Bearer {}".format(self.access_token),
-                                          "X-DIGIKEY-Client-Id": "{}".format(self.CLIENT_ID)
-                                      })
+        try:
+            with self.token_lock:  # lookups can run concurrently, but the token must only be refreshed once
+                self.check_access_token()
+            barcode2d_resp = self.api_request("GET",
+                                              url=url,
+                                              headers={
+                                                  "accept": "application/json",
+                                                  "Authorization": "Bearer {}".format(self.access_token),
+                                                  "X-DIGIKEY-Client-Id": "{}".format(self.CLIENT_ID)
+                                              })
+        except requests.RequestException as e:  # offline
+            barcode2d_resp = LocalResponse(text=str(e), status_code=0)
+
         if barcode2d_resp.status_code == 200:  # OK
             success = True
+            self.response_cache.put(dmtx_bytes=dmtx_bytes, response_text=barcode2d_resp.text)
+        else:  # rate limited, offline or otherwise failed
+            cached = self.response_cache.get(dmtx_bytes=dmtx_bytes, allow_expired=True)
+            if cached is not None:
+                print("Digi-Key API unavailable, using an expired cached response")
+                return True, LocalResponse(text=cached)
         return success, barcode2d_resp
 
 
@@ -0,0 +1,115 @@
+from cv2 import cv2
+import numpy as np
+
+DETECT_WIDTH = 320  # frames are shrunk to this width before looking for codes
+MAX_REGIONS = 3  # most candidate regions handed to the decoder per frame
+MIN_REGION_FRACTION = 0.02  # smallest candidate side, as a fraction of the shrunk frame width
+ROI_MARGIN = 0.2  # padding around a candidate, as a fraction of its size. The decoder needs the quiet zone
+ROI_KEEP_FRAMES = 10  # frames to keep trying the last successful region after it stops decoding
+
+
+def find_candidate_regions(gray, max_regions: int = MAX_REGIONS) -> list:
+    """
+    Finds square, high-contrast, densely textured regions in a frame that could be a data matrix code.
+    The frame is shrunk first, which is enough to find the code and keeps this to a couple of milliseconds.
+    :param gray: full resolution grayscale frame
+    :param max_regions: most regions to return
+    :return: list of (x, y, width, height) in full frame coordinates, the most promising first
+    """
+    frame_h, frame_w = gray.shape[:2]
+    scale = min(1.0, DETECT_WIDTH / frame_w)
+    small = cv2.resize(gray, (int(frame_w * scale), int(frame_h * scale)), interpolation=cv2.INTER_AREA)
+
+    # the modules of a code make lots of strong edges in every direction, the background mostly doesn't
+    kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (3, 3))
+    gradient = cv2.morphologyEx(small, cv2.MORPH_GRADIENT, kernel)
+    _, edges = cv2.threshold(gradient, 0, 255, cv2.THRESH_BINARY | cv2.THRESH_OTSU)
+
+    # merge the edges of neighbouring modules into solid blobs, and drop thin lines like text and bag edges
+    blobs = cv2.morphologyEx(edges, cv2.MORPH_CLOSE, cv2.getStructuringElement(cv2.MORPH_RECT, (7, 7)))
+    blobs = cv2.morphologyEx(blobs, cv2.MORPH_OPEN, cv2.getStructuringElement(cv2.MORPH_RECT, (5, 5)))
+
+    # [-2] picks the contours out of the return value in both OpenCV 3 and 4
+    contours = cv2.findContours(blobs, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)[-2]
+    min_side = MIN_REGION_FRACTION * small.shape[1]
+    scored = []
+    for contour in contours:
+        (_, _), (rect_w, rect_h), _ = cv2.minAreaRect(contour)  # rotated rectangle, codes can be at any angle
+        if rect_w < min_side or rect_h < min_side:
+            continue
+        if max(rect_w, rect_h) / min(rect_w, rect_h) > 1.6:  # data matrix codes on bags are square
+            continue
+        fill = cv2.contourArea(contour) / (rect_w * rect_h)
+        if fill < 0.6:  # the blob of a code is solid, not a ring or a scribble
+            continue
+
+        x, y, w, h = cv2.boundingRect(contour)
+        contrast = float(np.std(small[y:y + h, x:x + w]))
+        scored += [(fill * contrast * np.sqrt(rect_w * rect_h), (x, y, w, h))]
+
+    scored.sort(key=lambda candidate: candidate[0], reverse=True)
+    regions = []
+    for _, (x, y, w, h) in scored[:max_regions]:
+        regions += [expand_region((x / scale, y / scale, w / scale, h / scale), frame_w, frame_h)]
+    return regions
+
+
+def expand_region(region: tuple, frame_w: int, frame_h: int, margin: float = ROI_MARGIN) -> tuple:
+    """
+    Pads a region on every side and clips it to the frame
+    :param region: (x, y, width, height)
+    :param frame_w: width of the frame
+    :param frame_h: height of the frame
+    :param margin: padding on each side, as a fraction of the larger side of the region
+    :return: the padded region as integer (x, y, width, height)
+    """
+    x, y, w, h = region
+    pad = margin * max(w, h)
+    x0 = max(0, int(x - pad))
+    y0 = max(0, int(y - pad))
+    x1 = min(frame_w, int(x + w + pad))
+    y1 = min(frame_h, int(y + h + pad))
+    return x0, y0, x1 - x0, y1 - y0
+
+
+class RoiTracker:
+    """
+    Remembers where the last code was decoded. A bag held in front of the camera barely moves between frames,
+    so that region is tried first for the next few frames.
+    """
+    def __init__(self, keep_frames: int = ROI_KEEP_FRAMES):
+        self.keep_frames = keep_frames
+        self.last_region = None  # (x, y, width, height) of the last successful decode
+        self.tracked_region = None  # the padded last_region, as handed out for the current frame
+        self.misses = 0  # frames since the last region decoded
+
+    def candidate_regions(self, gray) -> list:
+        """
+        :param gray: full resolution grayscale frame
+        :return: regions worth decoding in this frame, the most promising first
+        """
+        regions = find_candidate_regions(gray)
+        self.tracked_region = None
+        if self.last_region is not None:
+            frame_h, frame_w = gray.shape[:2]
+            # allow for a bit of movement since the last frame
+            self.tracked_region = expand_region(self.last_region, frame_w, frame_h)
+            regions = [self.tracked_region] + regions
+        return regions
+
+    def hit(self, region: tuple) -> None:
+        """
+        :param region: the region from candidate_regions() that decoded
+        :return: None
+        """
+        if region != self.tracked_region:  # keep the original, so it doesn't grow by the padding every frame
+            self.last_region = region
+        self.misses = 0
+
+    def miss(self) -> None:
+        if self.last_region is None:
+            return
+        self.misses += 1
+        if self.misses > self.keep_frames:  # the code has moved away
+            self.last_region = None
+            self.misses = 0
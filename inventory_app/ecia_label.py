@@ -0,0 +1,116 @@
+"""
+Parses the content of ECIA (ANSI MH10.8.2) data matrix codes, as printed on Digi-Key, Mouser and most other
+distributor and manufacturer labels. The format envelope "[)>" RS "06" GS ... RS EOT holds fields separated by GS,
+each starting with a data identifier (DI): up to 3 digits and a letter, like "1P" for the supplier part number.
+
+Running this file benchmarks the parser: python ecia_label.py [--count N]
+"""
+import argparse
+import re
+import time
+
+GS = "\x1d"  # group separator, between fields
+RS = "\x1e"  # record separator, around the format envelope
+EOT = "\x04"
+FORMAT_HEADER = "[)>" + RS + "06"  # format 06, the data identifiers of MH10.8.2
+
+# every field in one pass: the GS, the data identifier, and the value up to the next separator
+FIELD_RE = re.compile(GS + r"(\d{0,3}[A-Z])([^" + GS + RS + EOT + r"]*)")
+
+# data identifiers and the EciaLabel attributes they fill in
+DI_ATTRIBUTES = {
+    "P": "customer_pn",  # Digi-Key puts the customer reference here, or its own part number if there's none
+    "1P": "manufacturer_pn",  # "supplier part number" in the standard, the manufacturer P/N on distributor labels
+    "30P": "supplier_pn",  # Digi-Key part number on newer labels
+    "Q": "quantity",
+    "K": "customer_po",
+    "1K": "sales_order",
+    "10K": "invoice",
+    "11K": "packing_list",
+    "14K": "line_item",
+    "9D": "date_code",
+    "10D": "date_code",
+    "1T": "lot_code",
+    "4L": "country",
+    "1V": "manufacturer",
+}
+
+
+class EciaLabel:
+    """
+    The fields of an ECIA label code. The ones not on the label are empty strings, or None for the quantity
+    """
+    __slots__ = ["customer_pn", "manufacturer_pn", "supplier_pn", "quantity", "customer_po", "sales_order",
+                 "invoice", "packing_list", "line_item", "date_code", "lot_code", "country", "manufacturer",
+                 "fields", "is_ecia"]
+
+    def __init__(self):
+        self.customer_pn: str = ""
+        self.manufacturer_pn: str = ""
+        self.supplier_pn: str = ""
+        self.quantity: int = None
+        self.customer_po: str = ""
+        self.sales_order: str = ""
+        self.invoice: str = ""
+        self.packing_list: str = ""
+        self.line_item: str = ""
+        self.date_code: str = ""
+        self.lot_code: str = ""
+        self.country: str = ""
+        self.manufacturer: str = ""
+        self.fields: dict = {}  # every field on the label by data identifier, including the ones not listed above
+        self.is_ecia: bool = False  # False if the code isn't in the ECIA format, and nothing was filled in
+
+
+def parse_label(dmtx_bytes: bytes) -> EciaLabel:
+    """
+    Splits the code into its fields in one pass. Fields missing from the label are left empty
+    :param dmtx_bytes: original data from the data matrix code
+    :return: the EciaLabel
+    """
+    label = EciaLabel()
+    data = dmtx_bytes.decode("latin-1")  # any byte decodes, the fields are ASCII
+    header = data.find(FORMAT_HEADER)  # Mouser puts a ">" in front
+    if header < 0:
+        return label
+
+    label.is_ecia = True
+    label.fields = dict(FIELD_RE.findall(data, header + len(FORMAT_HEADER)))
+    for di, value in label.fields.items():
+        attribute = DI_ATTRIBUTES.get(di)
+        if attribute is not None:
+            setattr(label, attribute, value)
+    if isinstance(label.quantity, str):
+        try:
+            label.quantity = int(label.quantity)
+        except ValueError:
+            label.quantity = None
+    return label
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the ECIA label parser")
+    parser.add_argument("--count", type=int, default=100000, help="number of codes to parse")
+    args = parser.parse_args()
+
+    samples = [
+        # Digi-Key
+        ("[)>" + RS + "06" + GS + GS.join(["P311-10.0KHRCT-ND", "1PRC0603FR-0710KL", "K", "1K67134321",
+                                           "10K80123456", "9D2145", "1T123456", "11K1", "4LTW", "Q100", "11ZPICK",
+                                           "12Z1234567", "13Z123456", "20Z" + "0" * 60]) + RS + EOT).encode(),
+        # Mouser
+        (">[)>" + RS + "06" + GS + GS.join(["K1234", "14K001", "1PGRM188R71H104KA01D", "Q50", "11K12345678",
+                                            "4LJP", "1VMurata"]) + RS + EOT).encode(),
+        # generic, with fields missing
+        ("[)>" + RS + "06" + GS + GS.join(["1PLM358DR", "Q2500", "1T7A12B"]) + RS + EOT).encode(),
+    ]
+    codes = [samples[i % len(samples)] for i in range(args.count)]
+    start = time.perf_counter()
+    for code in codes:
+        parse_label(code)
+    elapsed = time.perf_counter() - start
+    print("Parsed {} codes in {:.3f} s, {:.0f} codes/s".format(args.count, elapsed, args.count / elapsed))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,209 @@
+"""
+Exports the whole inventory to a file and imports it back, streaming the records a chunk at a time so the memory
+used stays the same however big the table is. CSV and JSON Lines are supported, and Parquet if pyarrow is installed.
+Importing saves the records in batches, adding the new ones and updating the ones already present by data matrix code.
+The data matrix code is written as hex, as it holds control characters.
+
+Usage: python inventory_io.py export|import FILE [--format csv|jsonl|parquet] [--chunk N]
+"""
+import argparse
+import csv
+import json
+import time
+
+from dbinterface import DbInterface, ItemRecord, SEARCH_COLUMNS, EXPORT_CHUNK_SIZE
+
+FILE_COLUMNS = SEARCH_COLUMNS + ["Dmtx Raw"]  # columns of the exported files, in table order
+FORMATS = ["csv", "jsonl", "parquet"]
+PROGRESS_INTERVAL = 1.  # s, between progress reports
+
+
+class Progress:
+    """
+    Counts the records processed and prints the rate every PROGRESS_INTERVAL seconds
+    """
+    def __init__(self, action: str, interval: float = PROGRESS_INTERVAL):
+        self.action = action  # "Exported" or "Imported", for the report
+        self.interval = interval
+        self.rows = 0
+        self.start = time.perf_counter()
+        self.last_report = self.start
+
+    def update(self, rows: int) -> None:
+        self.rows += rows
+        now = time.perf_counter()
+        if now - self.last_report >= self.interval:
+            self.last_report = now
+            self.report()
+
+    def rows_per_second(self) -> float:
+        elapsed = time.perf_counter() - self.start
+        if elapsed <= 0:
+            return 0.
+        return self.rows / elapsed
+
+    def report(self) -> None:
+        print("{} {} records, {:.0f} records/s".format(self.action, self.rows, self.rows_per_second()))
+
+
+def detect_format(filename: str) -> str:
+    """
+    :return: one of FORMATS, from the file extension
+    """
+    extension = filename.lower().rsplit(".", 1)[-1]
+    if extension in ["json", "jsonl", "ndjson"]:
+        return "jsonl"
+    if extension in ["parquet", "pq"]:
+        return "parquet"
+    return "csv"
+
+
+def item_to_values(item: ItemRecord) -> list:
+    """
+    :return: the values of the record in FILE_COLUMNS order, with the data matrix code in hex
+    """
+    values = list(item.to_db_row())
+    values[-1] = (item.dmtx or b"").hex()
+    return values
+
+
+def item_from_values(values: dict) -> ItemRecord:
+    """
+    :param values: the values of a record read from a file, by FILE_COLUMNS name. Missing columns are left empty
+    :return: the ItemRecord, ready to save
+    """
+    dmtx = bytes.fromhex(values.get("Dmtx Raw") or "")
+    quantity = values.get("Quantity")
+    return ItemRecord(has_dmtx=(dmtx != b""),
+                      name=values.get("Name") or "",
+                      pn=values.get("Supplier P/N") or "",
+                      mfg_pn=values.get("Manufacturer P/N") or "",
+                      loc=values.get("Location") or "",
+                      qty=int(quantity) if quantity not in [None, ""] else 0,
+                      cat=values.get("Category") or "",
+                      desc=values.get("Description") or "",
+                      supplier=values.get("Supplier") or "",
+                      manufacturer=values.get("Manufacturer") or "",
+                      proj=values.get("Used by Project") or "",
+                      cust_ref=values.get("Customer Ref") or "",
+                      comment=values.get("Comment") or "",
+                      dmtx=dmtx)
+
+
+def import_pyarrow():
+    """
+    :return: the pyarrow and pyarrow.parquet modules, only needed for Parquet files
+    """
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError:
+        raise ImportError("Parquet files need pyarrow, install it with: pip install pyarrow")
+    return pyarrow, pyarrow.parquet
+
+
+def export_inventory(db: DbInterface, filename: str, file_format: str = None,
+                     chunk_size: int = EXPORT_CHUNK_SIZE) -> int:
+    """
+    Writes every record into a file, a chunk at a time
+    :param db: the inventory
+    :param filename: the file to write, overwritten if present
+    :param file_format: one of FORMATS, None to go by the file extension
+    :param chunk_size: records held in memory at a time
+    :return: number of records exported
+    """
+    if file_format is None:
+        file_format = detect_format(filename)
+    progress = Progress("Exported")
+
+    if file_format == "parquet":
+        pyarrow, parquet = import_pyarrow()
+        schema = pyarrow.schema([(col, pyarrow.int64() if col == "Quantity" else pyarrow.string())
+                                 for col in FILE_COLUMNS])
+        with parquet.ParquetWriter(filename, schema) as writer:
+            for items in db.iter_items(chunk_size=chunk_size):
+                columns = list(zip(*[item_to_values(item) for item in items]))
+                writer.write_table(pyarrow.Table.from_arrays([pyarrow.array(column, type=field.type)
+                                                              for column, field in zip(columns, schema)],
+                                                             schema=schema))
+                progress.update(len(items))
+    else:
+        with open(filename, "w", newline="", encoding="utf-8") as f_out:
+            if file_format == "csv":
+                csv_writer = csv.writer(f_out)
+                csv_writer.writerow(FILE_COLUMNS)
+            for items in db.iter_items(chunk_size=chunk_size):
+                if file_format == "csv":
+                    csv_writer.writerows(item_to_values(item) for item in items)
+                else:
+                    f_out.writelines(json.dumps(dict(zip(FILE_COLUMNS, item_to_values(item)))) + "\n"
+                                     for item in items)
+                progress.update(len(items))
+    progress.report()
+    return progress.rows
+
+
+def read_chunks(filename: str, file_format: str, chunk_size: int):
+    """
+    :return: generator of lists of ItemRecord objects read from the file, chunk_size at a time
+    """
+    if file_format == "parquet":
+        _, parquet = import_pyarrow()
+        for batch in parquet.ParquetFile(filename).iter_batches(batch_size=chunk_size):
+            yield [item_from_values(values) for values in batch.to_pylist()]
+        return
+
+    with open(filename, newline="", encoding="utf-8-sig") as f_in:
+        if file_format == "csv":
+            rows = csv.DictReader(f_in)
+        else:
+            rows = (json.loads(line) for line in f_in if line.strip() != "")
+        chunk = []
+        for values in rows:
+            chunk += [item_from_values(values)]
+            if len(chunk) >= chunk_size:
+                yield chunk
+                chunk = []
+        if len(chunk) > 0:
+            yield chunk
+
+
+def import_inventory(db: DbInterface, filename: str, file_format: str = None,
+                     chunk_size: int = EXPORT_CHUNK_SIZE) -> int:
+    """
+    Saves the records in a file into the database, a chunk per transaction. Records with a data matrix code already
+    in the database update it, the others are added. If a chunk fails, the chunks before it stay saved
+    :param db: the inventory
+    :param filename: file written by export_inventory(), or in the same columns
+    :param file_format: one of FORMATS, None to go by the file extension
+    :param chunk_size: records saved per transaction
+    :return: number of records imported
+    """
+    if file_format is None:
+        file_format = detect_format(filename)
+    progress = Progress("Imported")
+    for items in read_chunks(filename, file_format=file_format, chunk_size=chunk_size):
+        progress.update(db.bulk_upsert(items))
+    progress.report()
+    return progress.rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export the inventory to a file, or import it from one")
+    parser.add_argument("action", choices=["export", "import"])
+    parser.add_argument("file", help="CSV, JSON Lines or Parquet file")
+    parser.add_argument("--format", choices=FORMATS, help="file format, by default from the file extension")
+    parser.add_argument("--chunk", type=int, default=EXPORT_CHUNK_SIZE, help="records processed at a time")
+    args = parser.parse_args()
+
+    db = DbInterface()
+    db.connect()
+    if args.action == "export":
+        export_inventory(db, args.file, file_format=args.format, chunk_size=args.chunk)
+    else:
+        import_inventory(db, args.file, file_format=args.format, chunk_size=args.chunk)
+    db.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+import sqlite3
+import threading
+import time
+
+SEARCH_DEBOUNCE = 0.15  # s, typing has to pause for this long before a search is run
+
+
+class LiveSearch:
+    """
+    Runs the search for a text box as the user types, on a worker thread so typing never waits for the database.
+    The search starts once typing pauses for SEARCH_DEBOUNCE seconds, and a search still running when the text
+    changes again is cancelled. Results that are already cached are shown straight away, without the pause.
+    """
+    def __init__(self, search, cached, interrupt, on_results, debounce: float = SEARCH_DEBOUNCE):
+        """
+        :param search: function taking the keyword and returning the first page of results. Called from the worker
+        :param cached: function taking the keyword and returning the first page if it's cached, None otherwise
+        :param interrupt: function taking a thread id and cancelling the query that thread is running
+        :param on_results: function taking (keyword, page). Called from the worker thread, so GUI code should pass it
+                           on with wx.CallAfter. Only called for the newest keyword
+        :param debounce: s, pause in typing before searching
+        """
+        self.search = search
+        self.cached = cached
+        self.interrupt = interrupt
+        self.on_results = on_results
+        self.debounce = debounce
+
+        self.condition = threading.Condition()
+        self.pending = None  # keyword waiting to be searched
+        self.pending_time = 0.  # time.monotonic() the pending keyword was typed
+        self.searching = None  # keyword being searched
+        self.stopping = False
+        self.thread = threading.Thread(target=self.search_loop, name="search", daemon=True)
+        self.thread.start()
+
+    def update(self, keyword: str) -> None:
+        """
+        Called when the text changes
+        :param keyword: the new text
+        :return: None
+        """
+        with self.condition:
+            self.pending = keyword
+            self.pending_time = time.monotonic()
+            if self.searching is not None and self.searching != keyword:  # superseded
+                self.interrupt(self.thread.ident)
+            self.condition.notify()
+
+    def stop(self) -> None:
+        with self.condition:
+            self.stopping = True
+            self.pending = None
+            if self.searching is not None:
+                self.interrupt(self.thread.ident)
+            self.condition.notify()
+        self.thread.join()
+
+    def search_loop(self) -> None:
+        while True:
+            with self.condition:
+                while not self.stopping and self.pending is None:
+                    self.condition.wait()
+                if self.stopping:
+                    return
+                keyword = self.pending
+
+            page = self.cached(keyword)  # outside the lock, as it may wait for the database
+            with self.condition:
+                if self.pending != keyword:  # changed meanwhile
+                    continue
+                if page is None:
+                    remaining = self.pending_time + self.debounce - time.monotonic()
+                    if remaining > 0:  # still typing
+                        self.condition.wait(timeout=remaining)
+                        continue
+                self.pending = None
+                self.searching = keyword
+
+            try:
+                if page is None:
+                    page = self.search(keyword)
+            except sqlite3.OperationalError:  # interrupted by the next keyword, or the database is busy
+                page = None
+            finally:
+                with self.condition:
+                    self.searching = None
+                    superseded = self.pending is not None
+
+            if page is not None and not superseded:
+                self.on_results(keyword, page)
@@ -0,0 +1,99 @@
+import wx
+import wx.grid
+
+from dbinterface import ItemRecord, SearchPage
+
+# (column label, ItemRecord attribute) for each column of the results grid
+RESULTS_COLUMNS = [("Name", "name"),
+                   ("Supplier P/N", "supplier_pn"),
+                   ("Manufacturer P/N", "manufacturer_pn"),
+                   ("Location", "location"),
+                   ("Quantity", "quantity"),
+                   ("Category", "category"),
+                   ("Description", "description"),
+                   ("Supplier", "supplier"),
+                   ("Manufacturer", "manufacturer"),
+                   ("Used by Project", "used_by_proj"),
+                   ("Customer Ref", "customer_ref"),
+                   ("Comment", "comment")]
+
+
+class ResultsGridTable(wx.grid.GridTableBase):
+    """
+    Virtual table behind the search results grid. The grid only asks for the cells it is drawing, so nothing is
+    done for rows that are never shown. The next page of the search is fetched when the last loaded row is drawn.
+    """
+    def __init__(self):
+        wx.grid.GridTableBase.__init__(self)
+        self.items = []  # ItemRecord objects loaded so far
+        self.cursor = None  # continuation token for the next page, None if everything is loaded
+        self.next_page = None  # function taking the cursor and returning the next SearchPage
+        self.loading = False  # True when fetching the next page has been scheduled
+
+    def GetNumberRows(self):
+        return len(self.items)
+
+    def GetNumberCols(self):
+        return len(RESULTS_COLUMNS)
+
+    def GetColLabelValue(self, col):
+        return RESULTS_COLUMNS[col][0]
+
+    def IsEmptyCell(self, row, col):
+        return False
+
+    def GetValue(self, row, col):
+        if row >= len(self.items) - 1 and self.cursor is not None and not self.loading:
+            # the end of the loaded results is being drawn. Changing the row count during drawing isn't allowed,
+            # so fetch the next page afterwards
+            self.loading = True
+            wx.CallAfter(self.load_more)
+        return str(getattr(self.items[row], RESULTS_COLUMNS[col][1]))
+
+    def SetValue(self, row, col, value):
+        pass  # the grid is read-only, edits go through the scan/edit tab
+
+    def get_item(self, row: int) -> ItemRecord:
+        return self.items[row]
+
+    def set_results(self, page: SearchPage, next_page) -> None:
+        """
+        Replaces the contents of the table with the first page of a new search
+        :param page: the first page of the search results
+        :param next_page: function taking a continuation token and returning the next page of the same search
+        :return: None
+        """
+        old_row_count = len(self.items)
+        self.items = list(page.items)
+        self.cursor = page.cursor
+        self.next_page = next_page
+        self.loading = False
+
+        grid = self.GetView()
+        if grid is not None:
+            grid.BeginBatch()
+            if old_row_count > 0:
+                grid.ProcessTableMessage(wx.grid.GridTableMessage(self, wx.grid.GRIDTABLE_NOTIFY_ROWS_DELETED,
+                                                                  0, old_row_count))
+            if len(self.items) > 0:
+                grid.ProcessTableMessage(wx.grid.GridTableMessage(self, wx.grid.GRIDTABLE_NOTIFY_ROWS_APPENDED,
+                                                                  len(self.items)))
+            grid.EndBatch()
+
+    def load_more(self) -> None:
+        """
+        Fetches the next page of the current search and appends it to the table
+        :return: None
+        """
+        self.loading = False
+        if self.cursor is None:  # a new search may have started since this was scheduled
+            return
+
+        page = self.next_page(self.cursor)
+        self.cursor = page.cursor
+        self.items += page.items
+
+        grid = self.GetView()
+        if grid is not None and len(page.items) > 0:
+            grid.ProcessTableMessage(wx.grid.GridTableMessage(self, wx.grid.GRIDTABLE_NOTIFY_ROWS_APPENDED,
+                                                              len(page.items)))
@@ -0,0 +1,181 @@
+import threading
+import queue
+import time
+
+from pylibdmtx.pylibdmtx import decode
+from cv2 import cv2
+
+from dmtx_roi import RoiTracker
+from adaptive_decode import AdaptiveDecoder
+
+DECODE_TIMEOUT = 50  # ms, time limit for each decoding attempt
+SCAN_DEBOUNCE = 2.  # s, the same code is ignored until it has been out of view for this long
+
+
+def to_gray(frame):
+    """
+    Converts a camera frame to grayscale, which seems to work the best for decoding compared to coloured and B&W
+    :param frame: BGR frame from OpenCV
+    :return: the grayscale frame
+    """
+    return cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+
+
+def decode_gray(gray, timeout: int = DECODE_TIMEOUT):
+    """
+    Looks for a data matrix code in a grayscale frame. Doesn't need a GUI or a camera, so it can be run headless.
+    :param gray: grayscale frame
+    :param timeout: time limit for decoding, in ms
+    :return: the raw bytes in the code, or None if no code was found
+    """
+    data_raw = decode(gray, timeout=timeout, max_count=1)
+    if len(data_raw) > 0:  # got a string
+        return data_raw[0].data
+    return None
+
+
+def decode_gray_regions(gray, roi_tracker: RoiTracker, timeout: int = DECODE_TIMEOUT):
+    """
+    Looks for a data matrix code only in the parts of the frame that look like one, instead of making the decoder
+    search the whole frame. The regions share the time limit, the most promising first.
+    :param gray: grayscale frame
+    :param roi_tracker: keeps track of where the code was found in the previous frames
+    :param timeout: time limit for decoding all the regions, in ms
+    :return: the raw bytes in the code, or None if no code was found
+    """
+    deadline = time.perf_counter() + timeout / 1000
+    regions = roi_tracker.candidate_regions(gray)
+    if len(regions) == 0:  # nothing stands out, fall back to searching the whole frame
+        return decode_gray(gray, timeout=timeout)
+
+    for region in regions:
+        remaining = int((deadline - time.perf_counter()) * 1000)
+        if remaining <= 0:
+            break
+        x, y, w, h = region
+        dmtx_bytes = decode_gray(gray[y:y + h, x:x + w], timeout=remaining)
+        if dmtx_bytes is not None:
+            roi_tracker.hit(region)
+            return dmtx_bytes
+    roi_tracker.miss()
+    return None
+
+
+class ScanPipeline:
+    """
+    Captures and decodes camera frames on worker threads, so the GUI thread only has to draw them.
+    The capture thread keeps reading the camera and hands the newest frame to the decode thread through a queue
+    holding a single frame, so the decoder never works on a stale frame and the capture never waits for it.
+    Decoding pauses after each successful read until resume_decoding() is called. A bag left in front of the camera
+    is not read again until it has been out of view for SCAN_DEBOUNCE seconds.
+    """
+    def __init__(self, camera_cap, on_decoded, frame_budget: float = DECODE_TIMEOUT,
+                 debounce: float = SCAN_DEBOUNCE):
+        """
+        :param camera_cap: opened cv2.VideoCapture object. The pipeline doesn't release it
+        :param on_decoded: function taking the decoded bytes. Called from the decode thread, so GUI code should
+                           pass it on with wx.CallAfter
+        :param frame_budget: ms the decoder can spend on each frame, 1000 / frame rate to keep up with the camera
+        :param debounce: s, time the last code has to be out of view before it's read again
+        """
+        self.camera_cap = camera_cap
+        self.on_decoded = on_decoded
+
+        self.frame_queue = queue.Queue(maxsize=1)  # frames waiting to be decoded, only the newest one is kept
+        self.latest_frame = None  # newest grayscale frame, for display
+        self.frame_lock = threading.Lock()
+
+        self.decoder = AdaptiveDecoder(budget=frame_budget)  # only used by the decode thread
+
+        self.debounce = debounce
+        self.last_code = None  # the last code passed on
+        self.last_seen = 0.  # time.monotonic() the last code was last decoded, or decoding resumed
+
+        self.running = threading.Event()
+        self.decoding = threading.Event()  # cleared while decoding is paused
+        self.capture_thread = None
+        self.decode_thread = None
+
+    def start(self) -> None:
+        self.running.set()
+        self.decoding.set()
+        self.capture_thread = threading.Thread(target=self.capture_loop, daemon=True)
+        self.decode_thread = threading.Thread(target=self.decode_loop, daemon=True)
+        self.capture_thread.start()
+        self.decode_thread.start()
+
+    def stop(self) -> None:
+        """
+        Stops both threads and waits for them to finish, after which the camera can be released
+        :return: None
+        """
+        self.running.clear()
+        self.decoding.clear()
+        if self.capture_thread is not None:
+            self.capture_thread.join()
+        if self.decode_thread is not None:
+            self.decode_thread.join()
+        self.capture_thread = None
+        self.decode_thread = None
+
+    def pause_decoding(self) -> None:
+        self.decoding.clear()
+
+    def resume_decoding(self) -> None:
+        self.drop_queued_frame()  # anything queued was captured before resuming
+        self.last_seen = time.monotonic()  # the bag may still be in view, give it time to be taken away
+        self.decoding.set()
+
+    def get_latest_frame(self):
+        """
+        :return: the newest grayscale frame from the camera, or None if there's none yet
+        """
+        with self.frame_lock:
+            return self.latest_frame
+
+    def drop_queued_frame(self) -> None:
+        try:
+            self.frame_queue.get_nowait()
+        except queue.Empty:
+            pass
+
+    def capture_loop(self) -> None:
+        while self.running.is_set():
+            ret, frame = self.camera_cap.read()  # blocks until the camera delivers a frame
+            if not ret:
+                print("Failed to read the camera frame...")
+                time.sleep(0.1)  # don't spin on a disconnected camera
+                continue
+
+            gray = to_gray(frame)
+            with self.frame_lock:
+                self.latest_frame = gray
+
+            if self.decoding.is_set():
+                # replace the frame waiting for the decoder, if it hasn't been picked up yet
+                self.drop_queued_frame()
+                try:
+                    self.frame_queue.put_nowait(gray)
+                except queue.Full:  # the decode thread can't put frames back, but just in case
+                    pass
+
+    def decode_loop(self) -> None:
+        while self.running.is_set():
+            try:
+                gray = self.frame_queue.get(timeout=0.1)  # time out to check if the pipeline is stopped
+            except queue.Empty:
+                continue
+            if not self.decoding.is_set():  # paused after the frame was queued
+                continue
+
+            dmtx_bytes = self.decoder.decode(gray)
+            if dmtx_bytes is None or not self.decoding.is_set():
+                continue
+            now = time.monotonic()
+            if dmtx_bytes == self.last_code and now - self.last_seen < self.debounce:
+                self.last_seen = now  # still in view
+                continue
+            self.last_code = dmtx_bytes
+            self.last_seen = now
+            self.decoding.clear()  # wait for the current code to be dealt with
+            self.on_decoded(dmtx_bytes)
@@ -0,0 +1,159 @@
+"""
+Measures how long the app takes to get its window up, phase by phase. By default it runs headless: the startup steps
+InventoryFrame runs that don't need the GUI, from app_startup.py, so it works without a display. --gui builds the
+real window. Either way it runs in a temporary folder with a copy of AppData, so the real database and settings are
+never opened.
+The modules imported only when the camera or the Digi-Key API is first used are timed separately, and flagged if
+anything on the startup path imported them early.
+
+Usage: python startup_benchmark.py [--gui] [--db FILE]
+"""
+import argparse
+import glob
+import importlib
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+APP_DATA_DIR = "AppData"
+# read from the working folder by the GUI and the Digi-Key API
+RESOURCE_PATTERNS = ["*.png", "*.ico", "*.pem", "*.html"]
+# imported on first use rather than at startup
+DEFERRED_MODULES = ["numpy", "cv2", "pylibdmtx.pylibdmtx", "requests"]
+
+
+def timed(phases: list, name: str, function):
+    """
+    Runs one phase and records how long it took
+    :param phases: list of (name, seconds) to add to
+    :param name: name of the phase, for the report
+    :param function: function taking no arguments
+    :return: what the function returned
+    """
+    start = time.perf_counter()
+    result = function()
+    phases += [(name, time.perf_counter() - start)]
+    return result
+
+
+def copy_database(source: str, destination: str) -> None:
+    """
+    Copies a SQLite file through the backup API, so the changes still in its WAL file come along
+    """
+    source_conn = sqlite3.connect("file:{}?mode=ro".format(source), uri=True)
+    destination_conn = sqlite3.connect(destination)
+    try:
+        source_conn.backup(destination_conn)
+    finally:
+        destination_conn.close()
+        source_conn.close()
+
+
+def copy_app_data(work_dir: str, db_filename: str) -> None:
+    """
+    Copies what the app reads at startup into a folder to run it in
+    :param work_dir: the folder, empty
+    :param db_filename: inventory database to copy in place of DB_FILENAME
+    :return: None
+    """
+    from dbinterface import DB_FILENAME
+
+    for pattern in RESOURCE_PATTERNS:
+        for filename in glob.glob(os.path.join(APP_DIR, pattern)):
+            shutil.copy2(filename, work_dir)
+
+    os.makedirs(os.path.join(work_dir, APP_DATA_DIR))
+    app_data = os.path.join(APP_DIR, APP_DATA_DIR)
+    for filename in glob.glob(os.path.join(app_data, "*")):
+        name = os.path.basename(filename)
+        if not os.path.isfile(filename) or name.endswith(("-wal", "-shm", "-journal")):  # backups, or in the copies
+            continue
+        if name.endswith(".db"):
+            if os.path.join(APP_DATA_DIR, name) != os.path.normpath(DB_FILENAME):
+                copy_database(filename, os.path.join(work_dir, APP_DATA_DIR, name))
+        else:
+            shutil.copy2(filename, os.path.join(work_dir, APP_DATA_DIR))
+
+    if os.path.isfile(db_filename):
+        copy_database(db_filename, os.path.join(work_dir, DB_FILENAME))
+    else:
+        print("{} not found, starting with a new database".format(db_filename))
+
+
+def headless_startup(phases: list) -> None:
+    from app_startup import connect_database, start_backup_service, first_results_page, start_live_search
+
+    db = timed(phases, "connect database", connect_database)
+    backup_service = timed(phases, "start backup service", start_backup_service)
+    timed(phases, "first results page", lambda: first_results_page(db))
+    live_search = timed(phases, "start search worker", lambda: start_live_search(db, on_results=lambda *_: None))
+    live_search.stop()
+    backup_service.stop()
+    db.close()
+
+
+def gui_startup(phases: list) -> None:
+    import wx
+    from Electrons_inventory import InventoryFrame
+
+    app = timed(phases, "create wx.App", lambda: wx.App(False))
+    frame = timed(phases, "build main window", lambda: InventoryFrame(None, wx.ID_ANY, ""))
+    timed(phases, "show main window", lambda: (frame.Show(), app.Yield()))
+    frame.Close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure the time to the first window, by phase")
+    parser.add_argument("--gui", action="store_true", help="build the real window, needs a display")
+    parser.add_argument("--db", help="database to start with, copied first. By default the app's own")
+    args = parser.parse_args()
+
+    # the imports don't depend on the working folder, so they're timed before the copy is made
+    phases = []
+    if args.gui:
+        timed(phases, "import wx and the GUI", lambda: importlib.import_module("Electrons_inventory"))
+    else:
+        timed(phases, "import database modules", lambda: [importlib.import_module(name) for name in
+                                                          ["app_startup", "batch_intake"]])
+    from dbinterface import DB_FILENAME
+
+    # the app opens its files relative to the working folder, so it runs in the copy
+    sys.path.insert(0, APP_DIR)
+    work_dir = tempfile.mkdtemp(prefix="startup_benchmark_")
+    copy_app_data(work_dir=work_dir, db_filename=args.db or os.path.join(APP_DIR, DB_FILENAME))
+    cwd = os.getcwd()
+    os.chdir(work_dir)
+    try:
+        if args.gui:
+            gui_startup(phases)
+        else:
+            headless_startup(phases)
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(work_dir, ignore_errors=True)
+    total = sum(seconds for _, seconds in phases)
+
+    print("Time to first window{}:".format("" if args.gui else " (headless)"))
+    for name, seconds in phases:
+        print("  {:<28} {:8.1f} ms  {:5.1%}".format(name, seconds * 1000, seconds / total))
+    print("  {:<28} {:8.1f} ms".format("total", total * 1000))
+
+    print("Deferred until first use:")
+    for name in DEFERRED_MODULES:
+        if name in sys.modules:
+            print("  {:<28} already imported during startup!".format(name))
+            continue
+        try:
+            seconds = []
+            timed(seconds, name, lambda: importlib.import_module(name))
+            print("  {:<28} {:8.1f} ms".format("import " + name, seconds[0][1] * 1000))
+        except Exception as e:  # not installed, or its native library is missing
+            print("  {:<28} not available: {}".format("import " + name, e))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,20 @@
+import os
+import sys
+
+import pytest
+
+# the app's modules import each other by name, as when run from inventory_app
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "inventory_app"))
+
+from dbinterface import DbInterface  # noqa: E402
+
+
+@pytest.fixture
+def db(tmp_path):
+    """
+    :return: DbInterface connected to a new, empty database
+    """
+    db = DbInterface()
+    db.connect(filename=str(tmp_path / "inventory.db"))
+    yield db
+    db.close()
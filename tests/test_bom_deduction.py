@@ -0,0 +1,33 @@
+from bom_deduction import BomLine, match_bom, deduct_bom, shared_records
+from dbinterface import ItemRecord
+
+
+def add_bag(db, dmtx: bytes, quantity: int):
+    db.add_component(ItemRecord(has_dmtx=True, pn="311-10.0KHRCT-ND", mfg_pn="RC0603FR-0710KL", qty=quantity,
+                                dmtx=dmtx))
+
+
+def test_lines_matching_the_same_record_share_its_stock(db):
+    add_bag(db, b"BAG1", 10)
+    lines = [BomLine(line_number=1, quantity=6, manufacturer_pn="RC0603FR-0710KL"),
+             BomLine(line_number=2, quantity=6, supplier_pn="311-10.0KHRCT-ND")]
+    matches = match_bom(db=db, lines=lines)
+
+    assert sorted(match.shortfall for match in matches) == [0, 2]
+    [(group, required, in_stock)] = shared_records(matches)
+    assert [match.line.line_number for match in group] == [1, 2]
+    assert (required, in_stock) == (12, 10)
+    assert not deduct_bom(db=db, matches=matches, project=None)
+    assert db.get_item_by_code(dmtx=b"BAG1").quantity == 10
+
+
+def test_shared_records_deducted_together(db):
+    add_bag(db, b"BAG1", 10)
+    add_bag(db, b"BAG2", 4)
+    lines = [BomLine(line_number=1, quantity=6, manufacturer_pn="RC0603FR-0710KL"),
+             BomLine(line_number=2, quantity=2, supplier_pn="311-10.0KHRTR-ND")]
+    matches = match_bom(db=db, lines=lines, builds=1)
+
+    assert [match.shortfall for match in matches] == [0, 0]
+    assert deduct_bom(db=db, matches=matches, project=None)
+    assert db.get_item_by_code(dmtx=b"BAG1").quantity + db.get_item_by_code(dmtx=b"BAG2").quantity == 6
@@ -0,0 +1,140 @@
+import threading
+import time
+
+import pytest
+
+import dbinterface
+from dbinterface import DbInterface, ItemRecord, MOVEMENT_ADD
+
+
+def test_search_does_not_wait_for_writer(db):
+    db.add_component(ItemRecord(has_dmtx=False, name="Resistor", qty=5))
+    writing = threading.Event()
+
+    def long_write():
+        with db.connections.writer():
+            writing.set()
+            time.sleep(1.)
+
+    thread = threading.Thread(target=long_write)
+    thread.start()
+    writing.wait()
+    start = time.perf_counter()
+    page = db.basic_search(keyword="Resistor")
+    elapsed = time.perf_counter() - start
+    thread.join()
+    assert [item.name for item in page.items] == ["Resistor"]
+    assert elapsed < 0.5
+
+
+def test_caches_cleared_by_other_instance_writes(db, tmp_path):
+    db.add_component(ItemRecord(has_dmtx=True, name="Before", qty=5, dmtx=b"CODE"))
+    assert db.get_item_by_code(dmtx=b"CODE").name == "Before"
+    generation = db.item_cache.generation
+    db.check_external_writes()  # this instance's own write doesn't count as another's
+    assert db.item_cache.generation == generation
+
+    other = DbInterface()
+    other.connect(filename=db.connections.filename)
+    item = other.get_item_by_code(dmtx=b"CODE")
+    item.name = "After"
+    other.update_component(item)
+    other.close()
+    assert db.get_item_by_code(dmtx=b"CODE").name == "After"
+
+
+def test_adjust_quantity_rejects_zero(db):
+    db.add_component(ItemRecord(has_dmtx=True, name="Resistor", qty=5, dmtx=b"CODE"))
+    with pytest.raises(ValueError):
+        db.adjust_quantity(dmtx=b"CODE", delta=0)
+    assert db.adjust_quantity(dmtx=b"CODE", delta=-2) == 3
+    with db.connections.reader() as db_cur:
+        db_cur.execute('SELECT "Delta" FROM "Stock Movements" WHERE "Reason" != ?', (MOVEMENT_ADD, ))
+        assert db_cur.fetchall() == [(-2, )]
+
+
+def test_first_page_estimates_the_total(db, monkeypatch):
+    db.bulk_upsert([ItemRecord(has_dmtx=False, name="Resistor {}".format(i), qty=1) for i in range(30)])
+    page = db.advanced_search(cols=["Name"], inputs=["Resistor*"], logics=[], page_size=10)
+    assert (page.total_estimate, page.total_is_exact, page.describe_total()) == (30, True, "30 results")
+    assert db.advanced_search(cols=["Name"], inputs=["Resistor*"], logics=[], cursor=page.cursor,
+                              page_size=10).total_estimate is None
+
+    monkeypatch.setattr(dbinterface, "COUNT_ESTIMATE_CAP", 20)
+    page = db.advanced_search(cols=["Name"], inputs=["Resistor*"], logics=[], page_size=10)
+    assert page.describe_total() == "20+ results"
+
+
+def test_quantity_changes_leave_the_index_alone(db):
+    db.add_component(ItemRecord(has_dmtx=True, name="Resistor", qty=5, dmtx=b"CODE"))
+    with db.connections.reader() as db_cur:
+        db_cur.execute('PRAGMA table_info("FSAE47 Inventory FTS")')
+        assert "Quantity" not in [row[1] for row in db_cur.fetchall()]
+        db_cur.execute("SELECT sql FROM sqlite_master WHERE name = 'FSAE47 Inventory FTS update'")
+        assert '"Quantity"' not in db_cur.fetchone()[0]
+    assert db.advanced_search(cols=["Quantity"], inputs=['"5"'], logics=[]).total_estimate == 1
+
+
+def test_index_with_quantity_is_rebuilt(db):
+    db.add_component(ItemRecord(has_dmtx=True, name="Resistor", qty=5, dmtx=b"CODE"))
+    filename = db.connections.filename
+    with db.connections.writer() as db_cur:  # the index as it was built before
+        for trigger in ["insert", "delete", "update"]:
+            db_cur.execute('DROP TRIGGER "FSAE47 Inventory FTS {}"'.format(trigger))
+        db_cur.execute('DROP TABLE "FSAE47 Inventory FTS"')
+        db_cur.execute('CREATE VIRTUAL TABLE "FSAE47 Inventory FTS" USING fts5({}, content="FSAE47 Inventory", '
+                       'content_rowid="rowid", tokenize="trigram")'.format(
+                           ", ".join('"{}"'.format(col) for col in dbinterface.SEARCH_COLUMNS)))
+    db.close()
+
+    db = DbInterface()
+    db.connect(filename=filename)
+    with db.connections.reader() as db_cur:
+        db_cur.execute('PRAGMA table_info("FSAE47 Inventory FTS")')
+        assert [row[1] for row in db_cur.fetchall()] == dbinterface.FTS_COLUMNS
+    assert [item.name for item in db.basic_search(keyword="esist").items] == ["Resistor"]
+    db.close()
+
+
+def test_bulk_upsert_saves_nothing_without_serial_counter(db):
+    with db.connections.writer() as db_cur:
+        db_cur.execute('DELETE FROM "DB_CFG" WHERE "key" = \'dmtx_ser\'')
+    items = [ItemRecord(has_dmtx=True, name="Bag", qty=1, dmtx=b"0000042"), ItemRecord(has_dmtx=False, name="Loose")]
+    assert db.bulk_upsert(items) == 0
+    assert db.get_all().items == []
+    with db.connections.reader() as db_cur:
+        db_cur.execute('SELECT count(*) FROM "DB_CFG"')
+        assert db_cur.fetchone()[0] == 0
+
+
+def test_bulk_upsert_adds_new_items_at_their_quantity(db):
+    db.bulk_upsert([ItemRecord(has_dmtx=True, name="Bag", qty=5, dmtx=b"ABC-1"),
+                    ItemRecord(has_dmtx=True, name="Bag again", qty=7, dmtx=b"ABC-1"),
+                    ItemRecord(has_dmtx=False, name="Loose", qty=3)])
+    with db.connections.reader() as db_cur:
+        db_cur.execute('SELECT "Dmtx Raw", "Quantity" FROM "FSAE47 Inventory"')
+        quantities = dict(db_cur.fetchall())
+        db_cur.execute('SELECT "Dmtx Raw", "Delta", "Balance" FROM "Stock Movements" ORDER BY rowid')
+        movements = db_cur.fetchall()
+    loose = next(dmtx for dmtx in quantities if dmtx != b"ABC-1")
+    assert quantities == {b"ABC-1": 7, loose: 3}
+    assert movements == [(loose, 3, 3), (b"ABC-1", 5, 5), (b"ABC-1", 2, 7)]
+
+
+def test_bulk_upsert_rate(db):
+    # well below what a laptop does, so it only fails if new items go back to being written twice
+    count = 5000
+    items = [ItemRecord(has_dmtx=True, name="Resistor {}".format(i), qty=10, dmtx="R{:06d}".format(i).encode(),
+                        desc="RES 10K OHM 1% 1/10W 0603") for i in range(count)]
+    start = time.perf_counter()
+    assert db.bulk_upsert(items) == count
+    rate = count / (time.perf_counter() - start)
+    assert rate > 2000, "bulk_upsert added {:.0f} rows per second".format(rate)
+
+
+def test_barcodes_in_digits_are_not_taken_for_serials(db):
+    db.bulk_upsert([ItemRecord(has_dmtx=True, name="Scanned UPC", qty=1, dmtx=b"012345678905"),
+                    ItemRecord(has_dmtx=True, name="Exported", qty=1, dmtx=b"0000042")])
+    with db.connections.reader() as db_cur:
+        db_cur.execute('SELECT "value" FROM "DB_CFG" WHERE "key" = \'dmtx_ser\'')
+        assert int(db_cur.fetchone()[0]) == 43
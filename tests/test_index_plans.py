@@ -0,0 +1,20 @@
+import pytest
+
+from dbinterface import INDEXED_COLUMNS
+
+SEARCHES = [([col], [term], []) for col in INDEXED_COLUMNS for term in ['"A01"', "A01*"]] + [
+    ([INDEXED_COLUMNS[0], INDEXED_COLUMNS[2]], ['"296-1234-1-ND"', "A*"], ["AND"]),
+    ([INDEXED_COLUMNS[1], INDEXED_COLUMNS[0]], ["RC0603*", "311-*"], ["OR"]),
+]
+
+
+@pytest.mark.parametrize("cursor", [None, (None, 1000)], ids=["first page", "next page"])
+@pytest.mark.parametrize("cols, inputs, logics", SEARCHES)
+def test_exact_and_prefix_searches_use_index(db, cols, inputs, logics, cursor):
+    from_sql, where_sql, params, ranked = db.advanced_search_query(cols=cols, inputs=inputs, logics=logics)
+    page_sql, page_params = db.search_page_sql(from_sql=from_sql, where_sql=where_sql, params=params, ranked=ranked,
+                                               cursor=cursor)
+    plan = db.query_plan(sql=page_sql, params=page_params)
+    # older SQLite versions say SCAN TABLE
+    table_scans = [step for step in plan if step.replace("SCAN TABLE ", "SCAN ").startswith("SCAN FSAE47 Inventory")]
+    assert table_scans == [], plan
@@ -0,0 +1,27 @@
+from dbinterface import DbInterface, ItemRecord
+from inventory_io import export_inventory, import_inventory
+
+
+def test_import_moves_serials_past_imported_ones(db, tmp_path):
+    source = DbInterface()
+    source.connect(filename=str(tmp_path / "source.db"))
+    source.add_component(ItemRecord(has_dmtx=False, name="A0", qty=5))
+    source.add_component(ItemRecord(has_dmtx=False, name="A1", qty=6))
+    source.add_component(ItemRecord(has_dmtx=True, name="Bag", qty=7, dmtx=b"[)>\x1e06\x1dPBAG"))
+    export_inventory(source, str(tmp_path / "inventory.csv"))
+    source.close()
+
+    assert import_inventory(db, str(tmp_path / "inventory.csv")) == 3
+
+    new_item = ItemRecord(has_dmtx=False, name="New", qty=1)
+    db.add_component(new_item)
+    assert new_item.dmtx == b"0000002"
+    assert db.get_item_by_code(dmtx=b"0000000").name == "A0"
+    assert db.get_item_by_code(dmtx=b"0000001").name == "A1"
+
+    # items without a code in the file get numbers after the imported ones too
+    with open(str(tmp_path / "more.csv"), "w", encoding="utf-8") as f_out:
+        f_out.write("Name,Quantity,Dmtx Raw\nOld,1,{}\nNo code,2,\n".format(b"0000009".hex()))
+    assert import_inventory(db, str(tmp_path / "more.csv")) == 2
+    assert db.get_item_by_code(dmtx=b"0000010").name == "No code"
+    assert db.get_item_by_code(dmtx=b"0000002").name == "New"